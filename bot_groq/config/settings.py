@@ -112,6 +112,8 @@ class Settings(BaseSettings):
     idle_chime_cooldown: int = Field(600, description="Пауза между 'напоминаниями о себе' (секунды)")
     idle_check_every: int = Field(600, description="Как часто проверять тишину в чатах (секунды)")
     idle_enabled: bool = Field(True, description="Включить авто-сообщения при длительной тишине")
+    coalesce_window_sec: float = Field(1.5, description="Окно склейки пачки сообщений в чате перед генерацией (секунды, 0 – выключено)")
+    coalesce_max_window_sec: float = Field(4.0, description="Максимальное адаптивное окно склейки при активной переписке (секунды)")
 
     # --- Контекст и память ---
     history_turns: int = Field(20, description="Количество последних сообщений в контексте")
@@ -125,6 +127,41 @@ class Settings(BaseSettings):
     
     # --- База данных ---
     db_name: str = Field("bot.db", description="Имя файла базы данных SQLite")
+    db_read_pool_size: int = Field(4, description="Размер пула read-only соединений веб-панели")
+    rollup_hourly_retention_hours: int = Field(48, description="Сколько часов хранить почасовые роллапы до сжатия в суточные")
+    db_maintenance_enabled: bool = Field(False, description="Периодические PRAGMA optimize / ANALYZE / VACUUM базы бота в задаче очистки")
+    rollup_compact_every: int = Field(3600, description="Как часто сжимать почасовые роллапы (секунды)")
+    reports_dir: str = Field("reports", description="Каталог для готовых отчётов веб-панели")
+    report_workers: int = Field(2, description="Сколько отчётов строится одновременно")
+    report_ttl_hours: int = Field(24, description="Сколько часов хранить готовый отчёт (и отдавать его повторно при тех же параметрах)")
+
+    # --- Ограничение частоты ---
+    rate_limit_enabled: bool = Field(True, description="Отсекать флуд до обработчиков, которые ходят в LLM")
+    rate_limit_user_per_minute: int = Field(20, description="Сообщений в минуту от одного пользователя (допускается всплеск до лимита)")
+    rate_limit_chat_per_minute: int = Field(60, description="Сообщений в минуту в одном чате (допускается всплеск до лимита)")
+    rate_limit_max_keys: int = Field(10_000, description="Сколько пользователей/чатов помнит ограничитель (LRU)")
+    ban_cache_ttl: int = Field(30, description="Как часто бот перечитывает баны из веб-панели (секунды)")
+
+    # --- Медиа ---
+    media_download_max_bytes: int = Field(10_000_000, description="Жёсткий лимит размера скачиваемого медиафайла (байт)")
+    media_download_timeout: int = Field(30, description="Таймаут скачивания медиафайла (секунды)")
+    vision_image_max_bytes: int = Field(3_000_000, description="Бюджет размера фото для vision: берётся самый крупный вариант не больше него (байт)")
+    vision_target_side: int = Field(800, description="Целевое разрешение фото для vision по длинной стороне (пикселей): больше не скачивается и не отправляется")
+    vision_upload_max_bytes: int = Field(300_000, description="Бюджет размера фото, отправляемого в vision-модель (байт); больше – пережимается")
+    vision_image_format: str = Field("jpeg", description="Формат пережатого фото для vision: jpeg или webp")
+    vision_cache_ttl_hours: int = Field(168, description="Сколько хранить описание картинки в кэше vision (часы)")
+    vision_max_concurrency: int = Field(2, description="Сколько фото одновременно обрабатывает vision-конвейер")
+    vision_queue_size: int = Field(8, description="Сколько фото может ждать очереди vision; лишние отбрасываются")
+    vision_queue_max_wait: int = Field(60, description="Фото, прождавшее очередь дольше (секунды), отбрасывается")
+    vision_stale_messages: int = Field(15, description="Фото отбрасывается, если пока оно ждало очереди, в чате прошло больше сообщений")
+    vision_request_timeout: int = Field(45, description="Таймаут одного запроса к vision-модели (секунды)")
+    vision_breaker_failures: int = Field(3, description="Ошибок подряд, после которых vision-модель временно пропускается")
+    vision_breaker_cooldown: int = Field(120, description="На сколько пропускать сбойную vision-модель (секунды)")
+    vision_comment_model: str = Field("llama-3.1-8b-instant", description="Дешёвая текстовая модель для комментария к описанию картинки")
+
+    # --- Веб-панель ---
+    live_feed_interval: float = Field(2.0, description="Период пересчёта метрик для живой ленты дашборда (секунды)")
+    live_feed_keepalive: int = Field(15, description="Пинг в пустой живой ленте, чтобы прокси не рвали соединение (секунды)")
 
     # --- Environment settings ---
     environment: str = Field("development", description="Среда выполнения")
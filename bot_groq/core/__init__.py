@@ -19,7 +19,26 @@ from .relations import (
 from .style_analysis import (
     style_analyzer,
     analyze_user_style,
-    get_style_adaptation_prompt
+    get_style_adaptation_prompt,
+    update_user_style_state,
+    get_style_adaptation_prompt_from_state
+)
+
+from .triggers import (
+    trigger_matcher,
+    scan_triggers,
+    TriggerHits
+)
+
+from .coalescer import (
+    message_coalescer,
+    Burst
+)
+
+from .terms import (
+    term_stats,
+    tokenize,
+    SpaceSaving
 )
 
 __all__ = [
@@ -37,5 +56,21 @@ __all__ = [
     # Анализ стиля
     "style_analyzer",
     "analyze_user_style",
-    "get_style_adaptation_prompt"
+    "get_style_adaptation_prompt",
+    "update_user_style_state",
+    "get_style_adaptation_prompt_from_state",
+    
+    # Матчер триггеров
+    "trigger_matcher",
+    "scan_triggers",
+    "TriggerHits",
+    
+    # Склейка пачек сообщений
+    "message_coalescer",
+    "Burst",
+    
+    # Частоты слов
+    "term_stats",
+    "tokenize",
+    "SpaceSaving"
 ]
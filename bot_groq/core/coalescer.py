@@ -0,0 +1,172 @@
+"""
+Склейка пачек сообщений в чате перед генерацией ответа.
+
+В активных группах люди пишут по 3-5 коротких сообщений подряд. Вместо
+отдельного LLM-запроса на каждое сообщение ждём короткое (адаптивное) окно,
+собираем пачку и отвечаем один раз на последнее сообщение с учётом всех
+остальных. Если пока шла генерация в чат прилетели новые сообщения, на
+которые ответит более свежая пачка, – ответ считается устаревшим и не
+отправляется. Сообщения без повода ответить его не отменяют.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from aiogram.types import Message
+
+from bot_groq.config.settings import settings
+
+# Чем раньше в списке, тем «сильнее» повод ответить.
+# Пачка наследует самую сильную причину из своих сообщений.
+REASON_PRIORITY = [
+    "direct_mention",
+    "reply_to_bot",
+    "keyword_trigger",
+    "question_to_bot",
+    "private_chat",
+    "random_response",
+]
+
+# Состояние чата, где давно тихо и ничего не копится, забываем
+IDLE_STATE_TTL = 600.0
+
+@dataclass
+class Burst:
+    """Пачка сообщений, на которую бот отвечает одной генерацией."""
+    chat_id: int
+    seq: int
+    messages: List[Message]
+    reason: str
+
+    @property
+    def latest(self) -> Message:
+        return self.messages[-1]
+
+@dataclass
+class _ChatState:
+    """Состояние окна склейки одного чата."""
+    seq: int = 0
+    pending: List[Message] = field(default_factory=list)
+    reason: Optional[str] = None
+    last_arrival: float = 0.0
+    gap_ema: Optional[float] = None
+    answer_seq: int = 0   # seq последней пачки, ушедшей в генерацию
+
+def _stronger(a: Optional[str], b: Optional[str]) -> Optional[str]:
+    """Возвращает более приоритетную причину ответа."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    rank = {r: i for i, r in enumerate(REASON_PRIORITY)}
+    return a if rank.get(a, len(rank)) <= rank.get(b, len(rank)) else b
+
+class MessageCoalescer:
+    """Per-chat debounce: собирает близкие по времени сообщения в одну пачку."""
+
+    def __init__(self, gap_alpha: float = 0.3):
+        self.gap_alpha = gap_alpha
+        self._chats: Dict[int, _ChatState] = {}
+        self._last_sweep = time.time()
+
+        # Статистика
+        self.stats = {
+            "messages": 0,
+            "bursts": 0,
+            "merged": 0,
+            "stale_dropped": 0,
+        }
+
+    def _window_for(self, state: _ChatState) -> float:
+        """Адаптивное окно: в спокойном чате – базовое, в перепалке – растёт до максимума."""
+        base = max(0.0, float(settings.coalesce_window_sec))
+        upper = max(base, float(settings.coalesce_max_window_sec))
+        if state.gap_ema is None or state.gap_ema >= upper:
+            return base
+        return min(upper, max(base, state.gap_ema * 1.5))
+
+    def _note_arrival(self, state: _ChatState, now: float):
+        if state.last_arrival:
+            gap = now - state.last_arrival
+            if state.gap_ema is None:
+                state.gap_ema = gap
+            else:
+                state.gap_ema = self.gap_alpha * gap + (1 - self.gap_alpha) * state.gap_ema
+        state.last_arrival = now
+
+    async def collect(self, message: Message, reason: Optional[str]) -> Optional[Burst]:
+        """Регистрирует сообщение и ждёт окно склейки.
+
+        Возвращает пачку только для последнего сообщения в окне и только если
+        хотя бы одно сообщение пачки было поводом ответить. Остальные вызовы
+        получают None – за них ответит последний.
+        """
+        chat_id = message.chat.id
+        now = time.time()
+        if now - self._last_sweep >= IDLE_STATE_TTL:
+            self._evict_idle(now)
+        state = self._chats.setdefault(chat_id, _ChatState())
+        self._note_arrival(state, now)
+        state.seq += 1
+        my_seq = state.seq
+        state.pending.append(message)
+        state.reason = _stronger(state.reason, reason)
+        self.stats["messages"] += 1
+
+        window = self._window_for(state)
+        if window > 0:
+            await asyncio.sleep(window)
+
+        if state.seq != my_seq:
+            # Пришло что-то новее – оно и заберёт пачку
+            return None
+
+        messages, burst_reason = state.pending, state.reason
+        state.pending, state.reason = [], None
+        if not burst_reason:
+            return None
+
+        state.answer_seq = my_seq
+        self.stats["bursts"] += 1
+        self.stats["merged"] += len(messages) - 1
+        return Burst(chat_id=chat_id, seq=my_seq, messages=messages, reason=burst_reason)
+
+    def _evict_idle(self, now: float):
+        """Забывает чаты, где ничего не копится и давно не было сообщений."""
+        self._last_sweep = now
+        cutoff = now - IDLE_STATE_TTL
+        for chat_id in [cid for cid, st in self._chats.items() if not st.pending and st.last_arrival < cutoff]:
+            del self._chats[chat_id]
+
+    def is_stale(self, burst: Burst) -> bool:
+        """True, если на сообщения, пришедшие после сбора пачки, ответит более свежая пачка.
+
+        Свежая пачка либо уже ушла в генерацию, либо ещё копится, но в ней
+        есть повод ответить. Сообщения без повода ответ не отменяют.
+        """
+        state = self._chats.get(burst.chat_id)
+        if state is None or state.seq == burst.seq:
+            return False
+        return state.answer_seq > burst.seq or (bool(state.pending) and state.reason is not None)
+
+    def drop_stale(self, burst: Burst):
+        """Отбрасывает устаревшую генерацию.
+
+        Если новая пачка ещё копится – возвращаем в неё сообщения, чтобы
+        следующий ответ учёл и их. Иначе просто забываем.
+        """
+        self.stats["stale_dropped"] += 1
+        state = self._chats.get(burst.chat_id)
+        if state is None or not state.pending:
+            return
+        state.pending = burst.messages + state.pending
+        state.reason = _stronger(state.reason, burst.reason)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Возвращает статистику склейки."""
+        return {**self.stats, "tracked_chats": len(self._chats)}
+
+# Глобальный экземпляр
+message_coalescer = MessageCoalescer()
@@ -4,8 +4,9 @@ import time
 from typing import Dict, List, Any, Optional
 from aiogram.types import Message, User
 
-from bot_groq.config.settings import settings
 from bot_groq.services.database import db_load_person, db_save_person
+from bot_groq.core.triggers import TriggerHits, scan_triggers
+from bot_groq.core.style_analysis import update_user_style_state
 
 # Профиль пользователя по умолчанию
 DEFAULT_PROFILE = {
@@ -20,9 +21,11 @@ DEFAULT_PROFILE = {
     "username": "", "display_name": ""
 }
 
-# Словари для анализа текста
-PROFANITY = {"бля", "блять", "сука", "нах", "нахуй", "хуй", "пизд", "еба", "ебл", "мраз", "чмо", "ссан", "говн", "твар", "дур", "идиот", "лох", "мудак", "падла"}
-ADDRESS_TOKENS = {"бро", "брат", "братан", "дружище", "леха", "лёха", "лешка", "лёшка", "бот", "батя", "кореш", "сынок", "шеф", "царь", "друг"}
+_NAME_RE = re.compile(r"(?:меня зовут|зови меня)\s+([a-zа-я]{3,20})")
+_LIKES_RE = re.compile(r"(?:люблю|нравится|кайфую от)\s+([^.,!?\n]{1,30})")
+_DISLIKES_RE = re.compile(r"(?:не люблю|бесит|ненавижу)\s+([^.,!?\n]{1,30})")
+_AGE_RE = re.compile(r"мне\s+(\d{1,2})\s*(?:лет|года|год)?")
+_HEIGHT_RE = re.compile(r"(?:мой\s+)?рост\s+(\d{2,3})")
 
 def _push_unique(lst: list, val: str, cap: int = 20):
     """Добавляет уникальное значение в список с ограничением размера."""
@@ -33,7 +36,7 @@ def _push_unique(lst: list, val: str, cap: int = 20):
         if len(lst) > cap: 
             del lst[0]
 
-def _tone_delta(txt: str) -> float:
+def _tone_delta(txt: str, hits: Optional[TriggerHits] = None) -> float:
     """Вычисляет изменение тона на основе текста."""
     low = (txt or "").lower()
     good = ["спасибо", "круто", "топ", "люблю", "ахах", "лол", "класс", "респект", "годно", "смешно"]
@@ -43,40 +46,42 @@ def _tone_delta(txt: str) -> float:
     d += sum(1 for w in good if w in low) * 0.20
     d -= sum(1 for w in bad if w in low) * 0.25
     
-    if any(p in low for p in PROFANITY): 
+    if (hits or scan_triggers(txt)).profanity: 
         d -= 0.05  # мат без смайла — слегка минус
     if "ахах" in low or "лол" in low or "😂" in low: 
         d += 0.10    # смешливость — смягчает
     
     return max(-1.0, min(1.0, d))
 
-def _extract_person_facts(text: str) -> Dict[str, Any]:
-    """Извлекает персональные факты из текста сообщения."""
+def _extract_person_facts(text: str, hits: Optional[TriggerHits] = None) -> Dict[str, Any]:
+    """Извлекает персональные факты из текста сообщения.
+    hits – уже посчитанный проход матчера триггеров (чтобы не сканировать текст повторно).
+    """
     low = (text or "").lower().replace("ё", "е")
     facts = {"names": [], "aliases": [], "address_terms": [], "likes": [], "dislikes": [], "spice_inc": 0, "age": None, "height": None}
+    if hits is None:
+        hits = scan_triggers(text)
     
     # Извлечение имен
-    for m in re.findall(r"(?:меня зовут|зови меня)\s+([a-zа-я]{3,20})", low):
+    for m in _NAME_RE.findall(low):
         facts["names"].append(m.capitalize())
     
     # Обращения
-    for tok in ADDRESS_TOKENS:
-        if re.search(rf"(?:^|\W){re.escape(tok)}(?:\W|$)", low):
-            facts["address_terms"].append(tok)
+    facts["address_terms"].extend(hits.address_terms)
     
     # Предпочтения
-    for m in re.findall(r"(?:люблю|нравится|кайфую от)\s+([^.,!?\n]{1,30})", low):
+    for m in _LIKES_RE.findall(low):
         facts["likes"].append(m.strip())
     
-    for m in re.findall(r"(?:не люблю|бесит|ненавижу)\s+([^.,!?\n]{1,30})", low):
+    for m in _DISLIKES_RE.findall(low):
         facts["dislikes"].append(m.strip())
     
     # Токсичность
-    if any(p in low for p in PROFANITY):
+    if hits.profanity:
         facts["spice_inc"] = 1
     
     # Возраст: «мне 25», "мне 13", "мне 13 лет"
-    m_age = re.search(r"мне\s+(\d{1,2})\s*(?:лет|года|год)?", low)
+    m_age = _AGE_RE.search(low)
     if m_age:
         try:
             age = int(m_age.group(1))
@@ -85,7 +90,7 @@ def _extract_person_facts(text: str) -> Dict[str, Any]:
         except Exception:
             pass
     # Рост: "мой рост 145" / "рост 180" / "я ростом 172"
-    m_height = re.search(r"(?:мой\s+)?рост\s+(\d{2,3})", low)
+    m_height = _HEIGHT_RE.search(low)
     if m_height:
         try:
             h = int(m_height.group(1))
@@ -124,8 +129,11 @@ def update_person_profile(m: Message, bot_username: Optional[str] = None):
     if u.username:
         prof["username"] = u.username
 
+    # Один проход матчера на всё сообщение
+    hits = scan_triggers(m.text or "")
+    
     # Извлечение фактов из текста
-    facts = _extract_person_facts(m.text or "")
+    facts = _extract_person_facts(m.text or "", hits)
     for k in ["names", "aliases", "address_terms", "likes", "dislikes"]:
         for v in facts.get(k, []):
             _push_unique(prof[k], v)
@@ -136,6 +144,10 @@ def update_person_profile(m: Message, bot_username: Optional[str] = None):
     if facts.get("height"):
         pfacts["height"] = facts["height"]
 
+    # Стиль общения – затухающие счётчики обновляются один раз на входящее сообщение
+    if m.text:
+        prof["style"] = update_user_style_state(prof.get("style"), m.text)
+
     # Обновление уровня токсичности
     if facts.get("spice_inc"):
         prof["spice"] = min(3, round(prof.get("spice", 1) * 0.7 + 2 * 0.3))
@@ -151,7 +163,7 @@ def update_person_profile(m: Message, bot_username: Optional[str] = None):
         addressed_bot = True
     
     # Проверка ключевых слов
-    if any(k in low for k in [w.replace("ё", "е") for w in settings.name_keywords_list]):
+    if hits.keywords:
         addressed_bot = True
     
     # Проверка реплая на бота
@@ -160,21 +172,21 @@ def update_person_profile(m: Message, bot_username: Optional[str] = None):
     
     if addressed_bot:
         # Обновление отношения к боту
-        td = _tone_delta(m.text or "")
+        td = _tone_delta(m.text or "", hits)
         prof["to_bot_tone"] = max(-1.0, min(1.0, prof.get("to_bot_tone", 0.0) * 0.8 + td * 0.6))
         
         # Как зовёт бота
-        for tok in ADDRESS_TOKENS:
-            if re.search(rf"(?:^|\W){re.escape(tok)}(?:\W|$)", low):
-                _push_unique(prof["to_bot_terms"], tok)
+        for tok in hits.address_terms:
+            _push_unique(prof["to_bot_terms"], tok)
 
     _save_person(m.chat.id, u.id, prof)
 
-def person_prompt_addon(chat_id: int, user_id: int) -> str:
+def person_prompt_addon(chat_id: int, user_id: int, profile: Optional[Dict[str, Any]] = None) -> str:
     """
     Генерирует дополнение к промпту на основе профиля пользователя.
+    profile – уже загруженный профиль, чтобы не читать его из БД повторно.
     """
-    p = _load_person(chat_id, user_id)
+    p = {**DEFAULT_PROFILE, **profile} if profile is not None else _load_person(chat_id, user_id)
     if not p:
         return ""
     
@@ -5,7 +5,7 @@ from typing import Dict, List, Any, Optional, Tuple
 from collections import defaultdict
 
 from bot_groq.config.settings import settings
-from bot_groq.services.database import db_get_chat_tail
+from bot_groq.services.database import db_get_chat_tail, db_get_chat_aggregate
 
 def get_user_clash_summary(chat_id: int, user1_id: int, user2_id: int, limit: int = 50) -> str:
     """
@@ -77,51 +77,39 @@ def get_user_clash_summary(chat_id: int, user1_id: int, user2_id: int, limit: in
 def analyze_group_dynamics(chat_id: int, limit: int = 100) -> Dict[str, Any]:
     """
     Анализирует общую динамику группы.
+    Счётчики берутся из инкрементальных агрегатов (chat_stats / chat_user_stats),
+    из хвоста читаются только последние 20 сообщений для recent_speakers.
+    limit оставлен для совместимости вызовов.
     """
-    messages = db_get_chat_tail(chat_id, limit)
-    if not messages:
+    current_time = time.time()
+    silent_threshold = current_time - 7 * 24 * 3600  # 7 дней
+    agg = db_get_chat_aggregate(chat_id, top_users=5, silent_before=silent_threshold)
+    if not agg:
         return {}
     
-    # Статистика активности
-    user_activity = defaultdict(int)
-    user_last_seen = {}
-    reply_chains = []
-    
-    for msg in messages:
-        user_id = msg.get("user_id")
-        if user_id:
-            user_activity[user_id] += 1
-            user_last_seen[user_id] = msg.get("timestamp", 0)
-    
-    # Определяем самых активных
-    most_active = sorted(user_activity.items(), key=lambda x: x[1], reverse=True)[:5]
-    
     # Анализируем цепочки реплаев
-    current_time = time.time()
     recent_speakers = []
-    
-    for msg in messages[-20:]:
+    for msg in db_get_chat_tail(chat_id, 20):
         user_id = msg.get("user_id")
-        if user_id and user_id not in recent_speakers[-3:]:  # избегаем повторов
+        if user_id and msg.get("role") != "assistant" and user_id not in recent_speakers[-3:]:  # избегаем повторов
             recent_speakers.append(user_id)
     
-    # Определяем "молчунов"
-    silent_threshold = current_time - 7 * 24 * 3600  # 7 дней
-    silent_users = [uid for uid, last_time in user_last_seen.items() 
-                   if last_time < silent_threshold and user_activity[uid] > 5]
-    
+    active_users = agg["user_count"]
     return {
-        "total_messages": len(messages),
-        "active_users": len(user_activity),
-        "most_active": most_active,
+        "total_messages": agg["message_count"],
+        "active_users": active_users,
+        "most_active": agg["top_users"],
         "recent_speakers": recent_speakers[-5:],
-        "silent_users": silent_users,
-        "avg_activity": sum(user_activity.values()) / max(1, len(user_activity))
+        "silent_users": agg["silent_users"],
+        "avg_activity": agg["user_message_count"] / max(1, active_users),
+        "hourly": agg["hourly"],
+        "last_activity": agg["last_ts"]
     }
 
-def get_group_tension_points(chat_id: int) -> List[str]:
+def get_group_tension_points(chat_id: int, dynamics: Optional[Dict[str, Any]] = None) -> List[str]:
     """
     Ищет точки напряжения в группе.
+    dynamics – уже посчитанный analyze_group_dynamics, чтобы не считать его второй раз.
     """
     messages = db_get_chat_tail(chat_id, 50)
     if not messages:
@@ -138,7 +126,7 @@ def get_group_tension_points(chat_id: int) -> List[str]:
     # Анализируем последние сообщения на конфликтность
     conflict_count = 0
     for msg in messages:
-        text = (msg.get("text") or "").lower()
+        text = (msg.get("content") or "").lower()
         if any(pattern in text for pattern in conflict_patterns):
             conflict_count += 1
     
@@ -146,7 +134,8 @@ def get_group_tension_points(chat_id: int) -> List[str]:
         tension_indicators.append("Повышенная конфликтность в последних сообщениях")
     
     # Анализируем активность (слишком тихо или слишком шумно)
-    dynamics = analyze_group_dynamics(chat_id)
+    if dynamics is None:
+        dynamics = analyze_group_dynamics(chat_id)
     
     if dynamics.get("active_users", 0) < 2:
         tension_indicators.append("Группа практически мертва")
@@ -225,8 +214,8 @@ def get_manipulation_context(chat_id: int) -> str:
     """
     Создает контекст для манипулятивного поведения.
     """
-    tensions = get_group_tension_points(chat_id)
     dynamics = analyze_group_dynamics(chat_id)
+    tensions = get_group_tension_points(chat_id, dynamics)
     
     context_parts = []
     
@@ -1,7 +1,14 @@
 import re
 import random
-from typing import Dict, List, Any, Optional
-from collections import Counter
+import hashlib
+from typing import Dict, List, Any, Optional, Tuple
+from collections import Counter, OrderedDict
+
+STYLE_CATEGORIES = ("formal", "casual", "aggressive", "ironic", "emotional")
+STYLE_DECAY = 0.7        # вес старых голосов при каждом новом сообщении
+STYLE_RECENT = 5         # сколько последних стилей держим для стратегии
+STYLE_MIN_SCORE = 0.5    # ниже этого доминирующий стиль считаем нейтральным
+_EMOJI_RE = re.compile(r'[😀-🙏]')
 
 class StyleAnalyzer:
     """Анализатор стиля общения пользователя."""
@@ -32,40 +39,90 @@ class StyleAnalyzer:
             "!!!", "??", "!!!", "ахахах", "ололо", "вау", "ого", 
             "боже", "капец", "пиздец", "охреть"
         ]
-    
-    def analyze_message_style(self, text: str) -> Dict[str, Any]:
-        """Анализирует стиль конкретного сообщения."""
-        if not text:
-            return {}
         
+        # Мемоизация оценок по хешу содержимого (LRU)
+        self.memo_size = 2048
+        self._memo: "OrderedDict[bytes, Tuple[Dict[str, Any], str]]" = OrderedDict()
+        self.memo_hits = 0
+        self.memo_misses = 0
+        
+        # Компиляция лексиконов для производительности
+        self._compile_lexicons()
+    
+    def _compile_lexicons(self):
+        """Собирает все индикаторы в одну регулярку (один проход по тексту на все категории)."""
+        lexicons = {
+            "formal": self.formal_indicators,
+            "casual": self.casual_indicators,
+            "aggressive": self.aggressive_indicators,
+            "ironic": self.ironic_indicators,
+            "emotional": self.emotional_indicators,
+        }
+        # индикатор -> {категория: кратность в списке}
+        weights: Dict[str, Counter] = {}
+        for category, indicators in lexicons.items():
+            for ind in indicators:
+                weights.setdefault(ind.lower(), Counter())[category] += 1
+        tokens = sorted(weights, key=len, reverse=True)
+        # Для перекрытий: каждому найденному токену – все более короткие токены-префиксы
+        self._lexicon_prefixes = {
+            tok: [p for p in tokens if tok.startswith(p)] for tok in tokens
+        }
+        self._lexicon_weights = weights
+        self._lexicon_re = re.compile("(?=(" + "|".join(re.escape(t) for t in tokens) + "))")
+        self._memo.clear()
+    
+    def _score(self, text: str) -> Dict[str, Any]:
+        """Один проход по тексту: счётчики всех категорий и доп. метрики."""
         text_lower = text.lower()
         
-        # Подсчет индикаторов разных стилей
-        formal_score = sum(1 for ind in self.formal_indicators if ind in text_lower)
-        casual_score = sum(1 for ind in self.casual_indicators if ind in text_lower)
-        aggressive_score = sum(1 for ind in self.aggressive_indicators if ind in text_lower)
-        ironic_score = sum(1 for ind in self.ironic_indicators if ind in text_lower)
-        emotional_score = sum(1 for ind in self.emotional_indicators if ind in text)
+        # Индикатор засчитывается один раз, сколько бы раз он ни встретился
+        present = set()
+        for m in self._lexicon_re.finditer(text_lower):
+            present.update(self._lexicon_prefixes[m.group(1)])
         
-        # Дополнительные метрики
-        caps_ratio = sum(1 for c in text if c.isupper()) / max(1, len(text))
-        exclamation_count = text.count('!')
-        question_count = text.count('?')
-        emoji_count = len(re.findall(r'[😀-🙏]', text))
+        scores = Counter()
+        for tok in present:
+            scores.update(self._lexicon_weights[tok])
         
-        return {
-            "formal": formal_score,
-            "casual": casual_score, 
-            "aggressive": aggressive_score,
-            "ironic": ironic_score,
-            "emotional": emotional_score,
-            "caps_ratio": caps_ratio,
-            "exclamations": exclamation_count,
-            "questions": question_count,
-            "emojis": emoji_count,
+        metrics: Dict[str, Any] = {category: scores.get(category, 0) for category in STYLE_CATEGORIES}
+        metrics.update({
+            "caps_ratio": sum(map(str.isupper, text)) / max(1, len(text)),
+            "exclamations": text.count('!'),
+            "questions": text.count('?'),
+            "emojis": len(_EMOJI_RE.findall(text)),
             "length": len(text),
             "words": len(text.split())
-        }
+        })
+        return metrics
+    
+    def _memoized(self, text: str) -> Tuple[Dict[str, Any], str]:
+        """Метрики и доминирующий стиль сообщения, закешированные по хешу текста."""
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        entry = self._memo.get(key)
+        if entry is not None:
+            self._memo.move_to_end(key)
+            self.memo_hits += 1
+            return entry
+        self.memo_misses += 1
+        metrics = self._score(text)
+        entry = (metrics, self.get_dominant_style(metrics))
+        self._memo[key] = entry
+        if len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+        return entry
+    
+    def analyze_message_style(self, text: str) -> Dict[str, Any]:
+        """Анализирует стиль конкретного сообщения."""
+        if not text:
+            return {}
+        return dict(self._memoized(text)[0])
+    
+    def message_style(self, text: str) -> str:
+        """Доминирующий стиль сообщения (из мемо-кеша)."""
+        if not text:
+            return "neutral"
+        return self._memoized(text)[1]
     
     def get_dominant_style(self, style_metrics: Dict[str, Any]) -> str:
         """Определяет доминирующий стиль на основе метрик."""
@@ -149,8 +206,7 @@ class StyleAnalyzer:
         for msg in messages:
             text = msg.get("text", "")
             if text:
-                style_metrics = self.analyze_message_style(text)
-                dominant_style = self.get_dominant_style(style_metrics)
+                style_metrics, dominant_style = self._memoized(text)
                 
                 styles_over_time.append(dominant_style)
                 aggression_trend.append(style_metrics.get("aggressive", 0))
@@ -180,6 +236,39 @@ class StyleAnalyzer:
             "dominant_style": max(set(styles_over_time), key=styles_over_time.count) if styles_over_time else "neutral"
         }
     
+    def update_style_state(self, state: Optional[Dict[str, Any]], text: str) -> Dict[str, Any]:
+        """Инкрементально обновляет стилевое состояние пользователя одним сообщением.
+        Хранит экспоненциально затухающие голоса по стилям, последние STYLE_RECENT
+        стилей и готовый доминирующий стиль – чтение на ответе стоит O(1).
+        """
+        state = dict(state or {})
+        style = self.message_style(text)
+        scores = {k: v * STYLE_DECAY for k, v in (state.get("scores") or {}).items()}
+        if style != "neutral":
+            scores[style] = scores.get(style, 0.0) + 1.0
+        scores = {k: round(v, 4) for k, v in scores.items() if v >= 0.01}
+        
+        recent = (list(state.get("recent") or []) + [style])[-STYLE_RECENT:]
+        
+        dominant = "neutral"
+        if scores:
+            top_style, top_score = max(scores.items(), key=lambda x: x[1])
+            if top_score >= STYLE_MIN_SCORE:
+                dominant = top_style
+        
+        return {
+            "scores": scores,
+            "recent": recent,
+            "dominant": dominant,
+            "messages": int(state.get("messages", 0)) + 1
+        }
+    
+    def get_response_strategy_from_state(self, state: Optional[Dict[str, Any]], bot_personality: str = "toxic") -> str:
+        """Стратегия ответа по готовому стилевому состоянию (без повторного анализа сообщений)."""
+        if not state or not state.get("recent"):
+            return "Стандартный ответ"
+        return self._strategy(list(state["recent"]), state.get("dominant", "neutral"), bot_personality)
+    
     def get_response_strategy(self, user_messages: List[str], bot_personality: str = "toxic") -> str:
         """Определяет стратегию ответа на основе истории сообщений пользователя."""
         
@@ -189,10 +278,12 @@ class StyleAnalyzer:
         # Анализируем последние сообщения
         recent_styles = []
         for msg in user_messages[-5:]:  # последние 5 сообщений
-            style_metrics = self.analyze_message_style(msg)
-            style = self.get_dominant_style(style_metrics)
-            recent_styles.append(style)
+            recent_styles.append(self.message_style(msg))
         
+        return self._strategy(recent_styles, recent_styles[-1], bot_personality)
+    
+    def _strategy(self, recent_styles: List[str], fallback_style: str, bot_personality: str) -> str:
+        """Выбирает стратегию по последовательности недавних стилей."""
         # Определяем паттерн
         if len(set(recent_styles)) == 1:
             # Пользователь стабилен в стиле
@@ -213,8 +304,7 @@ class StyleAnalyzer:
         
         else:
             # Обычная ситуация
-            last_style = recent_styles[-1] if recent_styles else "neutral"
-            adaptation = self.generate_style_adaptation(last_style, bot_personality)
+            adaptation = self.generate_style_adaptation(fallback_style or "neutral", bot_personality)
             return f"АДАПТАЦИЯ К СТИЛЮ: {adaptation['instruction']}"
 
 # Глобальный экземпляр анализатора
@@ -226,4 +316,12 @@ def analyze_user_style(messages: List[str]) -> Dict[str, Any]:
 
 def get_style_adaptation_prompt(user_messages: List[str], bot_personality: str = "toxic") -> str:
     """Возвращает промпт для адаптации стиля бота."""
-    return style_analyzer.get_response_strategy(user_messages, bot_personality)
\ No newline at end of file
+    return style_analyzer.get_response_strategy(user_messages, bot_personality)
+
+def update_user_style_state(state: Optional[Dict[str, Any]], text: str) -> Dict[str, Any]:
+    """Обновляет стилевое состояние пользователя новым сообщением."""
+    return style_analyzer.update_style_state(state, text)
+
+def get_style_adaptation_prompt_from_state(state: Optional[Dict[str, Any]], bot_personality: str = "toxic") -> str:
+    """Возвращает промпт адаптации стиля по сохранённому состоянию пользователя."""
+    return style_analyzer.get_response_strategy_from_state(state, bot_personality)
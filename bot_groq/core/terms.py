@@ -0,0 +1,289 @@
+"""
+Частоты слов по чатам и пользователям для аналитики (темы чата, любимые слова).
+
+Текст токенизируется один раз при приёме сообщения; частоты копятся в
+структурах Space-Saving фиксированного размера (heavy hitters), поэтому
+память ограничена, а топ-K читается без прохода по истории и без сортировки
+всего словаря. Для чатов, где словарь меньше ёмкости, счёт точный.
+
+Структура, которой ещё нет в БД, один раз засевается из сохранённой истории
+и сразу записывается (побеждает первый записавший процесс). В ней хранится
+seeded_ts – время самого нового учтённого сообщения, поэтому сообщение,
+уже попавшее в засев, при приёме второй раз не считается.
+"""
+
+import asyncio
+import heapq
+import logging
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
+
+from bot_groq.core.triggers import normalize
+from bot_groq.services.database import (
+    db_load_term_stats, db_save_term_stats, db_seed_term_stats, db_get_chat_texts
+)
+
+CHAT_CAPACITY = 200      # сколько слов отслеживаем на чат
+USER_CAPACITY = 64       # и на пользователя в чате
+MIN_TERM_LENGTH = 4
+FLUSH_EVERY_UPDATES = 50  # записывать в БД после стольких сообщений
+FLUSH_INTERVAL = 30.0     # или не позже чем через столько секунд после первого изменения
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"[a-zа-я]+")
+
+# Служебные и «пустые» слова, которые иначе забивают весь топ
+STOP_WORDS = frozenset({
+    "этот", "этого", "этом", "этому", "этой", "этих", "тебя", "тебе", "меня", "себя", "себе",
+    "него", "нему", "ними", "если", "когда", "тогда", "только", "чтобы", "тоже", "также", "есть",
+    "было", "была", "были", "быть", "будет", "будут", "буду", "очень", "который", "которая",
+    "которые", "просто", "потом", "сейчас", "может", "можно", "надо", "нужно", "даже", "вообще",
+    "какой", "какая", "какие", "какое", "типа", "короче", "вроде", "всех", "всем", "всего", "свой",
+    "своя", "свои", "твой", "твоя", "твои", "здесь", "куда", "почему", "зачем", "потому", "поэтому",
+    "чего", "чему", "кого", "кому", "ничего", "никто", "нибудь", "либо", "более", "менее", "лучше",
+    "хуже", "после", "перед", "через", "между", "около", "опять", "снова", "прям", "прямо", "блин",
+    "ладно", "давай", "знаю", "думаю",
+    "that", "this", "with", "have", "what", "just", "from", "your", "will", "they", "there",
+})
+
+def tokenize(text: str) -> Counter:
+    """Слова сообщения (нижний регистр, ё -> е, без стоп-слов и коротких) с кратностью."""
+    return Counter(
+        w for w in _WORD_RE.findall(normalize(text))
+        if len(w) >= MIN_TERM_LENGTH and w not in STOP_WORDS
+    )
+
+class SpaceSaving:
+    """Space-Saving: топ частых элементов потока в памяти O(capacity).
+
+    Когда места нет, вытесняется самый редкий элемент, а новый наследует его
+    счёт (как верхнюю оценку ошибки). Минимум ищется по куче с ленивым
+    удалением устаревших записей.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.total = 0
+        self.counts: Dict[str, List[int]] = {}   # слово -> [счёт, ошибка]
+        self.seeded_ts: Optional[float] = None   # засеяна из истории по это время включительно
+        self._heap: List[Tuple[int, str]] = []
+
+    def _pop_min(self) -> Tuple[int, str]:
+        while True:
+            count, term = heapq.heappop(self._heap)
+            entry = self.counts.get(term)
+            if entry is not None and entry[0] == count:
+                return count, term
+
+    def _rebuild_heap(self):
+        self._heap = [(entry[0], term) for term, entry in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def offer(self, term: str, weight: int = 1):
+        """Учитывает weight вхождений слова."""
+        self.total += weight
+        entry = self.counts.get(term)
+        if entry is not None:
+            entry[0] += weight
+        elif len(self.counts) < self.capacity:
+            entry = self.counts[term] = [weight, 0]
+        else:
+            floor, victim = self._pop_min()
+            del self.counts[victim]
+            entry = self.counts[term] = [floor + weight, floor]
+        heapq.heappush(self._heap, (entry[0], term))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild_heap()
+
+    def offer_many(self, terms: Counter):
+        for term, weight in terms.items():
+            self.offer(term, weight)
+
+    def top(self, k: int) -> List[Tuple[str, int]]:
+        """k самых частых слов: [(слово, счёт)]."""
+        best = heapq.nlargest(k, self.counts.items(), key=lambda kv: kv[1][0])
+        return [(term, entry[0]) for term, entry in best]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"capacity": self.capacity, "total": self.total, "seeded_ts": self.seeded_ts,
+                "terms": self.counts}
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Копия to_dict(), которую можно сериализовать в другом потоке."""
+        return {"capacity": self.capacity, "total": self.total, "seeded_ts": self.seeded_ts,
+                "terms": {term: [c, e] for term, (c, e) in self.counts.items()}}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], capacity: int) -> "SpaceSaving":
+        sketch = cls(int(data.get("capacity", capacity)))
+        sketch.total = int(data.get("total", 0))
+        sketch.seeded_ts = data.get("seeded_ts")
+        sketch.counts = {term: [int(c), int(e)] for term, (c, e) in data.get("terms", {}).items()}
+        sketch._rebuild_heap()
+        return sketch
+
+class TermStats:
+    """Частоты слов по чатам и пользователям: загрузка, обновление при записи, топ-K.
+
+    Структуры живут в памяти; входящее сообщение только помечает их
+    изменёнными. В БД они пишутся пачкой в пуле потоков – после
+    FLUSH_EVERY_UPDATES сообщений или через FLUSH_INTERVAL секунд после
+    первого изменения (и при остановке бота). Холодная структура тоже
+    строится вне event loop: засев идёт под замком ключа, так что процесс
+    сканирует историю для ключа не больше одного раза.
+    """
+
+    def __init__(self, cache_size: int = 512):
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[int, Optional[int]], SpaceSaving]" = OrderedDict()
+        # Изменённые, но ещё не записанные (держим ссылку, даже если вытеснены из кэша)
+        self._dirty: Dict[Tuple[int, Optional[int]], SpaceSaving] = {}
+        self._flushing: Dict[Tuple[int, Optional[int]], SpaceSaving] = {}
+        self._loading: Dict[Tuple[int, Optional[int]], "asyncio.Future"] = {}
+        self._updates = 0
+        self._flush_now: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        # Засев вызывается из потоков (ingest через to_thread, аналитика веб-панели)
+        self._seed_locks: Dict[Tuple[int, Optional[int]], threading.Lock] = {}
+        self._seed_locks_guard = threading.Lock()
+
+    def _lookup(self, key: Tuple[int, Optional[int]]) -> Optional[SpaceSaving]:
+        sketch = self._cache.get(key)
+        if sketch is not None:
+            self._cache.move_to_end(key)
+            return sketch
+        return self._dirty.get(key) or self._flushing.get(key)
+
+    def _remember(self, key: Tuple[int, Optional[int]], sketch: SpaceSaving):
+        self._cache[key] = sketch
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _seed_lock(self, key: Tuple[int, Optional[int]]) -> threading.Lock:
+        with self._seed_locks_guard:
+            return self._seed_locks.setdefault(key, threading.Lock())
+
+    def _read_sketch(self, chat_id: int, user_id: Optional[int]) -> SpaceSaving:
+        """Структура из БД; если её нет – засев из сохранённой истории с записью в БД.
+
+        Блокирующая: вызывать вне event loop.
+        """
+        capacity = USER_CAPACITY if user_id is not None else CHAT_CAPACITY
+        data = db_load_term_stats(chat_id, user_id)
+        if data:
+            return SpaceSaving.from_dict(data, capacity)
+        key = (chat_id, user_id)
+        try:
+            with self._seed_lock(key):
+                # Пока ждали замок, ключ мог засеять другой поток
+                data = db_load_term_stats(chat_id, user_id)
+                if not data:
+                    sketch = SpaceSaving(capacity)
+                    texts, sketch.seeded_ts = db_get_chat_texts(chat_id, user_id=user_id, limit=1000)
+                    for text in texts:
+                        sketch.offer_many(tokenize(text))
+                    # Засев сохраняется сразу (и пустой тоже) – повторного скана истории не будет
+                    data = db_seed_term_stats(chat_id, user_id, sketch.snapshot())
+        finally:
+            # Дальше ключ читается из БД, замок больше не нужен
+            with self._seed_locks_guard:
+                self._seed_locks.pop(key, None)
+        return SpaceSaving.from_dict(data, capacity)
+
+    async def _get(self, key: Tuple[int, Optional[int]]) -> SpaceSaving:
+        """Структура для записи; холодную читает/засевает в пуле потоков (один раз на ключ)."""
+        sketch = self._lookup(key)
+        if sketch is not None:
+            return sketch
+        pending = self._loading.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        task = asyncio.ensure_future(asyncio.to_thread(self._read_sketch, *key))
+        self._loading[key] = task
+        try:
+            sketch = await task
+        finally:
+            self._loading.pop(key, None)
+        self._remember(key, sketch)
+        return sketch
+
+    async def ingest(self, chat_id: int, user_id: Optional[int], text: str, ts: Optional[float] = None):
+        """Учитывает входящее сообщение: одна токенизация, обновление чата и пользователя в памяти.
+
+        ts – время записи сообщения в историю (log_chat_event); сообщение, уже
+        учтённое засевом структуры (seeded_ts >= ts), повторно не считается.
+        """
+        terms = tokenize(text)
+        if not terms:
+            return
+        keys = [(chat_id, None)] + ([(chat_id, user_id)] if user_id is not None else [])
+        for key in keys:
+            sketch = await self._get(key)
+            if ts is not None and sketch.seeded_ts is not None and sketch.seeded_ts >= ts:
+                continue
+            sketch.offer_many(terms)
+            self._dirty[key] = sketch
+        self._updates += 1
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_now is None:
+            self._flush_now = asyncio.Event()
+        if self._updates >= FLUSH_EVERY_UPDATES:
+            self._flush_now.set()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.wait_for(self._flush_now.wait(), FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        self._flush_now.clear()
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.warning(f"term_stats flush failed: {e}")
+
+    async def flush(self):
+        """Пишет изменённые структуры в БД одной транзакцией (в пуле потоков)."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        # По одной записи за раз: более старый снимок не должен перезаписать новый
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            flushing, self._dirty = self._dirty, {}
+            self._flushing = flushing
+            self._updates = 0
+            # Снимок на event loop: дальше структуры меняются, пока поток пишет
+            items = [(cid, uid, sketch.snapshot()) for (cid, uid), sketch in flushing.items()]
+            try:
+                await asyncio.to_thread(db_save_term_stats, items)
+            except BaseException:
+                # Не потерять изменения: вернуть в очередь на запись
+                for key, sketch in flushing.items():
+                    self._dirty.setdefault(key, sketch)
+                raise
+            finally:
+                self._flushing = {}
+
+    def top_terms(self, chat_id: int, user_id: Optional[int] = None, k: int = 10) -> Dict[str, int]:
+        """Топ-k слов чата или пользователя в чате.
+
+        Если структуры нет в памяти, она читается из БД без кэширования, чтобы
+        процесс, который сам не пишет сообщения (веб-панель), не держал
+        устаревшие частоты; засев при первом обращении сохраняется в БД.
+        Блокирующая: вызывать вне event loop (аналитика идёт в пуле потоков).
+        """
+        sketch = self._lookup((chat_id, user_id))
+        if sketch is None:
+            sketch = self._read_sketch(chat_id, user_id)
+        return dict(sketch.top(k))
+
+# Глобальный экземпляр
+term_stats = TermStats()
@@ -0,0 +1,144 @@
+"""
+Единый матчер триггеров: ключевые слова бота, обращения, мат и вопросы.
+
+Все словари собираются в одну скомпилированную регулярку (lookahead-alternation,
+длинные токены первыми), и текст сканируется ОДИН раз. Для каждого совпадения
+заранее известен список более коротких токенов-префиксов, поэтому перекрывающиеся
+попадания («лех» внутри «леха») не теряются – как в автомате Aho–Corasick, но
+проход выполняется движком re на C.
+
+Матчер пересобирается сам, если поменялся settings.name_keywords
+(старт, /reload_settings, runtime override).
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Set, Tuple, Optional
+
+from bot_groq.config.settings import settings
+
+# Словари для анализа текста
+PROFANITY = {"бля", "блять", "сука", "нах", "нахуй", "хуй", "пизд", "еба", "ебл", "мраз", "чмо", "ссан", "говн", "твар", "дур", "идиот", "лох", "мудак", "падла"}
+ADDRESS_TOKENS = {"бро", "брат", "братан", "дружище", "леха", "лёха", "лешка", "лёшка", "бот", "батя", "кореш", "сынок", "шеф", "царь", "друг"}
+# Имена, после которых «?» означает вопрос боту (целым словом)
+BOT_NAME_TOKENS = {"бот", "леха", "лёха"}
+# Фразы-вопросы к боту (подстрокой)
+QUESTION_PHRASES = {"что думаешь", "как считаешь", "твое мнение"}
+
+# Категории. WORD – нужна граница слова с обеих сторон, иначе подстрока.
+KEYWORD = "keyword"
+ADDRESS = "address"
+PROFANE = "profanity"
+QUESTION = "question"
+BOT_NAME = "bot_name"
+_WORD_CATEGORIES = {ADDRESS, BOT_NAME}
+
+def normalize(text: str) -> str:
+    """Нижний регистр и ё -> е – единая форма для всех словарей."""
+    return (text or "").lower().replace("ё", "е")
+
+@dataclass
+class TriggerHits:
+    """Результат одного прохода по тексту."""
+    keywords: List[str] = field(default_factory=list)
+    address_terms: List[str] = field(default_factory=list)
+    profanity: List[str] = field(default_factory=list)
+    question: bool = False
+
+    @property
+    def categories(self) -> Set[str]:
+        cats = set()
+        if self.keywords:
+            cats.add(KEYWORD)
+        if self.address_terms:
+            cats.add(ADDRESS)
+        if self.profanity:
+            cats.add(PROFANE)
+        if self.question:
+            cats.add(QUESTION)
+        return cats
+
+class TriggerMatcher:
+    """Скомпилированный многошаблонный матчер."""
+
+    def __init__(self):
+        self._source: Optional[str] = None
+        self._regex: Optional[re.Pattern] = None
+        # токен -> [(токен-префикс, категории)] включая сам токен
+        self._prefixes: Dict[str, List[Tuple[str, Set[str]]]] = {}
+        self.rebuilds = 0
+
+    def _vocabulary(self) -> Dict[str, Set[str]]:
+        vocab: Dict[str, Set[str]] = {}
+        def add(tokens, category):
+            for tok in tokens:
+                t = normalize(tok).strip()
+                if t:
+                    vocab.setdefault(t, set()).add(category)
+        add(settings.name_keywords_list, KEYWORD)
+        add(ADDRESS_TOKENS, ADDRESS)
+        add(PROFANITY, PROFANE)
+        add(QUESTION_PHRASES, QUESTION)
+        add(BOT_NAME_TOKENS, BOT_NAME)
+        return vocab
+
+    def rebuild(self):
+        """Пересобирает регулярку из текущих словарей и настроек."""
+        vocab = self._vocabulary()
+        tokens = sorted(vocab, key=len, reverse=True)
+        self._prefixes = {
+            tok: [(p, vocab[p]) for p in tokens if tok.startswith(p)]
+            for tok in tokens
+        }
+        alternation = "|".join(re.escape(t) for t in tokens)
+        self._regex = re.compile(f"(?=({alternation}))")
+        self._source = settings.name_keywords
+        self.rebuilds += 1
+
+    def _ensure(self) -> re.Pattern:
+        if self._regex is None or self._source != settings.name_keywords:
+            self.rebuild()
+        return self._regex
+
+    def scan(self, text: str) -> TriggerHits:
+        """Один проход по тексту – все категории попаданий."""
+        hits = TriggerHits()
+        low = normalize(text)
+        if not low:
+            return hits
+        regex = self._ensure()
+        seen: Set[Tuple[str, str]] = set()
+        for m in regex.finditer(low):
+            start = m.start()
+            for tok, cats in self._prefixes[m.group(1)]:
+                end = start + len(tok)
+                bounded = (start == 0 or not low[start - 1].isalnum()) and \
+                          (end == len(low) or not low[end].isalnum())
+                for cat in cats:
+                    if cat in _WORD_CATEGORIES and not bounded:
+                        continue
+                    if cat == BOT_NAME:
+                        line_end = low.find("\n", end)
+                        if "?" in low[end:line_end if line_end != -1 else None]:
+                            hits.question = True
+                        continue
+                    if cat == QUESTION:
+                        hits.question = True
+                        continue
+                    if (cat, tok) in seen:
+                        continue
+                    seen.add((cat, tok))
+                    if cat == KEYWORD:
+                        hits.keywords.append(tok)
+                    elif cat == ADDRESS:
+                        hits.address_terms.append(tok)
+                    elif cat == PROFANE:
+                        hits.profanity.append(tok)
+        return hits
+
+# Глобальный экземпляр
+trigger_matcher = TriggerMatcher()
+
+def scan_triggers(text: str) -> TriggerHits:
+    """Сканирует текст глобальным матчером."""
+    return trigger_matcher.scan(text)
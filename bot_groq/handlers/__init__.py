@@ -7,6 +7,7 @@ from . import admin
 from . import public  
 from . import chat
 from . import media
+from .middleware import BanMiddleware, RateLimitMiddleware
 
 # Список всех роутеров для регистрации в диспетчере
 routers = [
@@ -16,10 +17,23 @@ routers = [
     chat.router
 ]
 
+# Баны из веб-панели и ограничение частоты – перед обработчиками, которые ходят в LLM
+# (админские команды не ограничиваем). Команды сверх лимита отбрасываются; обычные
+# сообщения и медиа всё равно пишутся в историю и статистику – без ответа (rate_limited)
+_ban = BanMiddleware()
+public.router.message.middleware(_ban)
+public.router.message.middleware(RateLimitMiddleware(drop=True))
+_record_only = RateLimitMiddleware(drop=False)
+for _router in (media.router, chat.router):
+    _router.message.middleware(_ban)
+    _router.message.middleware(_record_only)
+
 __all__ = [
     "admin",
     "public", 
     "chat",
     "media",
-    "routers"
+    "routers",
+    "BanMiddleware",
+    "RateLimitMiddleware"
 ]
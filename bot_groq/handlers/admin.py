@@ -1,17 +1,20 @@
 from aiogram import Router, F
-from aiogram.types import Message
+from aiogram.types import Message, FSInputFile
 from aiogram.filters import Command
-import json
+import asyncio
+import os
 import time
+from contextlib import suppress
 from typing import List
 
 from bot_groq.config.settings import settings
 from bot_groq.services.database import (
     db_get_chat_tail, db_clear_history, db_get_group_stats,
-    db_load_person, db_save_person, db_get_all_groups,
+    db_load_person, db_save_person, db_get_all_chat_stats, db_get_global_totals,
     db_get_settings, db_set_system_prompt,
     db_runtime_set, db_runtime_get, db_runtime_all, db_runtime_delete
 )
+from bot_groq.services.export import EXPORT_FORMATS, export_to_file
 from bot_groq.core.profiles import get_user_profile_for_display
 from bot_groq.core.relations import analyze_group_dynamics, get_group_tension_points
 from bot_groq.config import reload_settings as _reload_settings
@@ -116,8 +119,8 @@ async def cmd_stats(message: Message):
         # Динамика группы
         dynamics = analyze_group_dynamics(message.chat.id, limit=200)
         
-        # Точки напряжения
-        tensions = get_group_tension_points(message.chat.id)
+        # Точки напряжения (переиспользуем уже посчитанную динамику)
+        tensions = get_group_tension_points(message.chat.id, dynamics)
         
         text_parts = [
             f"📊 <b>Статистика чата</b>",
@@ -249,31 +252,51 @@ async def cmd_export_data(message: Message):
         await message.reply("🚫 Команда доступна только главному администратору")
         return
     
+    args = (message.text or "").split()[1:]
+    fmt = next((a for a in args if a in EXPORT_FORMATS), "json")
+    compress = any(a in ("gz", "gzip") for a in args)
+    path = None
+    
     try:
-        # Собираем данные для экспорта
-        export_data = {
-            "chat_id": message.chat.id,
-            "export_time": time.time(),
-            "messages": db_get_chat_tail(message.chat.id, limit=1000),
+        # Сводка кладётся в шапку экспорта, сами сообщения пишутся потоком
+        dynamics = analyze_group_dynamics(message.chat.id)
+        meta = {
             "stats": db_get_group_stats(message.chat.id),
-            "dynamics": analyze_group_dynamics(message.chat.id),
-            "tensions": get_group_tension_points(message.chat.id)
+            "dynamics": dynamics,
+            "tensions": get_group_tension_points(message.chat.id, dynamics)
         }
         
-        # Конвертируем в JSON
-        json_data = json.dumps(export_data, ensure_ascii=False, indent=2)
+        status = await message.reply("📦 Готовлю экспорт…")
+        loop = asyncio.get_running_loop()
+        last_update = [0.0]
+        
+        def progress(done: int, total: int):
+            # Вызывается из рабочего потока – правим статус не чаще раза в 2 секунды
+            now = time.time()
+            if now - last_update[0] < 2:
+                return
+            last_update[0] = now
+            asyncio.run_coroutine_threadsafe(
+                status.edit_text(f"📦 Экспорт: {done}/{total} сообщений…"), loop
+            )
         
-        # Сохраняем во временный файл и отправляем
-        filename = f"chat_export_{message.chat.id}_{int(time.time())}.json"
+        path, filename = await asyncio.to_thread(
+            export_to_file, message.chat.id, fmt, compress, meta, progress
+        )
         
         await message.reply_document(
-            document=json_data.encode('utf-8'),
-            filename=filename,
+            document=FSInputFile(path, filename=filename),
             caption="📦 Экспорт данных чата"
         )
+        with suppress(Exception):
+            await status.delete()
         
     except Exception as e:
         await message.reply(f"❌ Ошибка экспорта данных: {str(e)}")
+    finally:
+        if path:
+            with suppress(OSError):
+                os.remove(path)
 
 @router.message(Command("global_stats"))
 async def cmd_global_stats(message: Message):
@@ -284,32 +307,19 @@ async def cmd_global_stats(message: Message):
         return
     
     try:
-        # Получаем список всех групп
-        groups = db_get_all_groups()
+        # Агрегаты всех чатов одним запросом (уже отсортированы по активности)
+        groups = db_get_all_chat_stats()
+        totals = db_get_global_totals()
         
-        total_messages = 0
-        total_users = 0
-        active_groups = 0
+        total_messages = totals["total_messages"]
+        total_users = totals["total_users"]
+        active_groups = sum(1 for g in groups if g["message_count"] > 10)  # считаем активными группы с >10 сообщений
         
         group_details = []
         
-        for group_data in groups:
-            chat_id = group_data.get('chat_id')
-            if not chat_id:
-                continue
-                
-            stats = db_get_group_stats(chat_id)
-            dynamics = analyze_group_dynamics(chat_id, limit=100)
-            
-            messages = stats.get('total_messages', 0)
-            users = dynamics.get('active_users', 0)
+        for group_data in groups[:5]:
+            chat_id = group_data["chat_id"]
             
-            total_messages += messages
-            total_users += users
-            
-            if messages > 10:  # считаем активными группы с >10 сообщений
-                active_groups += 1
-                
             # Получаем название группы
             try:
                 chat = await message.bot.get_chat(chat_id)
@@ -319,13 +329,10 @@ async def cmd_global_stats(message: Message):
                 
             group_details.append({
                 'name': chat_name,
-                'messages': messages,
-                'users': users
+                'messages': group_data["message_count"],
+                'users': group_data["user_count"]
             })
         
-        # Сортируем по активности
-        group_details.sort(key=lambda x: x['messages'], reverse=True)
-        
         text_parts = [
             f"🌍 <b>Глобальная статистика</b>",
             f"",
@@ -685,7 +692,7 @@ async def cmd_admin_help(message: Message):
         "/reload_settings","/prompt","/prompt full","/prompt set <txt>",
         "/set k v","/get k","/vars","/unset k","/clean_overrides",
         "/config","/config set k v","/config find mask",
-        "/who","/stats","/global_stats","/clear_history","/export_data",
+        "/who","/stats","/global_stats","/clear_history","/export_data [json|ndjson|csv] [gz]",
         "/set_mode <mode>","/debug","/forget_user (reply)"
     ]
     await message.reply("Админ команды:\n" + "\n".join(cmds))
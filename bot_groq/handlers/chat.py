@@ -3,17 +3,20 @@ from aiogram.types import Message, ChatMemberUpdated
 from aiogram.filters import ChatMemberUpdatedFilter
 import random
 import time
-import re
+from typing import List, Optional
 
 from bot_groq.config.settings import settings
 from bot_groq.services.database import (
     db_add_chat_message, db_load_person, db_save_person,
     db_get_chat_tail, db_get_last_activity, log_chat_event
 )
-from bot_groq.services.llm import llm_text, ai_bit, post_filter
+from bot_groq.services.llm import llm_text, ai_bit
 from bot_groq.core.profiles import update_person_profile, person_prompt_addon
 from bot_groq.core.relations import get_manipulation_context, find_alliance_opportunities
-from bot_groq.core.style_analysis import get_style_adaptation_prompt
+from bot_groq.core.style_analysis import get_style_adaptation_prompt_from_state
+from bot_groq.core.coalescer import message_coalescer
+from bot_groq.core.triggers import scan_triggers
+from bot_groq.core.terms import term_stats
 
 router = Router()
 
@@ -42,21 +45,12 @@ async def should_respond(message: Message, bot_username: str) -> tuple[bool, str
     if message.reply_to_message and message.reply_to_message.from_user.is_bot:
         return True, "reply_to_bot"
     
-    # Ключевые слова
-    if any(keyword.lower() in text for keyword in settings.name_keywords_list):
+    # Ключевые слова и вопросы боту – один проход скомпилированного матчера
+    hits = scan_triggers(text)
+    if hits.keywords:
         return True, "keyword_trigger"
     
-    # Вопросы боту
-    question_patterns = [
-        r'\bбот\b.*\?',
-        r'\bлеха\b.*\?', 
-        r'\bлёха\b.*\?',
-        r'что думаешь',
-        r'как считаешь',
-        r'твое мнение'
-    ]
-    
-    if any(re.search(pattern, text) for pattern in question_patterns):
+    if hits.question:
         return True, "question_to_bot"
     
     # Случайная реплика: не чаще чем указано и не сразу после собственного ответа
@@ -81,15 +75,17 @@ async def should_respond(message: Message, bot_username: str) -> tuple[bool, str
     
     return False, "no_trigger"
 
-async def generate_contextual_response(message: Message, trigger_reason: str) -> str:
-    """Генерирует контекстуальный ответ на сообщение."""
+async def generate_contextual_response(message: Message, trigger_reason: str,
+                                       burst: Optional[List[Message]] = None) -> str:
+    """Генерирует контекстуальный ответ на сообщение.
+    burst – пачка склеенных сообщений (последнее – message), на которую отвечаем разом.
+    """
     
     # Получаем историю сообщений для контекста (используем настройку)
     history = db_get_chat_tail(message.chat.id, limit=settings.history_turns)
     
-    # Обновляем профиль пользователя
-    bot_info = await message.bot.get_me()
-    update_person_profile(message, bot_info.username)
+    # Профиль (уже обновлён при приёме сообщения в handle_text_message)
+    profile = db_load_person(message.chat.id, message.from_user.id) or {}
     
     # Базовый промпт
     prompt_parts = [
@@ -97,17 +93,26 @@ async def generate_contextual_response(message: Message, trigger_reason: str) ->
         f"Причина ответа: {trigger_reason}"
     ]
     
+    # Пачка сообщений, пришедших почти одновременно – отвечаем на всё разом
+    if burst and len(burst) > 1:
+        burst_lines = []
+        for m in burst[:-1]:
+            author = (m.from_user.username or m.from_user.first_name) if m.from_user else "?"
+            burst_lines.append(f"{author}: {(m.text or '')[:400]}")
+        prompt_parts.append(
+            "ПЕРЕД ЭТИМ ПОДРЯД НАПИСАЛИ (ответь одним сообщением на всё сразу, главное – последнее):\n"
+            + "\n".join(burst_lines)
+        )
+    
     # Добавляем персональную информацию
-    personal_addon = person_prompt_addon(message.chat.id, message.from_user.id)
+    personal_addon = person_prompt_addon(message.chat.id, message.from_user.id, profile=profile)
     if personal_addon:
         prompt_parts.append(personal_addon)
     
-    # Анализ стиля пользователя
-    user_messages = [msg.get('content', '') for msg in history 
-                     if msg.get('user_id') == str(message.from_user.id)][-5:]
-    
-    if user_messages:
-        style_prompt = get_style_adaptation_prompt(user_messages, "toxic")
+    # Стиль пользователя: инкрементальное состояние из профиля (update_person_profile
+    # заводит его и для старых профилей на первом же текстовом сообщении)
+    if profile.get("style"):
+        style_prompt = get_style_adaptation_prompt_from_state(profile["style"], "toxic")
         prompt_parts.append(f"СТИЛЬ АДАПТАЦИИ: {style_prompt}")
     
     # Контекст манипуляций для групп
@@ -140,9 +145,8 @@ async def generate_contextual_response(message: Message, trigger_reason: str) ->
     response = await llm_text(full_prompt, max_tokens=0)
     
     if response:
-        # Применяем пост-фильтр
-        filtered_response = post_filter(response)
-        return filtered_response
+        # llm_text уже прогнал ответ через sanitize_reply
+        return response
     
     # Fallback ответы если LLM не работает
     fallback_responses = {
@@ -182,11 +186,14 @@ async def generate_contextual_response(message: Message, trigger_reason: str) ->
     return random.choice(responses)
 
 @router.message(F.text)
-async def handle_text_message(message: Message):
-    """Обработчик текстовых сообщений."""
+async def handle_text_message(message: Message, rate_limited: bool = False):
+    """Обработчик текстовых сообщений.
+
+    rate_limited (RateLimitMiddleware) – сообщение учитывается, но без ответа.
+    """
     try:
         # Сохраняем сообщение в базу данных
-        log_chat_event(
+        logged_ts = log_chat_event(
             chat_id=message.chat.id,
             user_id=message.from_user.id,
             username=message.from_user.username or "",
@@ -199,15 +206,30 @@ async def handle_text_message(message: Message):
         bot_info = await message.bot.get_me()
         update_person_profile(message, bot_info.username)
         
+        # Частоты слов для аналитики – одна токенизация на сообщение
+        await term_stats.ingest(message.chat.id, message.from_user.id, message.text or "", ts=logged_ts)
+        
+        # Флуд: история и статистика уже записаны, отвечать не нужно
+        if rate_limited:
+            return
+        
         # Определяем, нужно ли отвечать
         should_resp, reason = await should_respond(message, bot_info.username)
         
-        if should_resp:
+        # Склеиваем пачку близких сообщений: отвечает только последнее в окне
+        burst = await message_coalescer.collect(message, reason if should_resp else None)
+        
+        if burst:
             # Генерируем и отправляем ответ
-            response = await generate_contextual_response(message, reason)
+            response = await generate_contextual_response(burst.latest, burst.reason, burst=burst.messages)
+            
+            # Пока генерировали, в чат написали ещё – ответ устарел
+            if message_coalescer.is_stale(burst):
+                message_coalescer.drop_stale(burst)
+                return
             
             if response and response.strip():
-                await message.reply(response)
+                await burst.latest.reply(response)
                 
                 # Сохраняем ответ бота в историю
                 log_chat_event(
@@ -224,7 +246,7 @@ async def handle_text_message(message: Message):
         print(f"Error handling message: {e}")
 
 @router.message(F.new_chat_members)
-async def handle_new_members(message: Message):
+async def handle_new_members(message: Message, rate_limited: bool = False):
     """Обработчик новых участников группы."""
     try:
         new_members = message.new_chat_members or []
@@ -237,7 +259,7 @@ async def handle_new_members(message: Message):
             system_profile = db_load_person(message.chat.id, 0) or {}
             bot_mode = system_profile.get("bot_mode", "toxic")
             
-            if bot_mode == "silent":
+            if bot_mode == "silent" or rate_limited:
                 continue
             
             # Генерируем приветствие
@@ -270,7 +292,7 @@ async def handle_new_members(message: Message):
         print(f"Error handling new members: {e}")
 
 @router.message(F.left_chat_member)
-async def handle_left_member(message: Message):
+async def handle_left_member(message: Message, rate_limited: bool = False):
     """Обработчик ушедших участников группы."""
     try:
         left_member = message.left_chat_member
@@ -282,7 +304,7 @@ async def handle_left_member(message: Message):
         system_profile = db_load_person(message.chat.id, 0) or {}
         bot_mode = system_profile.get("bot_mode", "toxic")
         
-        if bot_mode == "silent":
+        if bot_mode == "silent" or rate_limited:
             return
         
         # Только 50% шанс отреагировать на уход
@@ -1,57 +1,19 @@
 from aiogram import Router, F
-from aiogram.types import Message, PhotoSize
+from aiogram.types import Message
 import random
 import time
-import base64
-import aiohttp
-import tempfile
-import os
 
 from bot_groq.config.settings import settings
-from bot_groq.services.database import db_add_chat_message, db_load_person, log_chat_event
-from bot_groq.services.llm import llm_vision, llm_text
+from bot_groq.services.database import db_add_chat_message, db_load_person, log_chat_event, db_update_recent_media
+from bot_groq.services.llm import llm_text
+from bot_groq.services.vision import vision_service, VisionJobDropped
 from bot_groq.core.profiles import update_person_profile
+from bot_groq.core.triggers import scan_triggers
 
 router = Router()
 
-async def download_photo(photo: PhotoSize, bot) -> str:
-    """Скачивает фото и возвращает путь к временному файлу."""
-    try:
-        # Получаем файл
-        file = await bot.get_file(photo.file_id)
-        
-        # Создаем временный файл
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
-        temp_path = temp_file.name
-        temp_file.close()
-        
-        # Скачиваем файл
-        file_url = f"https://api.telegram.org/file/bot{bot.token}/{file.file_path}"
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.get(file_url) as response:
-                if response.status == 200:
-                    with open(temp_path, 'wb') as f:
-                        f.write(await response.read())
-                    return temp_path
-                else:
-                    os.unlink(temp_path)
-                    return None
-                    
-    except Exception as e:
-        print(f"Error downloading photo: {e}")
-        return None
-
-def cleanup_temp_file(file_path: str):
-    """Удаляет временный файл."""
-    try:
-        if file_path and os.path.exists(file_path):
-            os.unlink(file_path)
-    except Exception:
-        pass
-
 @router.message(F.photo)
-async def handle_photo(message: Message):
+async def handle_photo(message: Message, rate_limited: bool = False):
     """Обработчик фотографий."""
     try:
         # Сохраняем сообщение в базу
@@ -63,6 +25,7 @@ async def handle_photo(message: Message):
             timestamp=time.time(),
             is_bot=False
         )
+        db_update_recent_media(message.chat.id, message.photo[-1].file_id, message.caption)
         
         # Обновляем профиль пользователя
         bot_info = await message.bot.get_me()
@@ -72,7 +35,8 @@ async def handle_photo(message: Message):
         system_profile = db_load_person(message.chat.id, 0) or {}
         bot_mode = system_profile.get("bot_mode", "toxic")
         
-        if bot_mode == "silent":
+        # Флуд (RateLimitMiddleware): сообщение уже записано, без ответа
+        if bot_mode == "silent" or rate_limited:
             return
         
         # Определяем, нужно ли анализировать фото
@@ -84,7 +48,7 @@ async def handle_photo(message: Message):
             reason = "private"
         elif message.caption and f"@{bot_info.username}" in message.caption.lower():
             should_analyze = True; reason = "mention"
-        elif message.caption and any(keyword.lower() in message.caption.lower() for keyword in settings.name_keywords_list):
+        elif message.caption and scan_triggers(message.caption).keywords:
             should_analyze = True; reason = "keyword"
         elif random.randint(1, 100) <= max(1, settings.response_chance // 2):
             should_analyze = True; reason = "random"
@@ -97,84 +61,76 @@ async def handle_photo(message: Message):
             if settings.debug:
                 print(f"[vision] analyze photo chat={message.chat.id} reason={reason} caption={message.caption!r}")
         
-        # Анализируем фото
-        photo = message.photo[-1]  # Берем самое большое разрешение
-        temp_file_path = await download_photo(photo, message.bot)
+        # Описание фото – из кэша (повтор, пересылка) или от vision-модели через очередь
+        try:
+            description = await vision_service.describe(message.bot, message.photo, message.chat.id)
+        except VisionJobDropped as e:
+            if settings.debug:
+                print(f"[vision] drop photo chat={message.chat.id}: {e}")
+            return
         
-        if not temp_file_path:
-            await message.reply("Не могу скачать фото для анализа.")
+        if not description:
+            await message.reply("Не могу разобрать фото для анализа.")
             return
         
-        try:
-            # Строим промпт – добавляем последние текстовые сообщения как фон (до 5)
-            from bot_groq.services.database import db_get_chat_tail
-            tail = db_get_chat_tail(message.chat.id, limit=8)
-            last_texts = []
-            for h in tail[-8:]:
-                c = h.get('content')
-                if not c or c.startswith('[ФОТО]'):
-                    continue
-                last_texts.append(c[:120])
-                if len(last_texts) >= 5:
-                    break
-            context_snip = (" | ".join(last_texts)) if last_texts else "ничего полезного"
-
-            vision_prompt = (
-                "Ты видишь новое фото в чате. Опиши СУТЬ максимально колко и едко."
-                " Если на фото документы/текст – НЕ переписывай полностью, просто съязви."
-                f" Контекст последних сообщений: {context_snip}."
-            )
-            if message.caption:
-                vision_prompt += f" Пользователь добавил подпись: '{message.caption[:150]}'"
-
-            # Превращаем локальный файл в data URL (Groq поддерживает image_url с URL. data: может быть не поддержан – если не сработает, останется fallback на путь)
-            data_url = None
-            try:
-                with open(temp_file_path, 'rb') as f:
-                    b64 = base64.b64encode(f.read()).decode('ascii')
-                    data_url = f"data:image/jpeg;base64,{b64}"
-            except Exception:
-                pass
+        # Строим промпт – добавляем последние текстовые сообщения как фон (до 5)
+        from bot_groq.services.database import db_get_chat_tail
+        tail = db_get_chat_tail(message.chat.id, limit=8)
+        last_texts = []
+        for h in tail[-8:]:
+            c = h.get('content')
+            if not c or c.startswith('[ФОТО]'):
+                continue
+            last_texts.append(c[:120])
+            if len(last_texts) >= 5:
+                break
+        context_snip = (" | ".join(last_texts)) if last_texts else "ничего полезного"
 
-            image_ref = data_url or temp_file_path
+        comment_prompt = (
+            f"В чат прислали фото. Что на нём: {description}\n"
+            "Опиши СУТЬ максимально колко и едко."
+            " Если на фото документы/текст – НЕ переписывай полностью, просто съязви."
+            f" Контекст последних сообщений: {context_snip}."
+        )
+        if message.caption:
+            comment_prompt += f" Пользователь добавил подпись: '{message.caption[:150]}'"
 
-            response = llm_vision(
-                system_prompt="Ты токсично комментируешь фотографии. Пиши по-русски, язвительно, коротко.",
-                image_url=image_ref,
-                user_prompt=vision_prompt
-            )
+        # Подпись и контекст – поверх закэшированного описания дешёвой текстовой моделью
+        response = await llm_text(
+            comment_prompt,
+            max_tokens=0,
+            model=settings.vision_comment_model,
+            system_prompt="Ты токсично комментируешь фотографии. Пиши по-русски, язвительно, коротко."
+        )
+        
+        if response:
+            await message.reply(response)
             
-            if response:
-                await message.reply(response)
-                
-                # Сохраняем ответ бота
-                log_chat_event(
-                    chat_id=message.chat.id,
-                    user_id=bot_info.id,
-                    username=bot_info.username,
-                    text=response,
-                    timestamp=time.time(),
-                    is_bot=True
-                )
-            else:
-                # Fallback ответы на фото
-                photo_responses = [
-                    "Интересное фото. Что хотел показать?",
-                    "Вижу картинку, но что это должно означать?",
-                    "Фотка зачетная, но смысл?",
-                    "И что мне с этим делать?",
-                    "Красиво. И что дальше?"
-                ]
-                await message.reply(random.choice(photo_responses))
-                
-        finally:
-            cleanup_temp_file(temp_file_path)
-    
+            # Сохраняем ответ бота
+            log_chat_event(
+                chat_id=message.chat.id,
+                user_id=bot_info.id,
+                username=bot_info.username,
+                text=response,
+                timestamp=time.time(),
+                is_bot=True
+            )
+        else:
+            # Fallback ответы на фото
+            photo_responses = [
+                "Интересное фото. Что хотел показать?",
+                "Вижу картинку, но что это должно означать?",
+                "Фотка зачетная, но смысл?",
+                "И что мне с этим делать?",
+                "Красиво. И что дальше?"
+            ]
+            await message.reply(random.choice(photo_responses))
+
     except Exception as e:
         print(f"Error handling photo: {e}")
 
 @router.message(F.sticker)
-async def handle_sticker(message: Message):
+async def handle_sticker(message: Message, rate_limited: bool = False):
     """Обработчик стикеров."""
     try:
         # Сохраняем в базу
@@ -195,7 +151,8 @@ async def handle_sticker(message: Message):
         system_profile = db_load_person(message.chat.id, 0) or {}
         bot_mode = system_profile.get("bot_mode", "toxic")
         
-        if bot_mode == "silent":
+        # Флуд (RateLimitMiddleware): сообщение уже записано, без ответа
+        if bot_mode == "silent" or rate_limited:
             return
         
         # Реагируем на стикеры реже
@@ -228,7 +185,7 @@ async def handle_sticker(message: Message):
         print(f"Error handling sticker: {e}")
 
 @router.message(F.animation)
-async def handle_gif(message: Message):
+async def handle_gif(message: Message, rate_limited: bool = False):
     """Обработчик GIF-анимаций."""
     try:
         # Сохраняем в базу
@@ -249,7 +206,8 @@ async def handle_gif(message: Message):
         system_profile = db_load_person(message.chat.id, 0) or {}
         bot_mode = system_profile.get("bot_mode", "toxic")
         
-        if bot_mode == "silent":
+        # Флуд (RateLimitMiddleware): сообщение уже записано, без ответа
+        if bot_mode == "silent" or rate_limited:
             return
         
         # Реагируем на GIF еще реже
@@ -283,7 +241,7 @@ async def handle_gif(message: Message):
         print(f"Error handling GIF: {e}")
 
 @router.message(F.video)
-async def handle_video(message: Message):
+async def handle_video(message: Message, rate_limited: bool = False):
     """Обработчик видео."""
     try:
         # Сохраняем в базу
@@ -304,7 +262,8 @@ async def handle_video(message: Message):
         system_profile = db_load_person(message.chat.id, 0) or {}
         bot_mode = system_profile.get("bot_mode", "toxic")
         
-        if bot_mode == "silent":
+        # Флуд (RateLimitMiddleware): сообщение уже записано, без ответа
+        if bot_mode == "silent" or rate_limited:
             return
         
         # Реагируем на видео редко
@@ -338,7 +297,7 @@ async def handle_video(message: Message):
         print(f"Error handling video: {e}")
 
 @router.message(F.voice)
-async def handle_voice(message: Message):
+async def handle_voice(message: Message, rate_limited: bool = False):
     """Обработчик голосовых сообщений."""
     try:
         # Сохраняем в базу
@@ -359,7 +318,8 @@ async def handle_voice(message: Message):
         system_profile = db_load_person(message.chat.id, 0) or {}
         bot_mode = system_profile.get("bot_mode", "toxic")
         
-        if bot_mode == "silent":
+        # Флуд (RateLimitMiddleware): сообщение уже записано, без ответа
+        if bot_mode == "silent" or rate_limited:
             return
         
         # Реагируем на войсы редко
@@ -404,7 +364,7 @@ async def handle_voice(message: Message):
         print(f"Error handling voice: {e}")
 
 @router.message(F.document)
-async def handle_document(message: Message):
+async def handle_document(message: Message, rate_limited: bool = False):
     """Обработчик документов."""
     try:
         # Сохраняем в базу
@@ -428,7 +388,8 @@ async def handle_document(message: Message):
         system_profile = db_load_person(message.chat.id, 0) or {}
         bot_mode = system_profile.get("bot_mode", "toxic")
         
-        if bot_mode == "silent":
+        # Флуд (RateLimitMiddleware): сообщение уже записано, без ответа
+        if bot_mode == "silent" or rate_limited:
             return
         
         # Реагируем на документы редко
@@ -0,0 +1,71 @@
+"""
+Middleware обработчиков.
+"""
+
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message, TelegramObject
+
+from bot_groq.config.settings import settings
+from bot_groq.utils.filters import check_rate_limit, ban_list
+from bot_groq.utils.logging import handlers_logger
+
+class RateLimitMiddleware(BaseMiddleware):
+    """Ограничивает частоту сообщений, на которые бот может ответить.
+
+    Вешается как inner-middleware на message-роутеры, поэтому считаются
+    только сообщения, которые действительно дошли бы до обработчика.
+    Админы не ограничиваются.
+
+    drop=True – лишнее сообщение молча отбрасывается (команды: их нет в истории).
+    drop=False – хендлер всё равно вызывается с rate_limited=True: сообщение
+    пишется в историю, профиль и статистику, пропускается только ответ/LLM.
+    """
+
+    def __init__(self, drop: bool = True):
+        self.drop = drop
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        data["rate_limited"] = False
+        if not settings.rate_limit_enabled or not isinstance(event, Message) or event.from_user is None:
+            return await handler(event, data)
+        if event.from_user.id in settings.admin_ids:
+            return await handler(event, data)
+        allowed, reason = check_rate_limit(event.from_user.id, event.chat.id)
+        if not allowed:
+            handlers_logger.logger.debug("rate_limited", chat_id=event.chat.id, user_id=event.from_user.id,
+                                         reason=reason, dropped=self.drop)
+            if self.drop:
+                return None
+            data["rate_limited"] = True
+        return await handler(event, data)
+
+class BanMiddleware(BaseMiddleware):
+    """Игнорирует сообщения пользователей, забаненных в чате через веб-панель.
+
+    Проверка – по кэшу банов в памяти (ban_list), БД перечитывается не чаще
+    раза в settings.ban_cache_ttl секунд.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Message) or event.from_user is None:
+            return await handler(event, data)
+        if event.from_user.id in settings.admin_ids:
+            return await handler(event, data)
+        await ban_list.refresh_if_needed()
+        if ban_list.is_banned(event.chat.id, event.from_user.id):
+            handlers_logger.logger.debug("banned_message_dropped", chat_id=event.chat.id,
+                                         user_id=event.from_user.id)
+            return None
+        return await handler(event, data)
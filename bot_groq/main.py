@@ -21,8 +21,11 @@ from aiogram.types import (
 
 # Импорты наших модулей
 from bot_groq.config import settings
-from bot_groq.services import initialize_database
+from bot_groq.services import initialize_database, start_scheduler, stop_scheduler
 from bot_groq.services.database import db_get_settings, db_set_model
+from bot_groq.services.media import media_fetcher
+from bot_groq.services.vision import vision_service
+from bot_groq.core.terms import term_stats
 from bot_groq.handlers import routers
 from bot_groq.tasks.idle_chime import idle_chime_worker
 
@@ -187,6 +190,11 @@ async def on_startup(bot: Bot):
         logger.info("▶️ idle_chime_worker started")
     except Exception as e:
         logger.warning(f"Не удалось запустить idle_chime_worker: {e}")
+    try:
+        await start_scheduler(bot)
+        logger.info("▶️ scheduler started")
+    except Exception as e:
+        logger.warning(f"Не удалось запустить планировщик: {e}")
 
     logger.info("🎉 Бот успешно запущен и готов к работе!")
 
@@ -200,6 +208,14 @@ async def on_shutdown(bot: Bot):
             t.cancel()
         except Exception:
             pass
+    with suppress(Exception):
+        await stop_scheduler()
+    with suppress(Exception):
+        await media_fetcher.close()
+    with suppress(Exception):
+        await vision_service.close()
+    with suppress(Exception):
+        await term_stats.flush()
     # Отправляем сообщение о завершении
     await shutdown_message(bot)
     
@@ -9,14 +9,35 @@ from .database import (
     db_get_chat_tail,
     db_load_person,
     db_save_person,
-    db_get_group_stats
+    db_get_group_stats,
+    db_get_chat_aggregate,
+    db_get_all_chat_stats,
+    db_get_global_totals,
+    db_get_chat_window_stats,
+    db_get_user_window_stats,
+    db_get_chat_texts,
+    db_compact_rollups,
+    db_get_rollup_period,
+    db_load_term_stats,
+    db_save_term_stats,
+    db_seed_term_stats,
+    db_search_messages,
+    db_search_chats,
+    db_rebuild_search_index,
+    db_count_chat_history,
+    db_iter_chat_history,
+    db_create_report_job,
+    db_update_report_job,
+    db_get_report_job,
+    db_find_report_job
 )
 
 from .llm import (
     llm_text,
     llm_vision,
     ai_bit,
-    post_filter
+    post_filter,
+    sanitize_reply
 )
 
 from .scheduler import (
@@ -33,12 +54,33 @@ __all__ = [
     "db_load_person",
     "db_save_person",
     "db_get_group_stats",
+    "db_get_chat_aggregate",
+    "db_get_all_chat_stats",
+    "db_get_global_totals",
+    "db_get_chat_window_stats",
+    "db_get_user_window_stats",
+    "db_get_chat_texts",
+    "db_compact_rollups",
+    "db_get_rollup_period",
+    "db_load_term_stats",
+    "db_save_term_stats",
+    "db_seed_term_stats",
+    "db_search_messages",
+    "db_search_chats",
+    "db_rebuild_search_index",
+    "db_count_chat_history",
+    "db_iter_chat_history",
+    "db_create_report_job",
+    "db_update_report_job",
+    "db_get_report_job",
+    "db_find_report_job",
     
     # LLM сервис
     "llm_text",
     "llm_vision",
     "ai_bit", 
     "post_filter",
+    "sanitize_reply",
     
     # Планировщик
     "schedule_reminder",
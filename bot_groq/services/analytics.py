@@ -4,16 +4,29 @@
 
 import time
 import json
+import html
 from typing import Dict, List, Any, Optional, Tuple
 from dataclasses import dataclass, asdict
-from collections import defaultdict, deque
+from collections import deque
 from datetime import datetime, timedelta
 import asyncio
 
-from bot_groq.services.database import db_get_chat_tail, db_get_all_groups
+from bot_groq.services.database import (
+    db_get_all_chat_stats, db_get_global_totals, db_get_chat_aggregate,
+    db_get_chat_window_stats, db_get_user_window_stats, db_get_rollup_period,
+    db_search_chats, db_search_messages, SNIPPET_OPEN, SNIPPET_CLOSE
+)
+from bot_groq.core.terms import term_stats
 from bot_groq.utils.logging import core_logger
 from bot_groq.utils.cache import cache, cached
 
+# Периоды веб-API -> часы
+PERIOD_HOURS = {"24h": 24, "7d": 24 * 7, "30d": 24 * 30}
+
+def period_to_hours(period: str, default: int = 24 * 7) -> int:
+    """Переводит период вида '24h' / '7d' / '30d' в часы."""
+    return PERIOD_HOURS.get(period, default)
+
 @dataclass
 class UserAnalytics:
     """Аналитика пользователя."""
@@ -30,18 +43,22 @@ class UserAnalytics:
 
 @dataclass
 class ChatAnalytics:
-    """Аналитика чата."""
+    """Аналитика чата.
+
+    chat_name, toxicity_index и conflict_incidents не хранятся в агрегатах –
+    None означает «не считается» (аналитика за период их не заполняет).
+    """
     chat_id: int
-    chat_name: str
     total_messages: int
     active_users: int
     avg_messages_per_day: float
     peak_activity_hour: int
-    toxicity_index: float
     top_users: List[Tuple[int, int]]  # (user_id, message_count)
     popular_topics: Dict[str, int]
-    conflict_incidents: int
     growth_trend: List[int]  # сообщений за последние 7 дней
+    chat_name: Optional[str] = None
+    toxicity_index: Optional[float] = None
+    conflict_incidents: Optional[int] = None
 
 @dataclass
 class GlobalAnalytics:
@@ -68,37 +85,13 @@ class AnalyticsEngine:
     def get_user_analytics(self, chat_id: int, user_id: int) -> Optional[UserAnalytics]:
         """Получает аналитику пользователя."""
         try:
-            # Получаем историю сообщений пользователя
-            history = db_get_chat_tail(chat_id, limit=1000)
-            user_messages = [msg for msg in history if msg.get('user_id') == user_id]
-            
-            if not user_messages:
+            # Счётчики, средняя длина и активность по часам считаются в SQLite
+            stats = db_get_user_window_stats(chat_id, user_id)
+            if not stats:
                 return None
             
-            # Вычисляем метрики
-            total_messages = len(user_messages)
-            total_length = sum(len(msg.get('text', '')) for msg in user_messages)
-            avg_length = total_length / total_messages if total_messages > 0 else 0
-            
-            # Анализируем активность по часам
-            activity_pattern = defaultdict(int)
-            for msg in user_messages:
-                if msg.get('timestamp'):
-                    hour = datetime.fromtimestamp(msg['timestamp']).hour
-                    activity_pattern[hour] += 1
-            
-            # Извлекаем популярные слова
-            all_text = ' '.join(msg.get('text', '') for msg in user_messages)
-            words = all_text.lower().split()
-            word_freq = defaultdict(int)
-            for word in words:
-                if len(word) > 3:  # Только длинные слова
-                    word_freq[word] += 1
-            
-            favorite_words = dict(sorted(word_freq.items(), key=lambda x: x[1], reverse=True)[:10])
-            
-            # Последняя активность
-            last_activity = max(msg.get('timestamp', 0) for msg in user_messages)
+            # Любимые слова – топ из частот, накопленных при записи сообщений
+            favorite_words = term_stats.top_terms(chat_id, user_id, k=10)
             
             # Получаем информацию о пользователе
             from bot_groq.services.database import db_load_person
@@ -108,12 +101,12 @@ class AnalyticsEngine:
                 user_id=user_id,
                 username=profile.get('username', ''),
                 display_name=profile.get('display_name', f'User_{user_id}'),
-                total_messages=total_messages,
-                avg_message_length=avg_length,
+                total_messages=stats["message_count"],
+                avg_message_length=stats["avg_length"],
                 toxicity_level=profile.get('spice', 0),
-                last_activity=last_activity,
+                last_activity=stats["last_ts"] or 0,
                 favorite_words=favorite_words,
-                activity_pattern=dict(activity_pattern),
+                activity_pattern=stats["hourly"],
                 sentiment_trend=[]  # TODO: Implement sentiment analysis
             )
             
@@ -125,65 +118,31 @@ class AnalyticsEngine:
     def get_chat_analytics(self, chat_id: int) -> Optional[ChatAnalytics]:
         """Получает аналитику чата."""
         try:
-            history = db_get_chat_tail(chat_id, limit=5000)
+            # Итоги, дневные бакеты, часы и топ пользователей – GROUP BY в SQLite
+            stats = db_get_chat_window_stats(chat_id, days=7)
             
-            if not history:
+            if not stats:
                 return None
             
-            # Основные метрики
-            total_messages = len(history)
-            unique_users = len(set(msg.get('user_id') for msg in history if msg.get('user_id')))
-            
-            # Активность по дням
-            now = time.time()
-            daily_messages = []
-            for i in range(7):  # Последние 7 дней
-                day_start = now - (i + 1) * 86400
-                day_end = now - i * 86400
-                day_count = len([msg for msg in history 
-                               if day_start <= msg.get('timestamp', 0) < day_end])
-                daily_messages.append(day_count)
-            
+            daily_messages = stats["daily"]
             avg_per_day = sum(daily_messages) / 7 if daily_messages else 0
             
             # Пиковый час активности
-            hour_activity = defaultdict(int)
-            for msg in history:
-                if msg.get('timestamp'):
-                    hour = datetime.fromtimestamp(msg['timestamp']).hour
-                    hour_activity[hour] += 1
-            
-            peak_hour = max(hour_activity.items(), key=lambda x: x[1])[0] if hour_activity else 0
-            
-            # Топ пользователей
-            user_counts = defaultdict(int)
-            for msg in history:
-                if msg.get('user_id'):
-                    user_counts[msg['user_id']] += 1
-            
-            top_users = sorted(user_counts.items(), key=lambda x: x[1], reverse=True)[:10]
-            
-            # Популярные темы (простой анализ ключевых слов)
-            all_text = ' '.join(msg.get('text', '') for msg in history).lower()
-            words = all_text.split()
-            topic_words = defaultdict(int)
+            hourly = stats["hourly"]
+            peak_hour = max(range(24), key=lambda h: hourly[h]) if any(hourly) else 0
             
-            # Фильтруем по важным словам
-            important_words = [word for word in words if len(word) > 4 and word.isalpha()]
-            for word in important_words:
-                topic_words[word] += 1
-            
-            popular_topics = dict(sorted(topic_words.items(), key=lambda x: x[1], reverse=True)[:15])
+            # Популярные темы – топ слов чата из частот, накопленных при записи
+            popular_topics = term_stats.top_terms(chat_id, k=15)
             
             return ChatAnalytics(
                 chat_id=chat_id,
                 chat_name=f"Chat_{chat_id}",  # TODO: Get real chat name
-                total_messages=total_messages,
-                active_users=unique_users,
+                total_messages=stats["message_count"],
+                active_users=stats["user_count"],
                 avg_messages_per_day=avg_per_day,
                 peak_activity_hour=peak_hour,
                 toxicity_index=0.0,  # TODO: Calculate toxicity
-                top_users=top_users,
+                top_users=stats["top_users"],
                 popular_topics=popular_topics,
                 conflict_incidents=0,  # TODO: Detect conflicts
                 growth_trend=daily_messages
@@ -196,42 +155,28 @@ class AnalyticsEngine:
     def get_global_analytics(self) -> GlobalAnalytics:
         """Получает глобальную аналитику."""
         try:
-            # Получаем все группы
-            groups = db_get_all_groups()
-            total_chats = len(groups)
-            
-            total_messages = 0
-            total_users = set()
-            
-            for group in groups:
-                chat_id = group.get('chat_id')
-                if chat_id:
-                    history = db_get_chat_tail(chat_id, limit=1000)
-                    total_messages += len(history)
-                    
-                    for msg in history:
-                        if msg.get('user_id'):
-                            total_users.add(msg['user_id'])
+            # Итоги из инкрементальных агрегатов – без выгрузки истории по каждому чату
+            totals = db_get_global_totals()
+            total_chats = totals["total_chats"]
+            total_messages = totals["total_messages"]
+            top_chats = db_get_all_chat_stats(limit=1)
             
             # Статистика из метрик
             from bot_groq.utils.cache import bot_metrics
             metrics = bot_metrics.get_stats()
             
-            # Дневная статистика (заглушка)
-            daily_stats = {}
-            for i in range(7):
-                date = (datetime.now() - timedelta(days=i)).strftime('%Y-%m-%d')
-                daily_stats[date] = total_messages // 7  # Упрощенно
+            # Дневная статистика из роллапов
+            daily_stats = self._daily_series(db_get_rollup_period(time.time() - 7 * 86400)["daily"], 7)
             
             return GlobalAnalytics(
                 total_chats=total_chats,
-                total_users=len(total_users),
+                total_users=totals["total_users"],
                 total_messages=total_messages,
                 llm_requests=metrics.get('llm_requests', 0),
                 llm_success_rate=1 - metrics.get('llm_error_rate', 0),
                 avg_response_time=metrics.get('avg_response_time', 0),
                 uptime_hours=metrics.get('uptime_seconds', 0) / 3600,
-                most_active_chat=None,  # TODO: Determine most active
+                most_active_chat=top_chats[0]["chat_id"] if top_chats else None,
                 daily_stats=daily_stats
             )
             
@@ -239,6 +184,83 @@ class AnalyticsEngine:
             core_logger.log_error(e, {"operation": "get_global_analytics"})
             return GlobalAnalytics(0, 0, 0, 0, 0, 0, 0, None, {})
 
+    @staticmethod
+    def _daily_series(daily: Dict[str, int], days: int) -> Dict[str, int]:
+        """Ряд 'дата -> сообщений' за последние days суток, включая дни без сообщений."""
+        now = datetime.now()
+        return {
+            date: daily.get(date, 0)
+            for date in ((now - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days))
+        }
+    
+    def get_messages_count_today(self) -> int:
+        """Сообщений с начала текущих суток (по роллапам)."""
+        midnight = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+        return db_get_rollup_period(midnight)["message_count"]
+    
+    @cached(ttl=300)
+    def get_global_analytics_period(self, hours: int) -> GlobalAnalytics:
+        """Глобальная аналитика за последние hours часов – точная, по роллапам."""
+        try:
+            period = db_get_rollup_period(time.time() - hours * 3600, top=1)
+            
+            from bot_groq.utils.cache import bot_metrics
+            metrics = bot_metrics.get_stats()
+            
+            return GlobalAnalytics(
+                total_chats=period["chat_count"],
+                total_users=period["user_count"],
+                total_messages=period["message_count"],
+                llm_requests=metrics.get('llm_requests', 0),
+                llm_success_rate=1 - metrics.get('llm_error_rate', 0),
+                avg_response_time=metrics.get('avg_response_time', 0),
+                uptime_hours=metrics.get('uptime_seconds', 0) / 3600,
+                most_active_chat=period["top_chats"][0][0] if period["top_chats"] else None,
+                daily_stats=self._daily_series(period["daily"], max(1, -(-hours // 24)))
+            )
+            
+        except Exception as e:
+            core_logger.log_error(e, {"operation": "get_global_analytics_period", "hours": hours})
+            return GlobalAnalytics(0, 0, 0, 0, 0, 0, 0, None, {})
+    
+    @cached(ttl=300)
+    def get_chat_analytics_period(self, chat_id: int, period: str = "7d") -> Optional[ChatAnalytics]:
+        """Аналитика чата за период ('24h', '7d', '30d') – итоги по роллапам.
+
+        None – чат неизвестен; тихий период даёт нулевую аналитику.
+        """
+        try:
+            aggregate = db_get_chat_aggregate(chat_id)
+            if not aggregate:
+                return None
+            
+            hours = period_to_hours(period)
+            days = max(1, -(-hours // 24))
+            rollup = db_get_rollup_period(time.time() - hours * 3600, chat_id=chat_id)
+            
+            # Пиковый час – из почасовых агрегатов чата за всё время
+            hourly = aggregate.get("hourly") or [0] * 24
+            peak_hour = max(range(24), key=lambda h: hourly[h]) if any(hourly) else 0
+            
+            # Тренд: от самого старого дня периода к сегодняшнему
+            series = self._daily_series(rollup["daily"], days)
+            growth_trend = list(reversed(list(series.values())))
+            
+            return ChatAnalytics(
+                chat_id=chat_id,
+                total_messages=rollup["message_count"],
+                active_users=rollup["user_count"],
+                avg_messages_per_day=rollup["message_count"] / days,
+                peak_activity_hour=peak_hour,
+                top_users=rollup["top_users"],
+                popular_topics=term_stats.top_terms(chat_id, k=15),
+                growth_trend=growth_trend
+            )
+            
+        except Exception as e:
+            core_logger.log_error(e, {"operation": "get_chat_analytics_period", "chat_id": chat_id})
+            return None
+
 class ReportGenerator:
     """Генератор отчетов."""
     
@@ -296,21 +318,16 @@ async def get_dashboard_data() -> Dict[str, Any]:
     """Получает данные для дашборда."""
     global_analytics = analytics_engine.get_global_analytics()
     
-    # Последние активные чаты
-    groups = db_get_all_groups()
-    recent_chats = []
-    
-    for group in groups[:10]:  # Топ 10 чатов
-        chat_id = group.get('chat_id')
-        if chat_id:
-            chat_analytics = analytics_engine.get_chat_analytics(chat_id)
-            if chat_analytics:
-                recent_chats.append({
-                    "chat_id": chat_id,
-                    "name": chat_analytics.chat_name,
-                    "messages": chat_analytics.total_messages,
-                    "users": chat_analytics.active_users
-                })
+    # Топ 10 чатов – прямо из агрегатов, без полной аналитики по каждому
+    recent_chats = [
+        {
+            "chat_id": group["chat_id"],
+            "name": f"Chat_{group['chat_id']}",
+            "messages": group["message_count"],
+            "users": group["user_count"]
+        }
+        for group in db_get_all_chat_stats(limit=10)
+    ]
     
     return {
         "global": asdict(global_analytics),
@@ -319,20 +336,28 @@ async def get_dashboard_data() -> Dict[str, Any]:
     }
 
 async def search_chats(query: str) -> List[Dict[str, Any]]:
-    """Поиск чатов по названию или ID."""
-    groups = db_get_all_groups()
-    results = []
-    
-    for group in groups:
-        chat_id = group.get('chat_id')
-        if chat_id and (query in str(chat_id) or query.lower() in str(group).lower()):
-            chat_analytics = analytics_engine.get_chat_analytics(chat_id)
-            if chat_analytics:
-                results.append({
-                    "chat_id": chat_id,
-                    "name": chat_analytics.chat_name,
-                    "messages": chat_analytics.total_messages,
-                    "users": chat_analytics.active_users
-                })
-    
-    return results
\ No newline at end of file
+    """Поиск чатов по ID или содержимому истории (индексный, без полной аналитики по каждому)."""
+    return [
+        {
+            "chat_id": chat["chat_id"],
+            "name": f"Chat_{chat['chat_id']}",
+            "messages": chat["message_count"],
+            "users": chat["user_count"]
+        }
+        for chat in db_search_chats(query)
+    ]
+
+def search_messages(query: str, chat_id: Optional[int] = None, source: str = "all",
+                    limit: int = 20, offset: int = 0) -> Dict[str, Any]:
+    """Полнотекстовый поиск по сообщениям и памяти чатов.
+
+    Сниппеты HTML-экранированы, совпадения обёрнуты в <mark>.
+    """
+    result = db_search_messages(query, chat_id=chat_id, source=source, limit=limit, offset=offset)
+    for item in result["items"]:
+        item["snippet"] = (
+            html.escape(item["snippet"] or "")
+            .replace(SNIPPET_OPEN, "<mark>")
+            .replace(SNIPPET_CLOSE, "</mark>")
+        )
+    return result
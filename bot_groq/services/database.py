@@ -1,8 +1,9 @@
+import re
 import sqlite3
 import time
 import json
 from contextlib import closing
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, Iterator, Callable
 
 from bot_groq.config.settings import settings
 import os
@@ -10,6 +11,8 @@ import logging
 
 _db_logger = logging.getLogger("database")
 _db_path_logged = False  # чтобы не засорять логи повторениями
+# Подписчики на активность в чатах (chat_id, ts) – вызываются после записи сообщения
+_activity_listeners: List[Callable[[int, float], None]] = []
 
 def get_db_connection():
     """Возвращает соединение с базой данных.
@@ -38,6 +41,8 @@ def get_db_connection():
 def initialize_database():
     """Инициализирует базу данных и создает таблицы, если они не существуют."""
     with closing(get_db_connection()) as conn:
+        # WAL: читатели веб-панели не блокируют запись сообщений ботом
+        conn.execute("PRAGMA journal_mode=WAL")
         c = conn.cursor()
         c.execute("""CREATE TABLE IF NOT EXISTS settings(
             id INTEGER PRIMARY KEY CHECK (id=1),
@@ -61,10 +66,17 @@ def initialize_database():
         c.execute("""CREATE TABLE IF NOT EXISTS reminders(
             id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id TEXT NOT NULL, user_id TEXT NOT NULL,
             text TEXT NOT NULL, due_ts REAL NOT NULL, created_ts REAL NOT NULL)""")
+        # Время последнего «пинга тишины» по чатам – кулдаун переживает рестарт
+        c.execute("""CREATE TABLE IF NOT EXISTS idle_chime_state(
+            chat_id TEXT PRIMARY KEY, last_chime_ts REAL NOT NULL)""")
         c.execute("""CREATE TABLE IF NOT EXISTS daily_mention(
             chat_id TEXT PRIMARY KEY, last_date TEXT NOT NULL)""")
         c.execute("""CREATE TABLE IF NOT EXISTS recent_media(
             chat_id TEXT PRIMARY KEY, file_id TEXT NOT NULL, caption TEXT, ts REAL NOT NULL)""")
+        # Описания картинок от vision-модели: ключ – file_unique_id, второй ключ – перцептивный хэш
+        c.execute("""CREATE TABLE IF NOT EXISTS vision_cache(
+            file_unique_id TEXT PRIMARY KEY, phash TEXT, description TEXT NOT NULL,
+            created_ts REAL NOT NULL, expires_ts REAL NOT NULL)""")
         c.execute("""CREATE TABLE IF NOT EXISTS chat_style(
             chat_id TEXT PRIMARY KEY, style_json TEXT NOT NULL, updated_ts REAL NOT NULL)""")
         c.execute("""CREATE TABLE IF NOT EXISTS person_profile(
@@ -76,12 +88,73 @@ def initialize_database():
             score REAL NOT NULL, tone REAL NOT NULL, addr_json TEXT NOT NULL, last_ts REAL NOT NULL,
             PRIMARY KEY(chat_id,user_id_a,user_id_b))""")
 
+        # Инкрементальные агрегаты по чатам (обновляются при записи сообщения)
+        c.execute("""CREATE TABLE IF NOT EXISTS chat_stats(
+            chat_id TEXT PRIMARY KEY, message_count INTEGER NOT NULL DEFAULT 0,
+            user_count INTEGER NOT NULL DEFAULT 0, first_ts REAL NOT NULL, last_ts REAL NOT NULL)""")
+        c.execute("""CREATE TABLE IF NOT EXISTS chat_user_stats(
+            chat_id TEXT NOT NULL, user_id TEXT NOT NULL, message_count INTEGER NOT NULL DEFAULT 0,
+            first_ts REAL NOT NULL, last_ts REAL NOT NULL,
+            PRIMARY KEY(chat_id,user_id))""")
+        # Итоги пользователя по всем чатам – для постраничного списка веб-панели
+        # (имя и username копируются из последнего сохранённого профиля)
+        c.execute("""CREATE TABLE IF NOT EXISTS user_stats(
+            user_id TEXT PRIMARY KEY, chat_count INTEGER NOT NULL DEFAULT 0,
+            message_count INTEGER NOT NULL DEFAULT 0, last_ts REAL NOT NULL,
+            display_name TEXT NOT NULL DEFAULT '', username TEXT NOT NULL DEFAULT '')""")
+        c.execute("""CREATE TABLE IF NOT EXISTS chat_hour_stats(
+            chat_id TEXT NOT NULL, hour INTEGER NOT NULL, message_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(chat_id,hour))""")
+        # Баны из веб-панели (until_ts NULL – бессрочно)
+        c.execute("""CREATE TABLE IF NOT EXISTS user_bans(
+            chat_id TEXT NOT NULL, user_id TEXT NOT NULL, reason TEXT NOT NULL DEFAULT '',
+            banned_ts REAL NOT NULL, until_ts REAL,
+            PRIMARY KEY(chat_id,user_id))""")
+        # Частоты слов (heavy hitters) по чату (user_id='') и по пользователю
+        c.execute("""CREATE TABLE IF NOT EXISTS term_stats(
+            chat_id TEXT NOT NULL, user_id TEXT NOT NULL, data_json TEXT NOT NULL, updated_ts REAL NOT NULL,
+            PRIMARY KEY(chat_id,user_id))""")
+        # Фоновые задачи отчётов веб-панели
+        c.execute("""CREATE TABLE IF NOT EXISTS report_jobs(
+            task_id TEXT PRIMARY KEY, params_hash TEXT NOT NULL, report_type TEXT NOT NULL,
+            params_json TEXT NOT NULL, status TEXT NOT NULL, progress REAL NOT NULL DEFAULT 0,
+            result_path TEXT, error TEXT, created_ts REAL NOT NULL, updated_ts REAL NOT NULL,
+            expires_ts REAL, owner TEXT, heartbeat_ts REAL)""")
+        # Роллапы по времени: почасовые пишутся при записи сообщения, старые сжимаются в суточные.
+        # user_id='' – сообщения бота и без автора; bucket_ts – начало часа / локальных суток.
+        c.execute("""CREATE TABLE IF NOT EXISTS chat_stats_hourly(
+            chat_id TEXT NOT NULL, user_id TEXT NOT NULL, bucket_ts INTEGER NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0, total_length INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(chat_id,user_id,bucket_ts))""")
+        c.execute("""CREATE TABLE IF NOT EXISTS chat_stats_daily(
+            chat_id TEXT NOT NULL, user_id TEXT NOT NULL, bucket_ts INTEGER NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0, total_length INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY(chat_id,user_id,bucket_ts))""")
+
         # Добавляю индексы для оптимизации (из ROADMAP.md)
         c.execute("CREATE INDEX IF NOT EXISTS idx_person_profile_chat_user ON person_profile(chat_id, user_id)")
         c.execute("CREATE INDEX IF NOT EXISTS idx_relationship_chat_user_a ON relationship_profile(chat_id, user_id_a)")
         c.execute("CREATE INDEX IF NOT EXISTS idx_history_user_ts ON history(user_id, ts)")
         c.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_chat_ts ON chat_history(chat_id, ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_chat_user_ts ON chat_history(chat_id, user_id, ts)")
         c.execute("CREATE INDEX IF NOT EXISTS idx_reminders_due_ts ON reminders(due_ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_chat_user_stats_count ON chat_user_stats(chat_id, message_count)")
+        # Ключи сортировки списка пользователей (keyset-пагинация: значение + user_id)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_user_stats_last ON user_stats(last_ts, user_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_user_stats_messages ON user_stats(message_count, user_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_user_stats_chats ON user_stats(chat_count, user_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_user_stats_name ON user_stats(display_name COLLATE NOCASE, user_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_chat_stats_last_ts ON chat_stats(last_ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_person_profile_user ON person_profile(user_id, updated_ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_user_bans_user ON user_bans(user_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_term_stats_user ON term_stats(user_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_vision_cache_phash ON vision_cache(phash)")
+        # Версия данных веб-панели (ETag) смотрит на время последнего сброса частот слов
+        c.execute("CREATE INDEX IF NOT EXISTS idx_term_stats_updated ON term_stats(updated_ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_term_stats_chat_updated ON term_stats(chat_id, updated_ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_report_jobs_hash ON report_jobs(params_hash, created_ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_chat_stats_hourly_ts ON chat_stats_hourly(bucket_ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_chat_stats_daily_ts ON chat_stats_daily(bucket_ts)")
 
         c.execute("SELECT COUNT(*) FROM settings")
         if c.fetchone()[0] == 0:
@@ -96,8 +169,264 @@ def initialize_database():
                 c.execute("ALTER TABLE chat_history ADD COLUMN username TEXT")
             except Exception:
                 pass
+        # Владелец и пульс задач отчётов: без них нельзя отличить брошенную задачу от строящейся
+        c.execute("PRAGMA table_info(report_jobs)")
+        cols = [row[1] for row in c.fetchall()]
+        for column, decl in (("owner", "TEXT"), ("heartbeat_ts", "REAL")):
+            if column not in cols:
+                c.execute(f"ALTER TABLE report_jobs ADD COLUMN {column} {decl}")
+        # Однократно заполняем агрегаты из уже накопленной истории
+        c.execute("SELECT COUNT(*) FROM chat_stats")
+        if c.fetchone()[0] == 0:
+            _backfill_chat_aggregates(c)
+        c.execute("SELECT COUNT(*) FROM user_stats")
+        if c.fetchone()[0] == 0:
+            _backfill_user_stats(c)
+        _init_search_index(c)
+        c.execute("SELECT (SELECT COUNT(*) FROM chat_stats_hourly) + (SELECT COUNT(*) FROM chat_stats_daily)")
+        if c.fetchone()[0] == 0:
+            _backfill_rollups(c)
+        conn.commit()
+
+# ========= Full-text search =========
+# FTS5-таблицы хранят нормализованную копию текста (ё -> е; регистр сворачивает
+# токенайзер) и метаданные, поэтому поиск не делает JOIN по rowid. Синхронизация –
+# триггерами. VACUUM может перенумеровать rowid таблиц без INTEGER PRIMARY KEY –
+# после него индекс пересобирается (db_rebuild_search_index).
+SNIPPET_OPEN = "\x02"
+SNIPPET_CLOSE = "\x03"
+
+def _fts_text(expr: str) -> str:
+    return f"replace(replace({expr},'ё','е'),'Ё','Е')"
+
+_SEARCH_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS chat_history_fts USING fts5(
+        body, chat_id UNINDEXED, user_id UNINDEXED, role UNINDEXED, ts UNINDEXED,
+        tokenize='unicode61')""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS chat_memory_fts USING fts5(
+        body, chat_id UNINDEXED, ts UNINDEXED,
+        tokenize='unicode61')""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_history_fts_ai AFTER INSERT ON chat_history BEGIN
+        INSERT INTO chat_history_fts(rowid, body, chat_id, user_id, role, ts)
+        VALUES (new.rowid, {_fts_text('new.content')}, new.chat_id, new.user_id, new.role, new.ts);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_history_fts_ad AFTER DELETE ON chat_history BEGIN
+        DELETE FROM chat_history_fts WHERE rowid=old.rowid;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_history_fts_au AFTER UPDATE ON chat_history BEGIN
+        UPDATE chat_history_fts SET body={_fts_text('new.content')}, chat_id=new.chat_id,
+            user_id=new.user_id, role=new.role, ts=new.ts WHERE rowid=old.rowid;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_memory_fts_ai AFTER INSERT ON chat_memory BEGIN
+        INSERT INTO chat_memory_fts(rowid, body, chat_id, ts)
+        VALUES (new.rowid, {_fts_text('new.value')}, new.chat_id, new.ts);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chat_memory_fts_ad AFTER DELETE ON chat_memory BEGIN
+        DELETE FROM chat_memory_fts WHERE rowid=old.rowid;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_memory_fts_au AFTER UPDATE ON chat_memory BEGIN
+        UPDATE chat_memory_fts SET body={_fts_text('new.value')}, chat_id=new.chat_id, ts=new.ts
+        WHERE rowid=old.rowid;
+    END""",
+]
+
+def _fill_search_index(c: sqlite3.Cursor):
+    """Заполняет FTS-таблицы с нуля по текущему содержимому."""
+    c.execute("DELETE FROM chat_history_fts")
+    c.execute(f"""INSERT INTO chat_history_fts(rowid, body, chat_id, user_id, role, ts)
+                  SELECT rowid, {_fts_text('content')}, chat_id, user_id, role, ts FROM chat_history""")
+    c.execute("DELETE FROM chat_memory_fts")
+    c.execute(f"""INSERT INTO chat_memory_fts(rowid, body, chat_id, ts)
+                  SELECT rowid, {_fts_text('value')}, chat_id, ts FROM chat_memory""")
+
+def _init_search_index(c: sqlite3.Cursor):
+    """Создаёт FTS-индекс и триггеры; при первом создании индексирует накопленное."""
+    c.execute("SELECT COUNT(*) FROM sqlite_master WHERE name='chat_history_fts'")
+    existed = c.fetchone()[0] > 0
+    try:
+        for stmt in _SEARCH_SCHEMA:
+            c.execute(stmt)
+    except sqlite3.OperationalError as e:
+        # Сборка SQLite без FTS5 – поиск будет работать через LIKE
+        _db_logger.warning(f"FTS5 недоступен, полнотекстовый поиск отключён: {e}")
+        return
+    if not existed:
+        _fill_search_index(c)
+
+def db_rebuild_search_index():
+    """Пересобирает FTS-индекс (после VACUUM rowid могли измениться)."""
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        try:
+            _fill_search_index(c)
+        except sqlite3.OperationalError:
+            return
         conn.commit()
 
+def _fts_query(query: str) -> str:
+    """Превращает пользовательский ввод в безопасный FTS-запрос: все слова, по префиксу."""
+    words = re.findall(r"\w+", (query or "").lower().replace("ё", "е"))
+    return " ".join(f'"{w}"*' for w in words)
+
+def db_search_messages(query: str, chat_id: Optional[int] = None, source: str = "all",
+                       limit: int = 20, offset: int = 0) -> Dict[str, Any]:
+    """Полнотекстовый поиск по истории чатов и памяти чатов.
+
+    source: 'history' | 'memory' | 'all'. Результаты по релевантности (bm25);
+    в snippet совпадения обрамлены SNIPPET_OPEN / SNIPPET_CLOSE.
+    Возвращает {"total": int, "items": [...]}.
+    """
+    match = _fts_query(query)
+    if not match:
+        return {"total": 0, "items": []}
+    parts, count_parts, params, count_params = [], [], [], []
+    chat_filter = " AND chat_id=?" if chat_id is not None else ""
+    if source in ("all", "history"):
+        parts.append(f"""SELECT 'history' AS source, chat_id, user_id, role, ts,
+                                snippet(chat_history_fts, 0, ?, ?, '…', 12) AS snippet,
+                                bm25(chat_history_fts) AS rank
+                         FROM chat_history_fts WHERE chat_history_fts MATCH ?{chat_filter}""")
+        count_parts.append(f"SELECT COUNT(*) FROM chat_history_fts WHERE chat_history_fts MATCH ?{chat_filter}")
+    if source in ("all", "memory"):
+        parts.append(f"""SELECT 'memory' AS source, chat_id, NULL AS user_id, NULL AS role, ts,
+                                snippet(chat_memory_fts, 0, ?, ?, '…', 12) AS snippet,
+                                bm25(chat_memory_fts) AS rank
+                         FROM chat_memory_fts WHERE chat_memory_fts MATCH ?{chat_filter}""")
+        count_parts.append(f"SELECT COUNT(*) FROM chat_memory_fts WHERE chat_memory_fts MATCH ?{chat_filter}")
+    if not parts:
+        return {"total": 0, "items": []}
+    for _ in parts:
+        params += [SNIPPET_OPEN, SNIPPET_CLOSE, match] + ([str(chat_id)] if chat_id is not None else [])
+        count_params += [match] + ([str(chat_id)] if chat_id is not None else [])
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        try:
+            c.execute(" UNION ALL ".join(parts) + " ORDER BY rank LIMIT ? OFFSET ?", params + [limit, offset])
+            rows = c.fetchall()
+            c.execute("SELECT " + " + ".join(f"({q})" for q in count_parts), count_params)
+            total = c.fetchone()[0]
+        except sqlite3.OperationalError as e:
+            _db_logger.warning(f"FTS-поиск недоступен, откат на LIKE: {e}")
+            return _search_messages_like(c, query, chat_id, source, limit, offset)
+    items = [{"source": src, "chat_id": _int_id(cid), "user_id": _int_id(uid), "role": role,
+              "ts": float(ts) if ts is not None else None, "snippet": snip}
+             for (src, cid, uid, role, ts, snip, _rank) in rows]
+    return {"total": total, "items": items}
+
+def _search_messages_like(c: sqlite3.Cursor, query: str, chat_id: Optional[int], source: str,
+                          limit: int, offset: int) -> Dict[str, Any]:
+    """Запасной поиск подстрокой для сборок SQLite без FTS5 (полный проход, без подсветки)."""
+    pattern = f"%{query.strip()}%"
+    parts, params = [], []
+    chat_filter = " AND chat_id=?" if chat_id is not None else ""
+    if source in ("all", "history"):
+        parts.append(f"""SELECT 'history', chat_id, user_id, role, ts, content FROM chat_history
+                         WHERE content LIKE ?{chat_filter}""")
+        params += [pattern] + ([str(chat_id)] if chat_id is not None else [])
+    if source in ("all", "memory"):
+        parts.append(f"""SELECT 'memory', chat_id, NULL, NULL, ts, value FROM chat_memory
+                         WHERE value LIKE ?{chat_filter}""")
+        params += [pattern] + ([str(chat_id)] if chat_id is not None else [])
+    if not parts:
+        return {"total": 0, "items": []}
+    union = " UNION ALL ".join(parts)
+    c.execute(f"SELECT COUNT(*) FROM ({union})", params)
+    total = c.fetchone()[0]
+    c.execute(union + " ORDER BY 5 DESC LIMIT ? OFFSET ?", params + [limit, offset])
+    items = [{"source": src, "chat_id": _int_id(cid), "user_id": _int_id(uid), "role": role,
+              "ts": ts, "snippet": text[:200]}
+             for (src, cid, uid, role, ts, text) in c.fetchall()]
+    return {"total": total, "items": items}
+
+def db_search_chats(query: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """Чаты, у которых ID содержит запрос или в истории есть совпадения (по FTS)."""
+    q = (query or "").strip()
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.execute("""SELECT chat_id, message_count, user_count, last_ts FROM chat_stats
+                     WHERE chat_id LIKE ? ORDER BY message_count DESC LIMIT ?""", (f"%{q}%", limit))
+        rows = c.fetchall()
+        match = _fts_query(q)
+        if match and len(rows) < limit:
+            seen = {r[0] for r in rows}
+            try:
+                c.execute("""SELECT s.chat_id, s.message_count, s.user_count, s.last_ts
+                             FROM (SELECT chat_id, COUNT(*) AS hits FROM chat_history_fts
+                                   WHERE chat_history_fts MATCH ? GROUP BY chat_id) f
+                             JOIN chat_stats s ON s.chat_id=f.chat_id
+                             ORDER BY f.hits DESC LIMIT ?""", (match, limit))
+                rows += [r for r in c.fetchall() if r[0] not in seen][:limit - len(rows)]
+            except sqlite3.OperationalError:
+                pass
+    return [{"chat_id": _int_id(cid), "message_count": mc, "user_count": uc, "last_ts": l}
+            for (cid, mc, uc, l) in rows]
+
+def _backfill_chat_aggregates(c: sqlite3.Cursor):
+    """Строит агрегаты по существующим строкам chat_history (миграция)."""
+    c.execute("""INSERT OR IGNORE INTO chat_user_stats(chat_id,user_id,message_count,first_ts,last_ts)
+                 SELECT chat_id, user_id, COUNT(*), MIN(ts), MAX(ts) FROM chat_history
+                 WHERE user_id IS NOT NULL AND role!='assistant' GROUP BY chat_id, user_id""")
+    c.execute("""INSERT OR IGNORE INTO chat_hour_stats(chat_id,hour,message_count)
+                 SELECT chat_id, CAST(strftime('%H', ts, 'unixepoch', 'localtime') AS INTEGER), COUNT(*)
+                 FROM chat_history GROUP BY 1, 2""")
+    c.execute("""INSERT OR IGNORE INTO chat_stats(chat_id,message_count,user_count,first_ts,last_ts)
+                 SELECT h.chat_id, COUNT(*),
+                        (SELECT COUNT(*) FROM chat_user_stats u WHERE u.chat_id=h.chat_id),
+                        MIN(h.ts), MAX(h.ts)
+                 FROM chat_history h GROUP BY h.chat_id""")
+
+def _backfill_user_stats(c: sqlite3.Cursor):
+    """Строит итоги пользователей по chat_user_stats и последним профилям (миграция)."""
+    c.execute("""INSERT OR IGNORE INTO user_stats(user_id,chat_count,message_count,last_ts,display_name,username)
+                 SELECT u.user_id, COUNT(*), SUM(u.message_count), MAX(u.last_ts),
+                        COALESCE((SELECT json_extract(p.profile_json, '$.display_name') FROM person_profile p
+                                  WHERE p.user_id=u.user_id ORDER BY p.updated_ts DESC LIMIT 1), ''),
+                        COALESCE((SELECT json_extract(p.profile_json, '$.username') FROM person_profile p
+                                  WHERE p.user_id=u.user_id ORDER BY p.updated_ts DESC LIMIT 1), '')
+                 FROM chat_user_stats u GROUP BY u.user_id""")
+
+def _backfill_rollups(c: sqlite3.Cursor):
+    """Строит почасовые роллапы по существующим строкам chat_history (миграция)."""
+    c.execute("""INSERT OR IGNORE INTO chat_stats_hourly(chat_id,user_id,bucket_ts,message_count,total_length)
+                 SELECT chat_id, CASE WHEN role='assistant' THEN '' ELSE COALESCE(user_id,'') END,
+                        CAST(ts AS INTEGER) / 3600 * 3600, COUNT(*), SUM(LENGTH(content))
+                 FROM chat_history GROUP BY 1, 2, 3""")
+
+def _hour_start(ts: float) -> int:
+    """Начало часа (epoch)."""
+    return int(ts) // 3600 * 3600
+
+def _day_start(ts: float) -> int:
+    """Начало локальных суток (epoch)."""
+    lt = time.localtime(ts)
+    return int(time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday, 0, 0, 0, 0, 0, -1)))
+
+def _update_chat_aggregates(c: sqlite3.Cursor, chat_id: str, role: str, user_id: Optional[str], ts: float,
+                            length: int = 0):
+    """Инкрементально обновляет агрегаты чата в рамках транзакции записи сообщения."""
+    new_user = 0
+    if user_id and role != "assistant":
+        c.execute("""INSERT OR IGNORE INTO chat_user_stats(chat_id,user_id,message_count,first_ts,last_ts)
+                     VALUES(?,?,0,?,?)""", (chat_id, user_id, ts, ts))
+        new_user = 1 if c.rowcount == 1 else 0
+        c.execute("""UPDATE chat_user_stats SET message_count=message_count+1, last_ts=?
+                     WHERE chat_id=? AND user_id=?""", (ts, chat_id, user_id))
+        c.execute("""INSERT INTO user_stats(user_id,chat_count,message_count,last_ts) VALUES(?,?,1,?)
+                     ON CONFLICT(user_id) DO UPDATE SET chat_count=chat_count+excluded.chat_count,
+                       message_count=message_count+1, last_ts=excluded.last_ts""",
+                  (user_id, new_user, ts))
+    c.execute("""INSERT INTO chat_hour_stats(chat_id,hour,message_count) VALUES(?,?,1)
+                 ON CONFLICT(chat_id,hour) DO UPDATE SET message_count=message_count+1""",
+              (chat_id, time.localtime(ts).tm_hour))
+    c.execute("""INSERT INTO chat_stats(chat_id,message_count,user_count,first_ts,last_ts) VALUES(?,1,?,?,?)
+                 ON CONFLICT(chat_id) DO UPDATE SET message_count=message_count+1,
+                   user_count=user_count+excluded.user_count, last_ts=excluded.last_ts""",
+              (chat_id, new_user, ts, ts))
+    c.execute("""INSERT INTO chat_stats_hourly(chat_id,user_id,bucket_ts,message_count,total_length) VALUES(?,?,?,1,?)
+                 ON CONFLICT(chat_id,user_id,bucket_ts) DO UPDATE SET message_count=message_count+1,
+                   total_length=total_length+excluded.total_length""",
+              (chat_id, user_id if user_id and role != "assistant" else "", _hour_start(ts), length))
+
 # ========= Settings =========
 def db_get_settings() -> Dict[str, Any]:
     with closing(get_db_connection()) as conn:
@@ -171,9 +500,11 @@ def db_get_history(user_id: str) -> List[Dict[str, str]]:
         rows = c.fetchall()
     return [{"role": r, "content": t} for (r, t) in rows]
 
-def db_add_chat_message(chat_id: int, role: str, content: str, user_id: Optional[str] = None, username: Optional[str] = None):
+def db_add_chat_message(chat_id: int, role: str, content: str, user_id: Optional[str] = None,
+                        username: Optional[str] = None) -> float:
     """Базовая внутренняя функция добавления сообщения в историю чата.
     Используйте log_chat_event для гибкой записи из хендлеров.
+    Возвращает ts, с которым сообщение записано.
     """
     now = time.time()
     with closing(get_db_connection()) as conn:
@@ -186,20 +517,35 @@ def db_add_chat_message(chat_id: int, role: str, content: str, user_id: Optional
         c.execute("""INSERT INTO chat_activity (chat_id, last_ts) VALUES (?,?)
                      ON CONFLICT(chat_id) DO UPDATE SET last_ts=excluded.last_ts""",
                   (str(chat_id), now))
+        _update_chat_aggregates(c, str(chat_id), role, str(user_id) if user_id else None, now, len(content))
         conn.commit()
+    for listener in _activity_listeners:
+        try:
+            listener(int(chat_id), now)
+        except Exception as e:
+            _db_logger.warning(f"activity listener failed: {e}")
+    return now
+
+def db_add_activity_listener(listener: Callable[[int, float], None]):
+    """Подписывает listener(chat_id, ts) на каждое записанное сообщение (без повторной подписки)."""
+    if listener not in _activity_listeners:
+        _activity_listeners.append(listener)
 
 def log_chat_event(*, chat_id: int, user_id: Optional[int] = None, username: Optional[str] = None,
-                   text: str = "", timestamp: Optional[float] = None, is_bot: bool = False, role: Optional[str] = None):
+                   text: str = "", timestamp: Optional[float] = None, is_bot: bool = False,
+                   role: Optional[str] = None) -> float:
     """Back-compat слой для старых вызовов.
     Старые хендлеры вызывали db_add_chat_message с keyword аргументами (username, text, timestamp).
     Мы приводим их к унифицированному формату и вызываем db_add_chat_message.
     Параметр username пока не сохраняется (нет колонки) – при необходимости добавить миграцию.
+    Возвращает ts записи (см. db_add_chat_message).
     """
     if role is None:
         # Простая эвристика: бот -> assistant, остальное -> user
         role = "assistant" if is_bot else "user"
     content = text or ""
-    db_add_chat_message(chat_id=chat_id, role=role, content=content, user_id=str(user_id) if user_id else None, username=username)
+    return db_add_chat_message(chat_id=chat_id, role=role, content=content,
+                               user_id=str(user_id) if user_id else None, username=username)
 
 def db_get_chat_tail(chat_id: int, limit: int) -> List[Dict[str, str]]:
     """Возвращает последние сообщения чата.
@@ -213,6 +559,51 @@ def db_get_chat_tail(chat_id: int, limit: int) -> List[Dict[str, str]]:
         rows = c.fetchall()[::-1]
     return [{"role": r, "content": t, "user_id": u} for (r, t, u) in rows]
 
+def db_count_chat_history(chat_id: Optional[int] = None) -> int:
+    """Число строк истории чата (или всех чатов)."""
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        if chat_id is None:
+            c.execute("SELECT COUNT(*) FROM chat_history")
+        else:
+            c.execute("SELECT COUNT(*) FROM chat_history WHERE chat_id=?", (str(chat_id),))
+        return c.fetchone()[0]
+
+def db_iter_chat_history(chat_id: Optional[int] = None, batch_size: int = 500) -> Iterator[List[Dict[str, Any]]]:
+    """Отдаёт историю пачками по batch_size в порядке (chat_id, ts).
+
+    Keyset-пагинация: каждая пачка – короткий запрос «после последнего ключа»
+    по индексу (chat_id, ts), без OFFSET и без удержания соединения между пачками.
+    """
+    last: Optional[Tuple] = None
+    while True:
+        with closing(get_db_connection()) as conn:
+            c = conn.cursor()
+            if chat_id is not None:
+                sql = "SELECT rowid, chat_id, role, content, ts, user_id, username FROM chat_history WHERE chat_id=?"
+                params: List[Any] = [str(chat_id)]
+                if last is not None:
+                    sql += " AND (ts, rowid) > (?, ?)"
+                    params += [last[1], last[2]]
+                sql += " ORDER BY ts, rowid LIMIT ?"
+            else:
+                sql = "SELECT rowid, chat_id, role, content, ts, user_id, username FROM chat_history"
+                params = []
+                if last is not None:
+                    sql += " WHERE (chat_id, ts, rowid) > (?, ?, ?)"
+                    params += list(last)
+                sql += " ORDER BY chat_id, ts, rowid LIMIT ?"
+            c.execute(sql, params + [batch_size])
+            rows = c.fetchall()
+        if not rows:
+            return
+        yield [{"chat_id": _int_id(cid), "role": r, "content": t, "ts": ts, "user_id": _int_id(u), "username": un}
+               for (_rowid, cid, r, t, ts, u, un) in rows]
+        rowid, cid, _r, _t, ts, _u, _un = rows[-1]
+        last = (cid, ts, rowid)
+        if len(rows) < batch_size:
+            return
+
 # ========= Simple memories =========
 def mem_add_user(user_id: str, value: str):
     v = value.strip()
@@ -266,7 +657,144 @@ def db_save_person(chat_id: int, user_id: int, prof: Dict[str, Any]):
                           profile_json=excluded.profile_json,
                           updated_ts=excluded.updated_ts""",
                      (str(chat_id), str(user_id), json.dumps(prof, ensure_ascii=False), time.time()))
+        conn.execute("UPDATE user_stats SET display_name=?, username=? WHERE user_id=?",
+                     (prof.get("display_name") or "", prof.get("username") or "", str(user_id)))
+        conn.commit()
+
+# ========= Term stats =========
+def db_load_term_stats(chat_id: int, user_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Загружает частоты слов чата (user_id=None) или пользователя в чате."""
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.execute("SELECT data_json FROM term_stats WHERE chat_id=? AND user_id=?",
+                  (str(chat_id), str(user_id) if user_id is not None else ""))
+        row = c.fetchone()
+    return json.loads(row[0]) if row else None
+
+def db_seed_term_stats(chat_id: int, user_id: Optional[int], data: Dict[str, Any]) -> Dict[str, Any]:
+    """Записывает начальные частоты, только если их ещё нет; возвращает то, что в итоге хранится.
+
+    Если засеять одновременно пытались несколько процессов, все получат одну и ту же запись.
+    """
+    cid, uid = str(chat_id), str(user_id) if user_id is not None else ""
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.execute("""INSERT INTO term_stats(chat_id,user_id,data_json,updated_ts) VALUES(?,?,?,?)
+                     ON CONFLICT(chat_id,user_id) DO NOTHING""",
+                  (cid, uid, json.dumps(data, ensure_ascii=False), time.time()))
+        c.execute("SELECT data_json FROM term_stats WHERE chat_id=? AND user_id=?", (cid, uid))
+        row = c.fetchone()
+        conn.commit()
+    return json.loads(row[0])
+
+def db_save_term_stats(items: List[Tuple[int, Optional[int], Dict[str, Any]]]):
+    """Сохраняет несколько наборов частот (chat_id, user_id|None, data) одной транзакцией."""
+    now = time.time()
+    with closing(get_db_connection()) as conn:
+        conn.executemany("""INSERT INTO term_stats(chat_id,user_id,data_json,updated_ts) VALUES(?,?,?,?)
+                            ON CONFLICT(chat_id,user_id) DO UPDATE SET
+                              data_json=excluded.data_json, updated_ts=excluded.updated_ts""",
+                         [(str(cid), str(uid) if uid is not None else "", json.dumps(data, ensure_ascii=False), now)
+                          for cid, uid, data in items])
+        conn.commit()
+
+# ========= Report jobs =========
+_REPORT_JOB_FIELDS = ("task_id", "params_hash", "report_type", "params_json", "status", "progress",
+                      "result_path", "error", "created_ts", "updated_ts", "expires_ts", "owner", "heartbeat_ts")
+_REPORT_JOB_UPDATABLE = {"status", "progress", "result_path", "error", "expires_ts"}
+
+def _report_job_row(row: Optional[Tuple]) -> Optional[Dict[str, Any]]:
+    if not row:
+        return None
+    job = dict(zip(_REPORT_JOB_FIELDS, row))
+    job["params"] = json.loads(job.pop("params_json"))
+    return job
+
+def db_create_report_job(task_id: str, params_hash: str, report_type: str, params: Dict[str, Any],
+                         owner: Optional[str] = None):
+    now = time.time()
+    with closing(get_db_connection()) as conn:
+        conn.execute("""INSERT INTO report_jobs(task_id,params_hash,report_type,params_json,status,progress,
+                                                created_ts,updated_ts,owner,heartbeat_ts)
+                        VALUES(?,?,?,?, 'pending', 0, ?, ?, ?, ?)""",
+                     (task_id, params_hash, report_type, json.dumps(params, ensure_ascii=False), now, now,
+                      owner, now))
+        conn.commit()
+
+def db_update_report_job(task_id: str, **fields):
+    """Обновляет статус/прогресс/результат задачи отчёта."""
+    fields = {k: v for k, v in fields.items() if k in _REPORT_JOB_UPDATABLE}
+    if not fields:
+        return
+    assignments = ", ".join(f"{k}=?" for k in fields)
+    with closing(get_db_connection()) as conn:
+        conn.execute(f"UPDATE report_jobs SET {assignments}, updated_ts=? WHERE task_id=?",
+                     (*fields.values(), time.time(), task_id))
+        conn.commit()
+
+def db_get_report_job(task_id: str) -> Optional[Dict[str, Any]]:
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.execute(f"SELECT {', '.join(_REPORT_JOB_FIELDS)} FROM report_jobs WHERE task_id=?", (task_id,))
+        return _report_job_row(c.fetchone())
+
+def db_find_report_job(params_hash: str, now: Optional[float] = None,
+                       stale_before: float = 0) -> Optional[Dict[str, Any]]:
+    """Живая задача с теми же параметрами: ещё идёт (пульс не старше stale_before) или готова и не истекла."""
+    now = time.time() if now is None else now
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.execute(f"""SELECT {', '.join(_REPORT_JOB_FIELDS)} FROM report_jobs
+                      WHERE params_hash=? AND ((status IN ('pending','running')
+                                                AND COALESCE(heartbeat_ts, updated_ts)>=?)
+                            OR (status='completed' AND expires_ts>?))
+                      ORDER BY created_ts DESC LIMIT 1""", (params_hash, stale_before, now))
+        return _report_job_row(c.fetchone())
+
+def db_heartbeat_report_jobs(task_ids: List[str], owner: str) -> int:
+    """Отмечает, что владелец ещё строит эти задачи."""
+    if not task_ids:
+        return 0
+    now = time.time()
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.executemany("""UPDATE report_jobs SET heartbeat_ts=? WHERE task_id=? AND owner=?
+                         AND status IN ('pending','running')""", [(now, t, owner) for t in task_ids])
+        conn.commit()
+        return c.rowcount
+
+def db_fail_interrupted_report_jobs(stale_before: float, reason: str = "interrupted") -> int:
+    """Помечает проваленными незавершённые задачи, чей владелец перестал слать пульс до stale_before.
+
+    Задачи живых процессов (в том числе других воркеров веб-панели) не трогаются.
+    """
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.execute("""UPDATE report_jobs SET status='failed', error=?, updated_ts=?
+                     WHERE status IN ('pending','running') AND COALESCE(heartbeat_ts, updated_ts)<?""",
+                  (reason, time.time(), stale_before))
+        conn.commit()
+        return c.rowcount
+
+def db_expire_report_jobs(now: Optional[float] = None, keep_failed_sec: float = 86400) -> List[str]:
+    """Удаляет истёкшие задачи. Возвращает пути файлов, на которые больше никто не ссылается."""
+    now = time.time() if now is None else now
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.execute("""SELECT task_id, result_path FROM report_jobs
+                     WHERE (status='completed' AND expires_ts<=?) OR (status='failed' AND updated_ts<=?)""",
+                  (now, now - keep_failed_sec))
+        expired = c.fetchall()
+        if not expired:
+            return []
+        c.executemany("DELETE FROM report_jobs WHERE task_id=?", [(t,) for (t, _p) in expired])
+        orphaned = []
+        for path in {p for (_t, p) in expired if p}:
+            c.execute("SELECT 1 FROM report_jobs WHERE result_path=? LIMIT 1", (path,))
+            if not c.fetchone():
+                orphaned.append(path)
         conn.commit()
+    return orphaned
 
 # ========= Relationships (A->B) =========
 def db_load_rel(chat_id: int, a: int, b: int) -> Optional[Dict[str, Any]]:
@@ -324,16 +852,29 @@ def db_get_chat_history_for_style(chat_id: int) -> List[str]:
         return [t for (t,) in c.fetchall() if t and not t.startswith("[image]")]
 
 # ========= Reminders / Schedulers =========
-def db_add_reminder(chat_id: int, user_id: int, text: str, due_ts: float):
+def db_add_reminder(chat_id: int, user_id: int, text: str, due_ts: float) -> int:
+    """Добавляет напоминание, возвращает его id."""
     with closing(get_db_connection()) as conn:
-        conn.execute("INSERT INTO reminders(chat_id,user_id,text,due_ts,created_ts) VALUES(?,?,?,?,?)",
-                     (str(chat_id), str(user_id), text, due_ts, time.time()))
+        cur = conn.execute("INSERT INTO reminders(chat_id,user_id,text,due_ts,created_ts) VALUES(?,?,?,?,?)",
+                           (str(chat_id), str(user_id), text, due_ts, time.time()))
         conn.commit()
+        return cur.lastrowid
+
+def db_get_due_reminders(now_ts: float, limit: Optional[int] = None) -> List[Tuple]:
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        sql = "SELECT id,chat_id,user_id,text,due_ts FROM reminders WHERE due_ts<=? ORDER BY due_ts ASC"
+        if limit:
+            c.execute(sql + " LIMIT ?", (now_ts, limit))
+        else:
+            c.execute(sql, (now_ts,))
+        return c.fetchall()
 
-def db_get_due_reminders(now_ts: float) -> List[Tuple]:
+def db_get_pending_reminders() -> List[Tuple]:
+    """Все неотправленные напоминания (id, chat_id, user_id, text, due_ts) – для загрузки планировщика."""
     with closing(get_db_connection()) as conn:
         c = conn.cursor()
-        c.execute("SELECT id,chat_id,user_id,text,due_ts FROM reminders WHERE due_ts<=? ORDER BY due_ts ASC LIMIT 20", (now_ts,))
+        c.execute("SELECT id,chat_id,user_id,text,due_ts FROM reminders ORDER BY due_ts ASC")
         return c.fetchall()
 
 def db_delete_reminder(reminder_id: int):
@@ -341,12 +882,45 @@ def db_delete_reminder(reminder_id: int):
         conn.execute("DELETE FROM reminders WHERE id=?", (reminder_id,))
         conn.commit()
 
+def db_delete_reminders(reminder_ids: List[int]):
+    """Удаляет пачку напоминаний одним DELETE (кусками по 500 – лимит параметров SQLite)."""
+    ids = list(reminder_ids)
+    if not ids:
+        return
+    with closing(get_db_connection()) as conn:
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            conn.execute(f"DELETE FROM reminders WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+        conn.commit()
+
 def db_get_all_chat_activities() -> List[Tuple]:
     with closing(get_db_connection()) as conn:
         c = conn.cursor()
-        c.execute("SELECT chat_id, last_ts FROM chat_activity")
+        c.execute("SELECT chat_id, last_ts FROM chat_activity ORDER BY last_ts")
         return c.fetchall()
 
+def db_get_active_bans() -> Dict[Tuple[int, int], Optional[float]]:
+    """Действующие баны: (chat_id, user_id) -> until_ts (None – бессрочно)."""
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.execute("SELECT chat_id, user_id, until_ts FROM user_bans WHERE until_ts IS NULL OR until_ts>?",
+                  (time.time(),))
+        return {(_int_id(cid), _int_id(uid)): until for cid, uid, until in c.fetchall()}
+
+def db_get_idle_chimes() -> Dict[int, float]:
+    """Время последнего пинга тишины по всем чатам."""
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.execute("SELECT chat_id, last_chime_ts FROM idle_chime_state")
+        return {_int_id(cid): ts for cid, ts in c.fetchall()}
+
+def db_set_idle_chime(chat_id: int, ts: float):
+    with closing(get_db_connection()) as conn:
+        conn.execute("""INSERT INTO idle_chime_state(chat_id,last_chime_ts) VALUES(?,?)
+                        ON CONFLICT(chat_id) DO UPDATE SET last_chime_ts=excluded.last_chime_ts""",
+                     (str(chat_id), ts))
+        conn.commit()
+
 def db_get_daily_mention_date(chat_id: int) -> Optional[str]:
     with closing(get_db_connection()) as conn:
         c = conn.cursor()
@@ -387,6 +961,37 @@ def db_update_recent_media(chat_id: int, file_id: str, caption: Optional[str]):
                      (str(chat_id), file_id, caption or "", time.time()))
         conn.commit()
 
+def db_get_vision_cache(file_unique_id: Optional[str] = None, phash: Optional[str] = None) -> Optional[str]:
+    """Неистёкшее описание картинки по file_unique_id или по перцептивному хэшу."""
+    if file_unique_id:
+        where, key = "file_unique_id=?", file_unique_id
+    elif phash:
+        where, key = "phash=?", phash
+    else:
+        return None
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.execute(f"""SELECT description FROM vision_cache WHERE {where} AND expires_ts>?
+                      ORDER BY created_ts DESC LIMIT 1""", (key, time.time()))
+        row = c.fetchone()
+    return row[0] if row else None
+
+def db_put_vision_cache(file_unique_id: str, phash: Optional[str], description: str, ttl_sec: float):
+    now = time.time()
+    with closing(get_db_connection()) as conn:
+        conn.execute("""INSERT INTO vision_cache(file_unique_id,phash,description,created_ts,expires_ts) VALUES(?,?,?,?,?)
+                        ON CONFLICT(file_unique_id) DO UPDATE SET phash=excluded.phash,description=excluded.description,
+                            created_ts=excluded.created_ts,expires_ts=excluded.expires_ts""",
+                     (file_unique_id, phash, description, now, now + ttl_sec))
+        conn.commit()
+
+def db_purge_vision_cache() -> int:
+    """Удаляет истёкшие описания картинок; возвращает число удалённых строк."""
+    with closing(get_db_connection()) as conn:
+        cur = conn.execute("DELETE FROM vision_cache WHERE expires_ts<=?", (time.time(),))
+        conn.commit()
+        return cur.rowcount
+
 # ========= Relationship Analysis =========
 def db_get_user_relationships(chat_id: int, user_id: int, limit: int = 6) -> List[Tuple]:
     with closing(get_db_connection()) as conn:
@@ -397,27 +1002,247 @@ def db_get_user_relationships(chat_id: int, user_id: int, limit: int = 6) -> Lis
         return c.fetchall()
 
 def db_get_group_stats(chat_id: int) -> Dict[str, Any]:
-    """Получает статистику группы."""
-    with closing(get_db_connection()) as conn:
-        c = conn.cursor()
-        
-        # Количество сообщений
-        c.execute("SELECT COUNT(*) FROM chat_history WHERE chat_id=?", (str(chat_id),))
-        message_count = c.fetchone()[0]
-        
-        # Количество уникальных пользователей
-        c.execute("SELECT COUNT(DISTINCT user_id) FROM chat_history WHERE chat_id=? AND user_id IS NOT NULL", (str(chat_id),))
-        user_count = c.fetchone()[0]
-        
-        # Последняя активность
-        c.execute("SELECT MAX(ts) FROM chat_history WHERE chat_id=?", (str(chat_id),))
-        last_activity = c.fetchone()[0]
-        
-        return {
-            "message_count": message_count,
-            "user_count": user_count,
-            "last_activity": last_activity
-        }
+    """Получает статистику группы из инкрементальных агрегатов (O(1))."""
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.execute("SELECT message_count, user_count, last_ts FROM chat_stats WHERE chat_id=?", (str(chat_id),))
+        row = c.fetchone()
+    message_count, user_count, last_activity = row if row else (0, 0, None)
+    return {
+        "message_count": message_count,
+        "total_messages": message_count,
+        "user_count": user_count,
+        "last_activity": last_activity
+    }
+
+def _int_id(raw: Optional[str]):
+    """user_id хранится строкой – отдаём int, если это число."""
+    return int(raw) if raw and raw.lstrip("-").isdigit() else raw
+
+def db_get_chat_aggregate(chat_id: int, top_users: int = 5, silent_before: Optional[float] = None,
+                          silent_min_messages: int = 5) -> Dict[str, Any]:
+    """Возвращает агрегаты чата одним соединением: счётчики, топ, почасовую гистограмму, молчунов."""
+    cid = str(chat_id)
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.execute("SELECT message_count, user_count, first_ts, last_ts FROM chat_stats WHERE chat_id=?", (cid,))
+        row = c.fetchone()
+        if not row:
+            return {}
+        message_count, user_count, first_ts, last_ts = row
+        c.execute("""SELECT user_id, message_count FROM chat_user_stats WHERE chat_id=?
+                     ORDER BY message_count DESC LIMIT ?""", (cid, top_users))
+        top = [(_int_id(u), n) for (u, n) in c.fetchall()]
+        c.execute("SELECT COALESCE(SUM(message_count),0) FROM chat_user_stats WHERE chat_id=?", (cid,))
+        user_messages = c.fetchone()[0]
+        c.execute("SELECT hour, message_count FROM chat_hour_stats WHERE chat_id=?", (cid,))
+        hourly = [0] * 24
+        for hour, n in c.fetchall():
+            hourly[hour] = n
+        silent: List[Any] = []
+        if silent_before is not None:
+            c.execute("""SELECT user_id FROM chat_user_stats WHERE chat_id=? AND last_ts<? AND message_count>?""",
+                      (cid, silent_before, silent_min_messages))
+            silent = [_int_id(u) for (u,) in c.fetchall()]
+    return {
+        "message_count": message_count,
+        "user_count": user_count,
+        "user_message_count": user_messages,
+        "first_ts": first_ts,
+        "last_ts": last_ts,
+        "top_users": top,
+        "hourly": hourly,
+        "silent_users": silent
+    }
+
+def db_get_chat_window_stats(chat_id: int, now: Optional[float] = None, days: int = 7) -> Dict[str, Any]:
+    """Аналитика чата по сырой истории – агрегация на стороне SQLite.
+
+    Сутки считаются скользящими окнами от now (бакет i = [now-(i+1)*86400, now-i*86400)),
+    час – по локальному времени. Все запросы идут по индексу (chat_id, ts).
+    """
+    cid = str(chat_id)
+    now = time.time() if now is None else now
+    since = now - days * 86400
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        # Пользователи считаются как в chat_user_stats: без ответов бота
+        c.execute("""SELECT COUNT(*), COUNT(DISTINCT CASE WHEN role!='assistant' THEN user_id END), MIN(ts), MAX(ts)
+                     FROM chat_history WHERE chat_id=?""", (cid,))
+        total, users, first_ts, last_ts = c.fetchone()
+        if not total:
+            return {}
+        c.execute("""SELECT CAST((? - ts) / 86400 AS INTEGER) AS bucket, COUNT(*)
+                     FROM chat_history WHERE chat_id=? AND ts>=? AND ts<?
+                     GROUP BY bucket""", (now, cid, since, now))
+        daily = [0] * days
+        for bucket, n in c.fetchall():
+            if 0 <= bucket < days:
+                daily[bucket] = n
+        c.execute("""SELECT CAST(strftime('%H', ts, 'unixepoch', 'localtime') AS INTEGER) AS hour, COUNT(*)
+                     FROM chat_history WHERE chat_id=? GROUP BY hour""", (cid,))
+        hourly = [0] * 24
+        for hour, n in c.fetchall():
+            hourly[hour] = n
+        c.execute("""SELECT user_id, COUNT(*) AS n FROM chat_history
+                     WHERE chat_id=? AND user_id IS NOT NULL AND role!='assistant'
+                     GROUP BY user_id ORDER BY n DESC LIMIT 10""", (cid,))
+        top = [(_int_id(u), n) for (u, n) in c.fetchall()]
+    return {
+        "message_count": total,
+        "user_count": users,
+        "first_ts": first_ts,
+        "last_ts": last_ts,
+        "daily": daily,
+        "hourly": hourly,
+        "top_users": top
+    }
+
+def db_get_user_window_stats(chat_id: int, user_id: int) -> Dict[str, Any]:
+    """Аналитика пользователя в чате по сырой истории (индекс (chat_id, user_id, ts))."""
+    cid, uid = str(chat_id), str(user_id)
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.execute("""SELECT COUNT(*), AVG(LENGTH(content)), MAX(ts)
+                     FROM chat_history WHERE chat_id=? AND user_id=?""", (cid, uid))
+        total, avg_len, last_ts = c.fetchone()
+        if not total:
+            return {}
+        c.execute("""SELECT CAST(strftime('%H', ts, 'unixepoch', 'localtime') AS INTEGER) AS hour, COUNT(*)
+                     FROM chat_history WHERE chat_id=? AND user_id=? GROUP BY hour""", (cid, uid))
+        hourly = {hour: n for (hour, n) in c.fetchall()}
+    return {
+        "message_count": total,
+        "avg_length": avg_len or 0.0,
+        "last_ts": last_ts,
+        "hourly": hourly
+    }
+
+def db_get_chat_texts(chat_id: int, user_id: Optional[int] = None,
+                      limit: int = 1000) -> Tuple[List[str], float]:
+    """Тексты пользовательских сообщений (без остальных колонок) – для частотного анализа слов.
+
+    Возвращает (тексты, ts самого нового из них или 0.0).
+    """
+    sql = "SELECT content, ts FROM chat_history WHERE chat_id=? AND role='user'"
+    params: List[Any] = [str(chat_id)]
+    if user_id is not None:
+        sql += " AND user_id=?"
+        params.append(str(user_id))
+    sql += " ORDER BY ts DESC LIMIT ?"
+    params.append(limit)
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.execute(sql, params)
+        rows = c.fetchall()
+    return [t for (t, _ts) in rows], (rows[0][1] if rows else 0.0)
+
+def db_get_all_chat_stats(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Агрегаты всех чатов одним запросом, самые активные первыми."""
+    sql = "SELECT chat_id, message_count, user_count, first_ts, last_ts FROM chat_stats ORDER BY message_count DESC"
+    params: Tuple = ()
+    if limit:
+        sql += " LIMIT ?"
+        params = (limit,)
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.execute(sql, params)
+        rows = c.fetchall()
+    return [{"chat_id": _int_id(cid), "message_count": mc, "user_count": uc, "first_ts": f, "last_ts": l}
+            for (cid, mc, uc, f, l) in rows]
+
+def db_get_global_totals() -> Dict[str, Any]:
+    """Глобальные итоги по агрегатам: чаты, сообщения, уникальные пользователи."""
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.execute("SELECT COUNT(*), COALESCE(SUM(message_count),0) FROM chat_stats")
+        chats, messages = c.fetchone()
+        c.execute("SELECT COUNT(*) FROM user_stats")
+        users = c.fetchone()[0]
+    return {"total_chats": chats, "total_messages": messages, "total_users": users}
+
+def db_compact_rollups(retention_hours: int = 48, now: Optional[float] = None) -> int:
+    """Сжимает почасовые роллапы старше retention_hours в суточные.
+
+    Граница выравнивается на начало локальных суток, так что каждые сутки лежат
+    целиком либо в почасовой, либо в суточной таблице. Возвращает число сжатых строк.
+    """
+    now = time.time() if now is None else now
+    cutoff = _day_start(now - retention_hours * 3600)
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.execute("""SELECT chat_id, user_id, bucket_ts, message_count, total_length
+                     FROM chat_stats_hourly WHERE bucket_ts<?""", (cutoff,))
+        rows = c.fetchall()
+        if not rows:
+            return 0
+        daily: Dict[Tuple[str, str, int], List[int]] = {}
+        for chat_id, user_id, bucket_ts, count, length in rows:
+            acc = daily.setdefault((chat_id, user_id, _day_start(bucket_ts)), [0, 0])
+            acc[0] += count
+            acc[1] += length
+        c.executemany("""INSERT INTO chat_stats_daily(chat_id,user_id,bucket_ts,message_count,total_length)
+                         VALUES(?,?,?,?,?)
+                         ON CONFLICT(chat_id,user_id,bucket_ts) DO UPDATE SET
+                           message_count=message_count+excluded.message_count,
+                           total_length=total_length+excluded.total_length""",
+                      [(cid, uid, day, n, ln) for (cid, uid, day), (n, ln) in daily.items()])
+        c.execute("DELETE FROM chat_stats_hourly WHERE bucket_ts<?", (cutoff,))
+        conn.commit()
+    return len(rows)
+
+def db_get_rollup_period(since_ts: float, chat_id: Optional[int] = None, top: int = 10) -> Dict[str, Any]:
+    """Точные итоги за период из роллапов – не зависит от того, сколько сырой истории хранится.
+
+    Почасовая часть точна до часа; в уже сжатой суточной части начало периода
+    округляется вниз до начала суток.
+    """
+    hour_from = _hour_start(since_ts)
+    day_from = _day_start(since_ts)
+    where = ""
+    params: List[Any] = [hour_from]
+    if chat_id is not None:
+        where = " AND chat_id=?"
+        params.append(str(chat_id))
+    params.append(day_from)
+    if chat_id is not None:
+        params.append(str(chat_id))
+    rollup = f"""WITH r AS (
+                    SELECT chat_id, user_id, bucket_ts, message_count, total_length
+                    FROM chat_stats_hourly WHERE bucket_ts>=?{where}
+                    UNION ALL
+                    SELECT chat_id, user_id, bucket_ts, message_count, total_length
+                    FROM chat_stats_daily WHERE bucket_ts>=?{where})"""
+    with closing(get_db_connection()) as conn:
+        c = conn.cursor()
+        c.execute(f"""{rollup}
+                      SELECT COALESCE(SUM(message_count),0), COALESCE(SUM(total_length),0),
+                             COUNT(DISTINCT NULLIF(user_id,'')), COUNT(DISTINCT chat_id) FROM r""", params)
+        messages, length, users, chats = c.fetchone()
+        c.execute(f"""{rollup}
+                      SELECT user_id, SUM(message_count) AS n FROM r WHERE user_id!=''
+                      GROUP BY user_id ORDER BY n DESC LIMIT ?""", params + [top])
+        top_users = [(_int_id(u), n) for (u, n) in c.fetchall()]
+        c.execute(f"""{rollup}
+                      SELECT chat_id, SUM(message_count) AS n FROM r
+                      GROUP BY chat_id ORDER BY n DESC LIMIT ?""", params + [top])
+        top_chats = [(_int_id(cid), n) for (cid, n) in c.fetchall()]
+        c.execute(f"""{rollup}
+                      SELECT bucket_ts, SUM(message_count) FROM r GROUP BY bucket_ts""", params)
+        buckets = c.fetchall()
+    daily: Dict[str, int] = {}
+    for bucket_ts, n in buckets:
+        day = time.strftime("%Y-%m-%d", time.localtime(bucket_ts))
+        daily[day] = daily.get(day, 0) + n
+    return {
+        "message_count": messages,
+        "total_length": length,
+        "user_count": users,
+        "chat_count": chats,
+        "top_users": top_users,
+        "top_chats": top_chats,
+        "daily": daily
+    }
 
 def db_get_last_activity(chat_id: int) -> Optional[float]:
     """Получает время последней активности в чате."""
@@ -0,0 +1,308 @@
+"""
+Асинхронный доступ к БД для веб-панели (aiosqlite).
+
+Синхронные функции services.database блокируют event loop uvicorn, поэтому
+веб-панель читает через пул read-only соединений aiosqlite (каждое – свой
+поток), а редкие записи (бан, режим чата) идут через одно пишущее соединение
+под замком. Все списки – постраничные запросы по индексам агрегатов.
+"""
+
+import asyncio
+import base64
+import heapq
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import aiosqlite
+
+from bot_groq.config.settings import settings
+from bot_groq.services.database import initialize_database, _int_id
+
+CHAT_MODES = ("toxic", "friendly", "neutral", "silent")
+# Системный «профиль» чата, где /set_mode хранит режим
+CHAT_SYSTEM_USER = "0"
+
+# Окно «активных» пользователей чата в списке чатов (как в get_chat_analytics)
+ACTIVE_WINDOW_SEC = 7 * 86400
+FAVORITE_WORDS = 3
+
+# Сортировка списка пользователей: (ключ в user_stats, направление). Второй ключ –
+# user_id в том же направлении, поэтому страница – диапазон индекса (ключ, user_id).
+_USER_SORTS = {
+    "last_seen": ("last_ts", "DESC"),
+    "messages": ("message_count", "DESC"),
+    "chats": ("chat_count", "DESC"),
+    "name": ("display_name COLLATE NOCASE", "ASC"),
+    "user_id": (None, "ASC"),
+}
+
+def _like(search: str) -> str:
+    escaped = search.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+def encode_cursor(values: List[Any]) -> str:
+    """Курсор страницы: ключ сортировки и user_id последней строки."""
+    return base64.urlsafe_b64encode(json.dumps(values, ensure_ascii=False).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    """Разбирает курсор из encode_cursor (ValueError – битый курсор)."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("invalid cursor")
+    return values
+
+class DatabaseService:
+    """Async-сервис БД веб-панели с пулом read-only соединений."""
+
+    def __init__(self, db_path: Optional[str] = None, pool_size: Optional[int] = None):
+        self._db_path = db_path
+        self._pool_size = pool_size
+        self._pool: Optional[asyncio.Queue] = None
+        self._readers: List[aiosqlite.Connection] = []
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._init_lock = asyncio.Lock()
+
+    @property
+    def db_path(self) -> str:
+        return os.path.abspath(self._db_path or settings.db_name)
+
+    async def _ensure_pool(self) -> asyncio.Queue:
+        if self._pool is not None:
+            return self._pool
+        async with self._init_lock:
+            if self._pool is None:
+                # Схема и миграции – синхронным кодом, один раз, вне event loop
+                await asyncio.to_thread(initialize_database)
+                size = max(1, self._pool_size or settings.db_read_pool_size)
+                pool: asyncio.Queue = asyncio.Queue()
+                for _ in range(size):
+                    conn = await aiosqlite.connect(f"file:{self.db_path}?mode=ro", uri=True)
+                    conn.row_factory = aiosqlite.Row
+                    await conn.execute("PRAGMA query_only=1")
+                    self._readers.append(conn)
+                    pool.put_nowait(conn)
+                self._pool = pool
+        return self._pool
+
+    @asynccontextmanager
+    async def _read(self) -> AsyncIterator[aiosqlite.Connection]:
+        pool = await self._ensure_pool()
+        conn = await pool.get()
+        try:
+            yield conn
+        finally:
+            pool.put_nowait(conn)
+
+    @asynccontextmanager
+    async def _write(self) -> AsyncIterator[aiosqlite.Connection]:
+        await self._ensure_pool()
+        async with self._write_lock:
+            if self._writer is None:
+                self._writer = await aiosqlite.connect(self.db_path)
+            yield self._writer
+
+    async def close(self):
+        """Закрывает все соединения (shutdown веб-приложения)."""
+        for conn in self._readers:
+            await conn.close()
+        self._readers.clear()
+        self._pool = None
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+
+    # --- Чаты ---
+    # Всё для строки списка – из агрегатов: одна выборка на страницу, без запросов на каждый чат
+    _CHAT_SELECT = """SELECT s.chat_id, s.message_count, s.user_count, s.first_ts, s.last_ts,
+                             (SELECT COUNT(*) FROM chat_user_stats u
+                              WHERE u.chat_id=s.chat_id AND u.last_ts>=:active_since) AS active_users,
+                             json_extract(p.profile_json, '$.bot_mode') AS mode
+                      FROM chat_stats s
+                      LEFT JOIN person_profile p ON p.chat_id=s.chat_id AND p.user_id='0'"""
+
+    @staticmethod
+    def _chat_row(row: aiosqlite.Row) -> Dict[str, Any]:
+        return {
+            "chat_id": _int_id(row["chat_id"]),
+            "message_count": row["message_count"],
+            "total_messages": row["message_count"],
+            "user_count": row["user_count"],
+            "active_users": row["active_users"],
+            "avg_toxicity": 0.0,  # токсичность пока не считается (см. ChatAnalytics.toxicity_index)
+            "first_activity": row["first_ts"],
+            "last_activity": row["last_ts"],
+            "mode": row["mode"] or "toxic",
+        }
+
+    async def search_chats(self, search: str = "", limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+        """Чаты по подстроке ID, самые свежие первыми."""
+        sql = self._CHAT_SELECT
+        params: Dict[str, Any] = {"active_since": time.time() - ACTIVE_WINDOW_SEC,
+                                  "limit": limit, "offset": offset}
+        if search.strip():
+            sql += " WHERE s.chat_id LIKE :search ESCAPE '\\'"
+            params["search"] = _like(search)
+        sql += " ORDER BY s.last_ts DESC LIMIT :limit OFFSET :offset"
+        async with self._read() as conn:
+            async with conn.execute(sql, params) as cur:
+                return [self._chat_row(r) for r in await cur.fetchall()]
+
+    async def get_all_chats(self, limit: int = 500, offset: int = 0) -> List[Dict[str, Any]]:
+        return await self.search_chats("", limit, offset)
+
+    async def get_recent_active_chats(self, limit: int = 10) -> List[Dict[str, Any]]:
+        return await self.search_chats("", limit, 0)
+
+    async def get_active_chats(self, window_sec: int = 86400) -> List[Dict[str, Any]]:
+        """Чаты с активностью за последние window_sec секунд (индекс по last_ts)."""
+        async with self._read() as conn:
+            async with conn.execute(self._CHAT_SELECT + " WHERE s.last_ts>=:since ORDER BY s.last_ts DESC",
+                                    {"since": time.time() - window_sec,
+                                     "active_since": time.time() - ACTIVE_WINDOW_SEC}) as cur:
+                return [self._chat_row(r) for r in await cur.fetchall()]
+
+    async def count_active_chats(self, window_sec: int = 86400) -> int:
+        """Число активных за window_sec чатов (только по индексу last_ts)."""
+        async with self._read() as conn:
+            async with conn.execute("SELECT COUNT(*) FROM chat_stats WHERE last_ts>=?",
+                                    (time.time() - window_sec,)) as cur:
+                return (await cur.fetchone())[0]
+
+    async def update_chat_mode(self, chat_id: int, mode: str):
+        """Меняет режим бота в чате (там же, где его хранит /set_mode)."""
+        if mode not in CHAT_MODES:
+            raise ValueError(f"mode must be one of: {', '.join(CHAT_MODES)}")
+        async with self._write() as conn:
+            await conn.execute("""INSERT INTO person_profile(chat_id,user_id,profile_json,updated_ts)
+                                  VALUES(?,?,?,?)
+                                  ON CONFLICT(chat_id,user_id) DO UPDATE SET
+                                    profile_json=json_set(profile_json, '$.bot_mode', ?),
+                                    updated_ts=excluded.updated_ts""",
+                               (str(chat_id), CHAT_SYSTEM_USER, json.dumps({"bot_mode": mode}), time.time(), mode))
+            await conn.commit()
+
+    # --- Пользователи ---
+    async def search_users(self, search: str = "", limit: int = 50, sort_by: str = "last_seen",
+                           cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Пользователи по всем чатам: поиск по ID, username или имени; сортировка и keyset-пагинация.
+
+        Страница – диапазон индекса user_stats после курсора прошлой страницы, без
+        OFFSET и без агрегации по chat_user_stats, так что её цена не растёт с числом
+        пользователей. Бан и любимые слова подтягиваются только для строк страницы.
+        Возвращает {"users": [...], "next_cursor": str | None}. ValueError – битый курсор.
+        """
+        key, direction = _USER_SORTS.get(sort_by, _USER_SORTS["last_seen"])
+        columns = [key, "user_id"] if key else ["user_id"]
+        conditions: List[str] = []
+        params: List[Any] = []
+        if search.strip():
+            pattern = _like(search)
+            conditions.append("(user_id LIKE ? ESCAPE '\\' OR username LIKE ? ESCAPE '\\'"
+                              " OR display_name LIKE ? ESCAPE '\\')")
+            params += [pattern, pattern, pattern]
+        if cursor:
+            after = decode_cursor(cursor, len(columns))
+            op = "<" if direction == "DESC" else ">"
+            # Первое условие ограничивает диапазон индекса, второе отсекает уже выданные строки
+            conditions.append(f"{columns[0]} {op}= ? AND ({', '.join(columns)}) {op} ({', '.join('?' * len(columns))})")
+            params += [after[0], *after]
+        where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+        order = ", ".join(f"{c} {direction}" for c in columns)
+        sql = f"""SELECT user_id, chat_count, message_count, last_ts, display_name, username,
+                         EXISTS(SELECT 1 FROM user_bans b WHERE b.user_id=s.user_id
+                                AND (b.until_ts IS NULL OR b.until_ts>?)) AS is_banned
+                  FROM user_stats s {where} ORDER BY {order} LIMIT ?"""
+        async with self._read() as conn:
+            async with conn.execute(sql, [time.time(), *params, limit]) as cur:
+                rows = await cur.fetchall()
+            favorites = await self._favorite_words(conn, [r["user_id"] for r in rows])
+        next_cursor = None
+        if rows and len(rows) == limit:
+            last = rows[-1]
+            sort_value = {"last_ts": last["last_ts"], "message_count": last["message_count"],
+                          "chat_count": last["chat_count"]}.get(key, last["display_name"])
+            next_cursor = encode_cursor([sort_value, last["user_id"]] if key else [last["user_id"]])
+        users = [{
+            "user_id": _int_id(r["user_id"]),
+            "username": r["username"],
+            "display_name": r["display_name"] or f"User_{r['user_id']}",
+            "chats": r["chat_count"],
+            "total_messages": r["message_count"],
+            "last_seen": r["last_ts"],
+            "avg_toxicity": 0.0,  # токсичность пока не считается
+            "favorite_words": favorites.get(r["user_id"], []),
+            "is_banned": bool(r["is_banned"]),
+        } for r in rows]
+        return {"users": users, "next_cursor": next_cursor}
+
+    @staticmethod
+    async def _favorite_words(conn: aiosqlite.Connection, user_ids: List[str]) -> Dict[str, List[str]]:
+        """Топ слов пользователей страницы по всем чатам – из сохранённых частот, одним запросом."""
+        if not user_ids:
+            return {}
+        marks = ",".join("?" * len(user_ids))
+        merged: Dict[str, Dict[str, int]] = {}
+        async with conn.execute(f"SELECT user_id, data_json FROM term_stats WHERE user_id IN ({marks})",
+                                user_ids) as cur:
+            async for row in cur:
+                counts = merged.setdefault(row["user_id"], {})
+                for term, (count, _error) in json.loads(row["data_json"]).get("terms", {}).items():
+                    counts[term] = counts.get(term, 0) + count
+        return {uid: heapq.nlargest(FAVORITE_WORDS, counts, key=counts.get) for uid, counts in merged.items()}
+
+    async def ban_user(self, chat_id: int, user_id: int, reason: str = "",
+                       ban_until: Optional[datetime] = None):
+        """Банит пользователя в чате (ban_until=None – бессрочно)."""
+        until_ts = ban_until.timestamp() if ban_until else None
+        async with self._write() as conn:
+            await conn.execute("""INSERT INTO user_bans(chat_id,user_id,reason,banned_ts,until_ts) VALUES(?,?,?,?,?)
+                                  ON CONFLICT(chat_id,user_id) DO UPDATE SET
+                                    reason=excluded.reason, banned_ts=excluded.banned_ts, until_ts=excluded.until_ts""",
+                               (str(chat_id), str(user_id), reason, time.time(), until_ts))
+            await conn.commit()
+
+    # --- Версии данных (для ETag веб-панели) ---
+    async def data_version(self, chat_id: Optional[int] = None) -> Dict[str, Any]:
+        """Дешёвый «номер версии» данных: меняется при новом сообщении, смене режима,
+        бане или сбросе частот слов (term_stats пишется с задержкой после сообщений).
+
+        chat_id=None – по всем чатам. Все подзапросы идут по индексам или по
+        маленьким таблицам. Возвращает {"version": tuple, "last_modified": ts}.
+        """
+        if chat_id is None:
+            sql = """SELECT (SELECT COUNT(*) FROM chat_stats), (SELECT MAX(last_ts) FROM chat_stats),
+                            (SELECT MAX(updated_ts) FROM person_profile WHERE user_id='0'),
+                            (SELECT COUNT(*) FROM user_bans), (SELECT MAX(banned_ts) FROM user_bans),
+                            (SELECT MAX(updated_ts) FROM term_stats)"""
+            params: tuple = ()
+        else:
+            sql = """SELECT (SELECT message_count FROM chat_stats WHERE chat_id=?1),
+                            (SELECT last_ts FROM chat_stats WHERE chat_id=?1),
+                            (SELECT updated_ts FROM person_profile WHERE chat_id=?1 AND user_id='0'),
+                            (SELECT COUNT(*) FROM user_bans WHERE chat_id=?1),
+                            (SELECT MAX(banned_ts) FROM user_bans WHERE chat_id=?1),
+                            (SELECT MAX(updated_ts) FROM term_stats WHERE chat_id=?1)"""
+            params = (str(chat_id),)
+        async with self._read() as conn:
+            async with conn.execute(sql, params) as cur:
+                row = tuple(await cur.fetchone())
+        stamps = [v for v in (row[1], row[2], row[4], row[5]) if v]
+        return {"version": row, "last_modified": max(stamps) if stamps else 0.0}
+
+    async def health_check(self) -> bool:
+        """Проверяет, что БД отвечает (исключение – если нет)."""
+        async with self._read() as conn:
+            async with conn.execute("SELECT 1") as cur:
+                await cur.fetchone()
+        return True
+
+# Глобальный экземпляр
+database_service = DatabaseService()
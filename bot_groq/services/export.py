@@ -0,0 +1,123 @@
+"""
+Потоковый экспорт истории чатов (JSON / NDJSON / CSV, опционально gzip).
+
+История читается пачками с keyset-пагинацией (db_iter_chat_history), каждая
+пачка сразу сериализуется в байтовый чанк. Память не зависит от размера
+экспорта: чанки уходят либо во временный файл (/export_data), либо прямо в
+StreamingResponse веб-панели.
+"""
+
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+import zlib
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from bot_groq.services.database import db_count_chat_history, db_iter_chat_history
+
+# формат -> (MIME, расширение)
+EXPORT_FORMATS = {
+    "json": ("application/json", ".json"),
+    "ndjson": ("application/x-ndjson", ".ndjson"),
+    "csv": ("text/csv", ".csv"),
+}
+MESSAGE_FIELDS = ("chat_id", "user_id", "username", "role", "ts", "content")
+
+ProgressCallback = Callable[[int, int], None]
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, default=str)
+
+def iter_export(chat_id: Optional[int], fmt: str = "json", meta: Optional[Dict[str, Any]] = None,
+                batch_size: int = 500, progress: Optional[ProgressCallback] = None) -> Iterator[bytes]:
+    """Генерирует экспорт чата (или всех чатов при chat_id=None) байтовыми чанками.
+
+    json   – один документ {..meta, "messages": [...]}, как и прежний экспорт;
+    ndjson – строка {"type": "meta"}, затем по строке {"type": "message"} на сообщение;
+    csv    – только сообщения, с заголовком.
+    progress(done, total) вызывается после каждой пачки.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+    header = {"chat_id": chat_id, "export_time": time.time(), **(meta or {})}
+    total = db_count_chat_history(chat_id) if progress else 0
+    done = 0
+
+    if fmt == "json":
+        # Шапка – тот же объект без закрывающей скобки, дальше массив сообщений
+        yield (_dumps(header)[:-1] + ', "messages": [').encode("utf-8")
+    elif fmt == "ndjson":
+        yield (_dumps({"type": "meta", **header}) + "\n").encode("utf-8")
+    else:
+        buf = io.StringIO()
+        csv.writer(buf).writerow(MESSAGE_FIELDS)
+        yield buf.getvalue().encode("utf-8")
+
+    first = True
+    for batch in db_iter_chat_history(chat_id, batch_size=batch_size):
+        if fmt == "json":
+            parts = []
+            for row in batch:
+                parts.append(("\n" if first else ",\n") + _dumps(row))
+                first = False
+            chunk = "".join(parts)
+        elif fmt == "ndjson":
+            chunk = "".join(_dumps({"type": "message", **row}) + "\n" for row in batch)
+        else:
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerows([row.get(f) for f in MESSAGE_FIELDS] for row in batch)
+            chunk = buf.getvalue()
+        yield chunk.encode("utf-8")
+        done += len(batch)
+        if progress:
+            progress(done, total)
+
+    if fmt == "json":
+        yield b"\n]}\n"
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Сжимает поток чанков в gzip на лету."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_filename(chat_id: Optional[int], fmt: str, compress: bool = False) -> str:
+    """Имя файла экспорта."""
+    scope = chat_id if chat_id is not None else "all"
+    return f"chat_export_{scope}_{int(time.time())}{EXPORT_FORMATS[fmt][1]}" + (".gz" if compress else "")
+
+def write_export(f: BinaryIO, chat_id: Optional[int], fmt: str = "json", compress: bool = False,
+                 meta: Optional[Dict[str, Any]] = None, progress: Optional[ProgressCallback] = None) -> int:
+    """Пишет экспорт в открытый бинарный файл чанками. Возвращает число байт."""
+    chunks = iter_export(chat_id, fmt, meta=meta, progress=progress)
+    if compress:
+        chunks = gzip_chunks(chunks)
+    written = 0
+    for chunk in chunks:
+        f.write(chunk)
+        written += len(chunk)
+    return written
+
+def export_to_file(chat_id: Optional[int], fmt: str = "json", compress: bool = False,
+                   meta: Optional[Dict[str, Any]] = None,
+                   progress: Optional[ProgressCallback] = None) -> Tuple[str, str]:
+    """Пишет экспорт во временный файл чанками. Возвращает (путь, имя файла).
+
+    Удалить файл после отправки – забота вызывающего.
+    """
+    filename = export_filename(chat_id, fmt, compress)
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write_export(f, chat_id, fmt, compress, meta, progress)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, filename
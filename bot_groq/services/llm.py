@@ -85,31 +85,53 @@ BAD_PATTERNS = [
 ]
 _bad_re = re.compile("|".join(BAD_PATTERNS), re.IGNORECASE)
 
+# Плейсхолдеры имени и упоминания, которые модель любит вставлять
+_name_placeholder_re = re.compile(r"@имя|[\[\{<]\s*имя\s*[\]\}>]", re.IGNORECASE)
+_mention_re = re.compile(r"@\w+")
+_spaces_re = re.compile(r"\s{3,}")
+_newlines_re = re.compile(r"\n{3,}")
+
+# Стандартные безопасные дисклеймеры в начале ответа – стиль должен оставаться язвительным.
+# Каждый снимается не больше одного раза и строго в этом порядке.
+DISCLAIMER_PATTERNS = [
+    r"i'?m\s+sorr(?:y|ie)\b.*",
+    r"sorry[,!]?\b.*",
+    r"i\s+cannot\s+comply.*",
+    r"i\s+can'?t\s+.*",
+    r"i\s+am\s+unable.*",
+    r"as an? (?:ai|large language|language) model[^\n]*",
+    r"i do not have (?:the )?ability.*",
+    r"i (?:will|must) not (?:provide|comply).*",
+]
+_disclaimer_res = [re.compile(p, re.IGNORECASE) for p in DISCLAIMER_PATTERNS]
+
+def _strip_disclaimers(text: str) -> str:
+    for pattern in _disclaimer_res:
+        m = pattern.match(text)
+        if m:
+            text = text[m.end():].strip()
+    return text
+
+def sanitize_reply(text: str) -> str:
+    """Единственная обработка ответа LLM перед отправкой – вызывается ровно один раз на ответ.
+
+    Результат совпадает с прежней цепочкой post_filter(clean_reply(text)),
+    но все регексы скомпилированы заранее.
+    """
+    return post_filter(clean_reply(text))
+
 def clean_reply(t: str) -> str:
     """Удаляет из ответа упоминания и лишние пробелы."""
-    t = re.sub(r'@имя|[\[\{<]\s*имя\s*[\]\}>]', '', t, flags=re.IGNORECASE)
-    t = re.sub(r'@\w+', '', t)
-    t = re.sub(r'\s{3,}', '  ', t)
+    t = _name_placeholder_re.sub("", t)
+    t = _mention_re.sub("", t)
+    t = _spaces_re.sub("  ", t)
     return t.strip()
 
 def post_filter(text: str) -> str:
     """Фильтрует ответ от LLM, удаляя нежелательные паттерны."""
     cleaned = _bad_re.sub("", text)
-    cleaned = re.sub(r"\n{3,}", "\n\n", cleaned).strip()
-    # Удаляем стандартные безопасные дисклеймеры, чтобы стиль оставался язвительным
-    disclaimer_patterns = [
-        r"^(i'?m\s+sorr(y|ie)\b.*)",
-        r"^sorry[,!]?\b.*",
-        r"^i\s+cannot\s+comply.*",
-        r"^i\s+can'?t\s+.*",
-        r"^i\s+am\s+unable.*",
-        r"^as an? (ai|large language|language) model[^\n]*",
-        r"^i do not have (the )?ability.*",
-        r"^i (will|must) not (provide|comply).*",
-    ]
-    for pat in disclaimer_patterns:
-        cleaned = re.sub(pat, "", cleaned, flags=re.IGNORECASE).strip()
-    return cleaned or "По делу."
+    cleaned = _newlines_re.sub("\n\n", cleaned).strip()
+    return _strip_disclaimers(cleaned) or "По делу."
 
 async def llm_text(
     prompt_or_messages: Union[str, List[Dict[str, Any]]],
@@ -187,7 +209,7 @@ async def llm_text(
             max_tokens=max_tokens
         )
         out = (resp.choices[0].message.content or "").strip()
-        cleaned = post_filter(clean_reply(out)) or "Пусто"
+        cleaned = sanitize_reply(out) or "Пусто"
         # Укорачиваем если включен короткий режим: оставляем 1-2 предложения
         from bot_groq.config.settings import settings as _s
         if _s.reply_short_mode:
@@ -207,33 +229,51 @@ async def llm_text(
     except Exception as e:
         return f"Ошибка LLM: {e}"
 
-def llm_vision(system_prompt: str, image_url: str, user_prompt: str) -> str:
+def vision_completion(model_name: str, system_prompt: str, image_url: str, user_prompt: str,
+                      timeout: Optional[float] = None) -> str:
+    """Один блокирующий запрос к конкретной Vision-модели (ошибки пробрасываются).
+
+    timeout – таймаут HTTP-запроса в клиенте Groq: по его истечении поток освобождается.
     """
-    Отправляет запрос к Vision-модели LLM.
-    Пробует несколько моделей из списка, если первая не удалась.
+    resp = get_groq_client().chat.completions.create(
+        model=model_name,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": [
+                {"type": "text", "text": user_prompt},
+                {"type": "image_url", "image_url": {"url": image_url}}
+            ]}
+        ],
+        temperature=0.4,
+        max_tokens=1024,
+        timeout=timeout
+    )
+    out = resp.choices[0].message.content.strip()
+    return sanitize_reply(out)
+
+def vision_request(system_prompt: str, image_url: str, user_prompt: str) -> str:
+    """
+    Запрос к Vision-модели LLM с перебором моделей из VISION_FALLBACKS.
+    Если не ответила ни одна – пробрасывает последнюю ошибку.
     """
     last_err = None
     for model_name in VISION_FALLBACKS:
         try:
-            resp = get_groq_client().chat.completions.create(
-                model=model_name,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": [
-                        {"type": "text", "text": user_prompt},
-                        {"type": "image_url", "image_url": {"url": image_url}}
-                    ]}
-                ],
-                temperature=0.4,
-                max_tokens=1024
-            )
-            out = resp.choices[0].message.content.strip()
-            return post_filter(clean_reply(out))
+            return vision_completion(model_name, system_prompt, image_url, user_prompt)
         except Exception as e:
             last_err = e
             continue
-    
-    return f"Ошибка vision-запроса: {last_err}"
+    raise RuntimeError(f"все vision-модели недоступны: {last_err}")
+
+def llm_vision(system_prompt: str, image_url: str, user_prompt: str) -> str:
+    """
+    Отправляет запрос к Vision-модели LLM.
+    Пробует несколько моделей из списка, если первая не удалась.
+    """
+    try:
+        return vision_request(system_prompt, image_url, user_prompt)
+    except Exception as e:
+        return f"Ошибка vision-запроса: {e}"
 
 async def ai_bit(mode: str, context: str = "", style_addon: str = "", system_prompt: str = "", model: str = None) -> str:
     """
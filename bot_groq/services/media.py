@@ -0,0 +1,96 @@
+"""
+Загрузка медиа из Telegram для vision.
+
+Одна общая aiohttp-сессия с keep-alive вместо новой на каждое фото. Файл
+читается потоком в буфер в памяти с жёстким лимитом размера – без временных
+файлов и лишних копий, base64 для data URL считается прямо из буфера.
+Размер фото выбирается под целевое разрешение и бюджет байт, а не всегда
+самый большой.
+"""
+
+import base64
+from typing import Optional, Sequence
+
+import aiohttp
+
+from bot_groq.config.settings import settings
+from bot_groq.utils.logging import core_logger
+
+CHUNK_SIZE = 64 * 1024
+# Грубая оценка размера JPEG, если Telegram не прислал file_size
+JPEG_BYTES_PER_PIXEL = 0.25
+
+class MediaTooLarge(Exception):
+    """Файл больше допустимого лимита."""
+
+def _estimated_size(photo) -> int:
+    if getattr(photo, "file_size", None):
+        return photo.file_size
+    return int(photo.width * photo.height * JPEG_BYTES_PER_PIXEL)
+
+def pick_photo_size(photos: Sequence, max_bytes: Optional[int] = None, target_side: Optional[int] = None):
+    """Вариант фото для vision.
+
+    Самый маленький, у которого длинная сторона не меньше target_side и размер
+    в бюджете байт; если такого нет – самый крупный в бюджете; если ни один
+    не влез – самый маленький.
+    """
+    budget = max_bytes or settings.vision_image_max_bytes
+    target = target_side or settings.vision_target_side
+    ordered = sorted(photos, key=lambda p: p.width * p.height)
+    fitting = [p for p in ordered if _estimated_size(p) <= budget]
+    for p in fitting:
+        if max(p.width, p.height) >= target:
+            return p
+    return fitting[-1] if fitting else ordered[0]
+
+def to_data_url(data: bytes, mime: str = "image/jpeg") -> str:
+    """data: URL из байтов в памяти."""
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+class MediaFetcher:
+    """Скачивание файлов через одну переиспользуемую сессию."""
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=settings.media_download_timeout),
+                connector=aiohttp.TCPConnector(limit=16, keepalive_timeout=60),
+            )
+        return self._session
+
+    async def fetch(self, url: str, max_bytes: Optional[int] = None) -> Optional[bytearray]:
+        """Читает URL потоком в память. None – ошибка HTTP; MediaTooLarge – превышен лимит."""
+        limit = max_bytes or settings.media_download_max_bytes
+        async with self._get_session().get(url) as response:
+            if response.status != 200:
+                core_logger.logger.warning("media_fetch_failed", status=response.status)
+                return None
+            if response.content_length and response.content_length > limit:
+                raise MediaTooLarge(f"{response.content_length} > {limit} bytes")
+            buf = bytearray()
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                buf += chunk
+                if len(buf) > limit:
+                    raise MediaTooLarge(f"more than {limit} bytes")
+            return buf
+
+    async def fetch_telegram_file(self, bot, file_id: str, max_bytes: Optional[int] = None) -> Optional[bytearray]:
+        """Скачивает файл Telegram по file_id в память."""
+        limit = max_bytes or settings.media_download_max_bytes
+        file = await bot.get_file(file_id)
+        if file.file_size and file.file_size > limit:
+            raise MediaTooLarge(f"{file.file_size} > {limit} bytes")
+        return await self.fetch(f"https://api.telegram.org/file/bot{bot.token}/{file.file_path}", limit)
+
+    async def close(self):
+        """Закрывает сессию (shutdown бота)."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+# Глобальный экземпляр
+media_fetcher = MediaFetcher()
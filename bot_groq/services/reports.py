@@ -0,0 +1,252 @@
+"""
+Фоновые задачи отчётов для веб-панели.
+
+POST /api/reports/generate ставит задачу в таблицу report_jobs и сразу
+возвращает task_id; статус и прогресс читаются через GET /api/reports/{task_id}.
+Одновременно строится не больше settings.report_workers отчётов: аналитика –
+в пуле потоков, тяжёлый экспорт (сериализация + gzip) – в пуле процессов.
+Прогресс воркер пишет прямо в report_jobs, поэтому он виден из любого процесса.
+
+Каждая задача помечена владельцем (хост, pid и случайный boot id процесса),
+который, пока строит или ждёт очереди, раз в REPORT_HEARTBEAT_SEC обновляет
+её пульс. Проваленными считаются только задачи с пульсом старше
+REPORT_STALE_SEC – их владелец умер; задачи соседних воркеров не трогаются.
+
+Результаты кэшируются по хешу параметров: повторный запрос с теми же
+параметрами, пока прошлый отчёт строится или не истёк (report_ttl_hours),
+возвращает ту же задачу. Истёкшие задачи и их файлы удаляются.
+"""
+
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import socket
+import time
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from bot_groq.config.settings import settings
+from bot_groq.services.database import (
+    db_create_report_job, db_update_report_job, db_get_report_job, db_find_report_job,
+    db_heartbeat_report_jobs, db_fail_interrupted_report_jobs, db_expire_report_jobs
+)
+from bot_groq.services.export import EXPORT_FORMATS, write_export
+from bot_groq.utils.logging import core_logger
+
+REPORT_TYPES = ("global", "chat", "user", "export")
+# Отчёты, которые строятся в отдельном процессе (CPU-bound)
+CPU_HEAVY_REPORTS = {"export"}
+CLEANUP_EVERY = 60  # не чаще раза в минуту при постановке задач
+REPORT_HEARTBEAT_SEC = 15.0
+# Задача без пульса дольше этого брошена (с запасом на паузы event loop)
+REPORT_STALE_SEC = 4 * REPORT_HEARTBEAT_SEC
+
+def report_params(report_type: str, format: str = "json", period: str = "7d",
+                  chat_id: Optional[int] = None, user_id: Optional[int] = None,
+                  gzip: bool = False) -> Dict[str, Any]:
+    """Проверяет и нормализует параметры (неважные для типа – обнуляются, чтобы кэш совпадал)."""
+    if report_type not in REPORT_TYPES:
+        raise ValueError(f"report_type must be one of: {', '.join(REPORT_TYPES)}")
+    if report_type == "export":
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+        return {"report_type": report_type, "format": format, "period": None,
+                "chat_id": chat_id, "user_id": None, "gzip": bool(gzip)}
+    if format != "json":
+        raise ValueError("analytics reports support only format=json")
+    if report_type in ("chat", "user") and chat_id is None:
+        raise ValueError("chat_id is required")
+    if report_type == "user" and user_id is None:
+        raise ValueError("user_id is required")
+    return {"report_type": report_type, "format": "json",
+            "period": period if report_type in ("global", "chat") else None,
+            "chat_id": chat_id, "user_id": user_id if report_type == "user" else None, "gzip": False}
+
+def params_hash(params: Dict[str, Any]) -> str:
+    """Адрес результата: хеш канонического JSON параметров."""
+    canonical = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+def _result_extension(params: Dict[str, Any]) -> str:
+    ext = EXPORT_FORMATS[params["format"]][1]
+    return ext + (".gz" if params.get("gzip") else "")
+
+def _analytics_report(params: Dict[str, Any]) -> Dict[str, Any]:
+    from bot_groq.services.analytics import analytics_engine, report_generator, period_to_hours
+    report_type = params["report_type"]
+    if report_type == "global":
+        hours = period_to_hours(params["period"])
+        report = {"global": asdict(analytics_engine.get_global_analytics_period(hours)),
+                  "report_type": "global_summary"}
+    elif report_type == "chat":
+        report = report_generator.generate_chat_report(params["chat_id"])
+        period = analytics_engine.get_chat_analytics_period(params["chat_id"], params["period"])
+        report["period_analytics"] = asdict(period) if period else None
+    else:
+        report = report_generator.generate_user_report(params["chat_id"], params["user_id"])
+    report.update({"period": params["period"], "generated_at": datetime.now().isoformat()})
+    return report
+
+def build_report(task_id: str, params: Dict[str, Any], path: str) -> str:
+    """Строит отчёт в файл path. Выполняется в воркере (поток или отдельный процесс)."""
+    tmp = path + ".part"
+    if params["report_type"] == "export":
+        last = [0.0]
+        def on_batch(done: int, total: int):
+            now = time.time()
+            if total and now - last[0] >= 1:
+                last[0] = now
+                db_update_report_job(task_id, progress=round(min(0.99, done / total), 3))
+        with open(tmp, "wb") as f:
+            write_export(f, params["chat_id"], params["format"], params["gzip"], progress=on_batch)
+    else:
+        report = _analytics_report(params)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp, path)
+    return path
+
+class ReportJobManager:
+    """Очередь задач отчётов с ограниченным числом воркеров."""
+
+    def __init__(self):
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._processes: Optional[ProcessPoolExecutor] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._last_cleanup = 0.0
+        # Владелец задач этого процесса; boot id отличает перезапуск с тем же pid
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def _executor(self, report_type: str) -> Executor:
+        workers = max(1, settings.report_workers)
+        if report_type in CPU_HEAVY_REPORTS:
+            if self._processes is None:
+                # spawn: не форкаем процесс с работающим event loop и потоками
+                self._processes = ProcessPoolExecutor(max_workers=workers,
+                                                      mp_context=multiprocessing.get_context("spawn"))
+            return self._processes
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report")
+        return self._threads
+
+    def _ensure_started(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(1, settings.report_workers))
+
+    def _ensure_heartbeat(self):
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def _heartbeat(self):
+        """Пульс незавершённых задач процесса; останавливается, когда задач нет."""
+        while self._tasks:
+            await asyncio.sleep(REPORT_HEARTBEAT_SEC)
+            try:
+                await asyncio.to_thread(db_heartbeat_report_jobs, list(self._tasks), self.owner)
+            except Exception as e:
+                core_logger.log_error(e, {"operation": "report_heartbeat"})
+
+    def recover_interrupted(self) -> int:
+        """Помечает проваленными задачи, чей владелец перестал слать пульс – их уже никто не достроит.
+
+        Вызывается при старте веб-приложения и при периодической очистке.
+        Задачи, которые строят живые процессы, не трогаются.
+        """
+        return db_fail_interrupted_report_jobs(time.time() - REPORT_STALE_SEC)
+
+    async def submit(self, report_type: str, format: str = "json", period: str = "7d",
+                     chat_id: Optional[int] = None, user_id: Optional[int] = None,
+                     gzip: bool = False) -> Dict[str, Any]:
+        """Ставит отчёт в очередь или возвращает уже существующий с теми же параметрами.
+
+        ValueError – некорректные параметры.
+        """
+        params = report_params(report_type, format, period, chat_id, user_id, gzip)
+        self._ensure_started()
+        if time.time() - self._last_cleanup >= CLEANUP_EVERY:
+            self.cleanup_expired()
+
+        digest = params_hash(params)
+        existing = db_find_report_job(digest, stale_before=time.time() - REPORT_STALE_SEC)
+        if existing:
+            return {**self._public(existing), "cached": True}
+
+        task_id = f"report_{report_type}_{digest[:12]}_{int(time.time() * 1000)}"
+        db_create_report_job(task_id, digest, report_type, params, owner=self.owner)
+        self._tasks[task_id] = asyncio.create_task(self._run(task_id, params))
+        self._ensure_heartbeat()
+        return {**self._public(db_get_report_job(task_id)), "cached": False}
+
+    async def _run(self, task_id: str, params: Dict[str, Any]):
+        try:
+            async with self._semaphore:
+                db_update_report_job(task_id, status="running")
+                os.makedirs(settings.reports_dir, exist_ok=True)
+                path = os.path.join(settings.reports_dir, task_id + _result_extension(params))
+                loop = asyncio.get_running_loop()
+                started = time.time()
+                await loop.run_in_executor(self._executor(params["report_type"]),
+                                           build_report, task_id, params, path)
+                db_update_report_job(task_id, status="completed", progress=1.0, result_path=path,
+                                     expires_ts=time.time() + settings.report_ttl_hours * 3600)
+                core_logger.logger.info("report_completed", task_id=task_id,
+                                        duration=round(time.time() - started, 3))
+        except Exception as e:
+            core_logger.log_error(e, {"operation": "build_report", "task_id": task_id})
+            db_update_report_job(task_id, status="failed", error=str(e))
+        finally:
+            self._tasks.pop(task_id, None)
+
+    @staticmethod
+    def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "task_id": job["task_id"],
+            "report_type": job["report_type"],
+            "params": job["params"],
+            "status": job["status"],
+            "progress": job["progress"],
+            "error": job["error"],
+            "created_at": job["created_ts"],
+            "updated_at": job["updated_ts"],
+            "expires_at": job["expires_ts"],
+            "ready": job["status"] == "completed" and bool(job["result_path"])
+        }
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Статус задачи для API (None – нет такой или уже удалена)."""
+        job = db_get_report_job(task_id)
+        return self._public(job) if job else None
+
+    def result_path(self, task_id: str) -> Optional[str]:
+        """Путь к готовому файлу отчёта, если он есть и не истёк."""
+        job = db_get_report_job(task_id)
+        if not job or job["status"] != "completed" or not job["result_path"]:
+            return None
+        if job["expires_ts"] and job["expires_ts"] <= time.time():
+            return None
+        return job["result_path"] if os.path.exists(job["result_path"]) else None
+
+    def cleanup_expired(self) -> int:
+        """Удаляет истёкшие задачи и их файлы, проваливает брошенные. Возвращает число удалённых файлов."""
+        self._last_cleanup = time.time()
+        self.recover_interrupted()
+        removed = 0
+        for path in db_expire_report_jobs():
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                core_logger.log_error(e, {"operation": "report_cleanup", "path": path})
+        return removed
+
+# Глобальный экземпляр
+report_jobs = ReportJobManager()
@@ -1,18 +1,35 @@
 """
 Расширенный планировщик фоновых задач и напоминаний
+
+Задачи лежат в мин-куче по времени запуска: цикл спит ровно до ближайшего
+срока и просыпается раньше, если добавили задачу. Напоминания при старте
+загружаются из таблицы reminders; наступившие отправляются пачкой и
+удаляются одним DELETE. Завершённые задачи из планировщика убираются.
+
+Готовые задачи выполняются параллельно, число одновременных задач каждого
+типа ограничено (TASK_TYPE_LIMITS), поэтому долгая очистка БД не задерживает
+напоминания. Блокирующая работа уходит в пул потоков, у каждой задачи есть
+таймаут, повторы – с экспоненциальной задержкой и джиттером.
 """
 
 import asyncio
+import heapq
+import html
+import itertools
+import random
 import time
 import json
-from typing import Dict, List, Any, Callable, Optional, Union
+from collections import deque
+from typing import Dict, List, Any, Callable, Optional, Tuple, Union
 from dataclasses import dataclass, asdict
 from datetime import datetime, timedelta
 from enum import Enum
 from abc import ABC, abstractmethod
 
 from bot_groq.config.settings import settings
-from bot_groq.services.database import db_get_due_reminders, db_delete_reminder, db_add_reminder, db_get_last_activity
+from bot_groq.services.database import (
+    db_get_pending_reminders, db_delete_reminders, db_add_reminder, db_get_last_activity, db_compact_rollups
+)
 from bot_groq.utils.logging import core_logger
 
 class TaskType(Enum):
@@ -24,6 +41,26 @@ class TaskType(Enum):
     BACKUP = "backup"
     NOTIFICATION = "notification"
 
+# Сколько задач каждого типа может выполняться одновременно
+TASK_TYPE_LIMITS = {
+    TaskType.REMINDER: 20,
+    TaskType.IDLE_CHECK: 2,
+    TaskType.CLEANUP: 1,
+    TaskType.ANALYTICS: 1,
+    TaskType.BACKUP: 1,
+    TaskType.NOTIFICATION: 5,
+}
+DEFAULT_TASK_TIMEOUT = 60.0
+# Повторы: base * 2^(n-1), не больше max, с джиттером ±50%
+RETRY_BACKOFF_BASE = 30.0
+RETRY_BACKOFF_MAX = 3600.0
+RECENT_HISTORY = 20
+
+def retry_delay(retries: int) -> float:
+    """Задержка перед повтором номер retries (экспоненциально, с джиттером)."""
+    delay = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** max(0, retries - 1))
+    return delay * random.uniform(0.5, 1.5)
+
 class TaskStatus(Enum):
     """Статусы задач."""
     PENDING = "pending"
@@ -52,6 +89,9 @@ class BaseTask(ABC):
         self.executed_at: Optional[float] = None
         self.retries = 0
         self.max_retries = 3
+        # Для периодических задач – интервал перезапуска после успеха (секунды)
+        self.interval: Optional[float] = None
+        self.timeout: float = DEFAULT_TASK_TIMEOUT
     
     @abstractmethod
     async def execute(self) -> TaskResult:
@@ -78,13 +118,17 @@ class ReminderTask(BaseTask):
         self.user_id = user_id
         self.text = text
         self.scheduled_at = due_time
+        self.timeout = 30.0
+        self.bot = None  # выставляет планировщик
     
     async def execute(self) -> TaskResult:
-        """Выполняет напоминание."""
+        """Отправляет напоминание в чат (удаление из БД – пачкой в планировщике)."""
         try:
-            # Здесь нужен доступ к bot instance
-            # Для простоты пока возвращаем успех
-            return TaskResult(True, "Reminder task completed")
+            if self.bot is None:
+                return TaskResult(False, "Bot is not attached to scheduler")
+            mention = f'<a href="tg://user?id={self.user_id}">Напоминание</a>'
+            await self.bot.send_message(self.chat_id, f"⏰ {mention}: {html.escape(self.text)}")
+            return TaskResult(True, "Reminder sent")
             
         except Exception as e:
             core_logger.log_error(e, {"task": "reminder", "reminder_id": self.reminder_id})
@@ -95,7 +139,9 @@ class CleanupTask(BaseTask):
     
     def __init__(self):
         super().__init__("cleanup", TaskType.CLEANUP)
-        self.scheduled_at = time.time() + 3600  # Каждый час
+        self.interval = 3600  # Каждый час
+        self.scheduled_at = time.time() + self.interval
+        self.timeout = 1800.0  # VACUUM большой базы – небыстрое дело
     
     async def execute(self) -> TaskResult:
         """Выполняет очистку данных."""
@@ -105,12 +151,18 @@ class CleanupTask(BaseTask):
             # Очищаем кеш
             cache.cleanup_expired()
             
-            # Оптимизируем БД
-            db_optimizer.optimize_database()
+            # Оптимизируем БД (VACUUM/ANALYZE блокируют – в пуле потоков); по умолчанию выключено:
+            # полный VACUUM живой базы бота включается только явно
+            if settings.db_maintenance_enabled:
+                await asyncio.to_thread(db_optimizer.optimize_database)
             
-            # Планируем следующую очистку
-            self.scheduled_at = time.time() + 3600
-            self.status = TaskStatus.PENDING
+            # Удаляем истёкшие отчёты веб-панели
+            from bot_groq.services.reports import report_jobs
+            await asyncio.to_thread(report_jobs.cleanup_expired)
+            
+            # Истёкшие описания картинок
+            from bot_groq.services.database import db_purge_vision_cache
+            await asyncio.to_thread(db_purge_vision_cache)
             
             return TaskResult(True, "Cleanup completed")
             
@@ -118,14 +170,43 @@ class CleanupTask(BaseTask):
             core_logger.log_error(e, {"task": "cleanup"})
             return TaskResult(False, f"Cleanup error: {e}")
 
+class RollupCompactionTask(BaseTask):
+    """Сжатие почасовых роллапов статистики в суточные."""
+    
+    def __init__(self):
+        super().__init__("rollup_compaction", TaskType.ANALYTICS)
+        self.interval = settings.rollup_compact_every
+        self.scheduled_at = time.time() + 60
+        self.timeout = 600.0
+    
+    async def execute(self) -> TaskResult:
+        """Выполняет сжатие роллапов."""
+        try:
+            compacted = await asyncio.to_thread(db_compact_rollups, settings.rollup_hourly_retention_hours)
+            self.interval = settings.rollup_compact_every
+            return TaskResult(True, "Rollup compaction completed", {"compacted_rows": compacted})
+            
+        except Exception as e:
+            core_logger.log_error(e, {"task": "rollup_compaction"})
+            return TaskResult(False, f"Rollup compaction error: {e}")
+
 class AdvancedTaskScheduler:
     """Расширенный планировщик задач."""
     
     def __init__(self):
         self.running = False
+        self.bot = None
         self.tasks: Dict[str, BaseTask] = {}
-        self.task_history: List[Dict[str, Any]] = []
         self.max_history = 1000
+        # Кольцевой буфер последних запусков
+        self.task_history: deque = deque(maxlen=self.max_history)
+        self._semaphores = {task_type: asyncio.Semaphore(limit) for task_type, limit in TASK_TYPE_LIMITS.items()}
+        self._running: set = set()
+        # Мин-куча (срок, порядковый номер, task_id); устаревшие записи пропускаются при извлечении
+        self._heap: List[Tuple[float, int, str]] = []
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._loop_task: Optional[asyncio.Task] = None
         
         # Статистика
         self.stats = {
@@ -135,62 +216,140 @@ class AdvancedTaskScheduler:
             "retries": 0
         }
     
-    async def start(self):
-        """Запускает планировщик."""
+    async def start(self, bot=None):
+        """Запускает планировщик (bot нужен для отправки напоминаний)."""
+        self.bot = bot
         self.running = True
         
-        # Добавляем системные задачи
+        # Добавляем системные задачи и сохранённые напоминания
         await self._add_system_tasks()
+        await self._load_reminders()
         
         # Запускаем основной цикл
-        asyncio.create_task(self._scheduler_loop())
+        self._loop_task = asyncio.create_task(self._scheduler_loop())
         
         core_logger.logger.info("advanced_scheduler_started", tasks_count=len(self.tasks))
     
     async def stop(self):
         """Останавливает планировщик."""
         self.running = False
+        self._wakeup.set()
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+        for running in list(self._running):
+            running.cancel()
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
         core_logger.logger.info("advanced_scheduler_stopped")
     
+    def _push(self, task: BaseTask):
+        """Кладёт срок задачи в кучу и будит цикл, если он спит дольше нужного."""
+        due = task.scheduled_at if task.scheduled_at is not None else time.time()
+        heapq.heappush(self._heap, (due, next(self._counter), task.task_id))
+        if self._heap[0][2] == task.task_id:
+            self._wakeup.set()
+    
+    def _pop_ready(self, now: float) -> List[BaseTask]:
+        """Извлекает из кучи все наступившие задачи."""
+        ready = []
+        while self._heap and self._heap[0][0] <= now:
+            due, _, task_id = heapq.heappop(self._heap)
+            task = self.tasks.get(task_id)
+            # Запись устарела: задача удалена, уже выполняется или перенесена на другой срок
+            if task is None or task.status != TaskStatus.PENDING:
+                continue
+            if task.scheduled_at is not None and task.scheduled_at != due:
+                continue
+            ready.append(task)
+        return ready
+    
+    def _next_delay(self) -> Optional[float]:
+        """Сколько спать до ближайшего срока (None – задач нет, ждём добавления)."""
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.time())
+    
     async def _scheduler_loop(self):
-        """Основной цикл планировщика."""
+        """Основной цикл планировщика: спим до ближайшего срока или до новой задачи."""
         while self.running:
             try:
                 await self._execute_ready_tasks()
-                await asyncio.sleep(30)  # Проверяем каждые 30 секунд
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self._next_delay())
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 core_logger.log_error(e, {"operation": "scheduler_loop"})
                 await asyncio.sleep(60)  # Пауза при ошибке
     
+    def _spawn(self, coro):
+        """Запускает выполнение в фоне, не блокируя цикл планировщика."""
+        running = asyncio.create_task(coro)
+        self._running.add(running)
+        running.add_done_callback(self._running.discard)
+    
     async def _execute_ready_tasks(self):
-        """Выполняет готовые задачи."""
-        ready_tasks = [
-            task for task in self.tasks.values()
-            if task.status == TaskStatus.PENDING and task.should_execute()
-        ]
+        """Запускает готовые задачи параллельно: напоминания – одной пачкой, остальные – каждая своей."""
+        ready_tasks = self._pop_ready(time.time())
+        reminders = [t for t in ready_tasks if isinstance(t, ReminderTask)]
+        if reminders:
+            self._spawn(self._deliver_reminders(reminders))
         
         for task in ready_tasks:
-            await self._execute_task(task)
+            if not isinstance(task, ReminderTask):
+                task.status = TaskStatus.RUNNING
+                self._spawn(self._execute_task(task))
+    
+    async def _deliver_reminders(self, reminders: List["ReminderTask"]):
+        """Отправляет пачку напоминаний и удаляет из БД разом все отработавшие."""
+        for task in reminders:
+            task.bot = self.bot
+            task.status = TaskStatus.RUNNING
+        await asyncio.gather(*(self._execute_task(task) for task in reminders))
+        # Отправленные и исчерпавшие повторы – больше не нужны; остальные ждут повтора
+        done = [t.reminder_id for t in reminders if t.status in (TaskStatus.COMPLETED, TaskStatus.FAILED)]
+        if done:
+            await asyncio.to_thread(db_delete_reminders, done)
     
     async def _execute_task(self, task: BaseTask):
-        """Выполняет конкретную задачу."""
+        """Выполняет конкретную задачу (с лимитом на её тип и таймаутом)."""
         task.status = TaskStatus.RUNNING
-        task.executed_at = time.time()
+        semaphore = self._semaphores.get(task.task_type)
         
+        if semaphore is not None:
+            await semaphore.acquire()
+        task.executed_at = time.time()
         start_time = time.time()
         
         try:
-            result = await task.execute()
-            execution_time = time.time() - start_time
+            try:
+                result = await asyncio.wait_for(task.execute(), timeout=task.timeout)
+            except asyncio.TimeoutError:
+                result = TaskResult(False, f"Timed out after {task.timeout:g}s")
+            result.execution_time = time.time() - start_time
             
             if result.success:
-                task.status = TaskStatus.COMPLETED
+                if task.interval:
+                    # Периодическая задача – планируем следующий запуск
+                    task.status = TaskStatus.PENDING
+                    task.retries = 0
+                    task.scheduled_at = time.time() + task.interval
+                else:
+                    task.status = TaskStatus.COMPLETED
                 self.stats["successful"] += 1
             else:
                 if task.can_retry():
                     task.retries += 1
                     task.status = TaskStatus.PENDING
-                    task.scheduled_at = time.time() + (60 * task.retries)
+                    task.scheduled_at = time.time() + retry_delay(task.retries)
                     self.stats["retries"] += 1
                 else:
                     task.status = TaskStatus.FAILED
@@ -198,38 +357,81 @@ class AdvancedTaskScheduler:
             
             self.stats["total_executed"] += 1
             
+        except asyncio.CancelledError:
+            task.status = TaskStatus.CANCELLED
+            raise
         except Exception as e:
             task.status = TaskStatus.FAILED
             self.stats["failed"] += 1
+            result = TaskResult(False, f"Error: {e}", execution_time=time.time() - start_time)
             core_logger.log_error(e, {"task": task.task_id, "operation": "execute_task"})
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+        
+        self._record(task, result)
+        if task.status == TaskStatus.PENDING:
+            self._push(task)
+        else:
+            # Завершённые задачи в планировщике не копятся
+            self.tasks.pop(task.task_id, None)
+    
+    def _record(self, task: BaseTask, result: TaskResult):
+        """Пишет запуск в кольцевой буфер истории."""
+        self.task_history.append({
+            "task_id": task.task_id,
+            "task_type": task.task_type.value,
+            "status": task.status.value,
+            "success": result.success,
+            "message": result.message,
+            "started_at": task.executed_at,
+            "execution_time": round(result.execution_time, 3),
+            "retries": task.retries,
+            "next_run_at": task.scheduled_at if task.status == TaskStatus.PENDING else None
+        })
     
     async def _add_system_tasks(self):
         """Добавляет системные задачи."""
         # Задача очистки
-        cleanup_task = CleanupTask()
-        self.tasks[cleanup_task.task_id] = cleanup_task
+        self.add_task(CleanupTask())
+        
+        # Сжатие роллапов статистики
+        self.add_task(RollupCompactionTask())
         
         core_logger.logger.info("system_tasks_added")
     
+    async def _load_reminders(self):
+        """Загружает неотправленные напоминания из БД (просроченные уйдут сразу)."""
+        rows = await asyncio.to_thread(db_get_pending_reminders)
+        for reminder_id, chat_id, user_id, text, due_ts in rows:
+            self.add_task(ReminderTask(reminder_id, int(chat_id), int(user_id), text, due_ts))
+        core_logger.logger.info("reminders_loaded", count=len(rows))
+    
     def add_task(self, task: BaseTask):
         """Добавляет задачу в планировщик."""
         self.tasks[task.task_id] = task
+        self._push(task)
     
-    def get_stats(self) -> Dict[str, Any]:
-        """Возвращает статистику планировщика."""
+    def get_stats(self, history_limit: int = RECENT_HISTORY) -> Dict[str, Any]:
+        """Возвращает статистику планировщика и последние запуски задач."""
+        next_delay = self._next_delay()
+        recent = list(itertools.islice(reversed(self.task_history), history_limit))
         return {
             **self.stats,
             "active_tasks": len([t for t in self.tasks.values() if t.status == TaskStatus.PENDING]),
-            "running_tasks": len([t for t in self.tasks.values() if t.status == TaskStatus.RUNNING])
+            "running_tasks": len([t for t in self.tasks.values() if t.status == TaskStatus.RUNNING]),
+            "next_due_in": round(next_delay, 3) if next_delay is not None else None,
+            "history_size": len(self.task_history),
+            "recent_tasks": recent
         }
 
 # Глобальный планировщик
 advanced_scheduler = AdvancedTaskScheduler()
 
 # API функции
-async def start_scheduler():
+async def start_scheduler(bot=None):
     """Запускает планировщик."""
-    await advanced_scheduler.start()
+    await advanced_scheduler.start(bot)
 
 async def stop_scheduler():
     """Останавливает планировщик."""
@@ -244,6 +446,6 @@ def schedule_reminder(chat_id: int, user_id: int, text: str, due_time: float) ->
     
     return task.task_id
 
-def get_scheduler_stats() -> Dict[str, Any]:
-    """Возвращает статистику планировщика."""
-    return advanced_scheduler.get_stats()
+def get_scheduler_stats(history_limit: int = RECENT_HISTORY) -> Dict[str, Any]:
+    """Возвращает статистику планировщика и последние history_limit запусков (новые первыми)."""
+    return advanced_scheduler.get_stats(history_limit)
@@ -0,0 +1,342 @@
+"""
+Vision-конвейер: кэш описаний картинок, ограниченный пул и предохранители моделей.
+
+Vision-модель описывает картинку нейтрально, без подписи и контекста чата –
+такое описание можно переиспользовать. Ключ кэша – file_unique_id (одинаков
+у пересланных и повторно отправленных фото), второй ключ – перцептивный
+хэш (dHash) для той же картинки, загруженной заново. Повтор не требует ни
+скачивания, ни vision-запроса: подпись и контекст накладываются поверх
+описания дешёвой текстовой моделью. Pillow входит в зависимости; если его
+всё же нет (минимальная установка), работает только первый ключ, а фото
+уходят в модель без пережатия.
+
+Промах кэша встаёт в очередь: одновременно обрабатывается не больше
+settings.vision_max_concurrency фото, ожидающих – не больше
+settings.vision_queue_size. Хэш, уменьшение/пережатие, base64 и
+блокирующие запросы к Groq выполняются в отдельном пуле потоков, event loop
+остаётся свободным для текста. Задание, дождавшееся очереди слишком поздно (чат ушёл вперёд),
+отбрасывается. Модели из VISION_FALLBACKS, которые подряд падают,
+временно пропускаются (circuit breaker).
+"""
+
+import asyncio
+import io
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, NamedTuple, Optional, Sequence
+
+from bot_groq.config.settings import settings
+from bot_groq.services.database import db_get_vision_cache, db_put_vision_cache, db_add_activity_listener
+from bot_groq.services.llm import vision_completion, VISION_FALLBACKS
+from bot_groq.services.media import media_fetcher, pick_photo_size, to_data_url
+from bot_groq.utils.logging import core_logger
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+HASH_SIZE = 8
+# Ступени пережатия: качество, затем уменьшение стороны
+QUALITY_STEPS = (85, 70, 55, 40)
+SHRINK_FACTOR = 0.75
+MAX_SHRINK_STEPS = 4
+
+DESCRIBE_SYSTEM_PROMPT = "Ты описываешь изображения для другой модели. Пиши по-русски, фактически, без оценок."
+DESCRIBE_USER_PROMPT = (
+    "Опиши, что на картинке: объекты, людей, действия, эмоции, обстановку."
+    " Если это мем или скриншот – перескажи суть и ключевой текст, не переписывая его целиком."
+    " До 5 предложений."
+)
+
+class VisionJobDropped(Exception):
+    """Фото не обработано: очередь переполнена или чат уже ушёл вперёд."""
+
+class PreparedImage(NamedTuple):
+    """Фото, готовое к отправке в vision-модель."""
+    phash: Optional[str]
+    data_url: str
+    size: int           # байт после подготовки
+    reencoded: bool
+
+def _dhash(img) -> str:
+    small = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE))
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:016x}"
+
+def perceptual_hash(data: bytes) -> Optional[str]:
+    """dHash: 64 бита разностей яркости соседних пикселей уменьшенной копии (hex). None без Pillow."""
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return _dhash(img)
+    except Exception:
+        return None
+
+def fit_image(img, target_side: int, max_bytes: int, fmt: str = "JPEG") -> bytes:
+    """Уменьшает картинку до target_side по длинной стороне и пережимает, пока не влезет в max_bytes.
+
+    Сначала снижается качество, затем – если не помогло – разрешение.
+    """
+    img = img.convert("RGB")
+    side = target_side
+    encoded = b""
+    for _ in range(MAX_SHRINK_STEPS):
+        frame = img.copy()
+        frame.thumbnail((side, side), Image.LANCZOS)
+        for quality in QUALITY_STEPS:
+            buf = io.BytesIO()
+            frame.save(buf, format=fmt, quality=quality)
+            encoded = buf.getvalue()
+            if len(encoded) <= max_bytes:
+                return encoded
+        side = int(side * SHRINK_FACTOR)
+    return encoded
+
+def prepare_image(data: bytes) -> PreparedImage:
+    """CPU-часть подготовки фото (в пуле потоков): хэш, уменьшение/пережатие и data URL.
+
+    Фото, которое уже не больше целевого разрешения и бюджета, уходит как есть.
+    Без Pillow (или если картинку не удалось открыть) – тоже как есть.
+    """
+    if Image is None:
+        return PreparedImage(None, to_data_url(data), len(data), False)
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            phash = _dhash(img)
+            target = settings.vision_target_side
+            budget = settings.vision_upload_max_bytes
+            if max(img.size) <= target and len(data) <= budget:
+                return PreparedImage(phash, to_data_url(data), len(data), False)
+            fmt = "WEBP" if settings.vision_image_format.lower() == "webp" else "JPEG"
+            encoded = fit_image(img, target, budget, fmt)
+    except Exception as e:
+        core_logger.logger.warning("vision_prepare_failed", error=str(e))
+        return PreparedImage(None, to_data_url(data), len(data), False)
+    return PreparedImage(phash, to_data_url(encoded, f"image/{fmt.lower()}"), len(encoded), True)
+
+class CircuitBreaker:
+    """Предохранитель модели: после failure_threshold ошибок подряд модель пропускается
+    на cooldown секунд, затем пропускается один пробный запрос."""
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.time() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Можно ли сейчас отправить запрос в модель."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            # Неудачная проба в half_open снова размыкает на полный cooldown
+            self.opened_at = time.time()
+
+    def release_probe(self):
+        """Снять флаг пробы, если запрос оборвался без исхода (например, отменён)."""
+        self._probing = False
+
+class VisionService:
+    """Описание фото с кэшем по file_unique_id и перцептивному хэшу."""
+
+    def __init__(self):
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        # Счётчик сообщений по чатам – чтобы понять, что чат «ушёл вперёд»
+        self._chat_seq: Dict[int, int] = defaultdict(int)
+        self._waiting = 0
+        self.id_hits = 0
+        self.hash_hits = 0
+        self.misses = 0
+        self.dropped = 0
+        self.failed = 0
+        # Экономия от подготовки фото: скачано vs отправлено в модель (по промахам кэша)
+        self.bytes_downloaded = 0
+        self.bytes_uploaded = 0
+        self.reencoded = 0
+        self.prepare_time = 0.0
+        db_add_activity_listener(self._on_activity)
+
+    def _on_activity(self, chat_id: int, ts: float):
+        self._chat_seq[chat_id] += 1
+
+    def _ensure_started(self):
+        if self._semaphore is None:
+            if Image is None:
+                core_logger.logger.warning("vision_pillow_missing",
+                                           detail="perceptual hash and downscaling are disabled")
+            self._semaphore = asyncio.Semaphore(max(1, settings.vision_max_concurrency))
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max(1, settings.vision_max_concurrency),
+                                                thread_name_prefix="vision")
+
+    async def _run(self, func, *args):
+        """Блокирующая работа – в пуле потоков vision, не в общем."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _breaker(self, model_name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(model_name)
+        if breaker is None:
+            breaker = CircuitBreaker(settings.vision_breaker_failures, settings.vision_breaker_cooldown)
+            self._breakers[model_name] = breaker
+        return breaker
+
+    async def _request(self, image_url: str) -> str:
+        """Перебор моделей из VISION_FALLBACKS с предохранителями и таймаутом на запрос."""
+        last_err: Optional[Exception] = None
+        for model_name in dict.fromkeys(m for m in VISION_FALLBACKS if m):
+            breaker = self._breaker(model_name)
+            if not breaker.allow():
+                continue
+            timeout = settings.vision_request_timeout
+            try:
+                # Таймаут и в клиенте Groq (освобождает поток), и здесь – на случай зависшего соединения
+                description = await asyncio.wait_for(
+                    self._run(vision_completion, model_name, DESCRIBE_SYSTEM_PROMPT, image_url,
+                              DESCRIBE_USER_PROMPT, timeout),
+                    timeout=timeout + 5,
+                )
+            except Exception as e:
+                breaker.record_failure()
+                last_err = e
+                continue
+            finally:
+                # Отмена (CancelledError) не должна навсегда оставить модель «на пробе»
+                breaker.release_probe()
+            breaker.record_success()
+            return description
+        raise RuntimeError(f"нет доступных vision-моделей: {last_err or 'все предохранители разомкнуты'}")
+
+    async def describe(self, bot, photos: Sequence, chat_id: Optional[int] = None) -> Optional[str]:
+        """Нейтральное описание фото (None – не удалось скачать или распознать).
+
+        VisionJobDropped – фото не дождалось очереди, отвечать на него уже не нужно.
+        """
+        # Самый крупный вариант – идентичность картинки, не зависящая от бюджета байт
+        unique_id = photos[-1].file_unique_id
+        ttl = settings.vision_cache_ttl_hours * 3600
+
+        description = await asyncio.to_thread(db_get_vision_cache, unique_id)
+        if description:
+            self.id_hits += 1
+            return description
+
+        self._ensure_started()
+        if self._waiting >= settings.vision_queue_size:
+            self.dropped += 1
+            raise VisionJobDropped("очередь vision переполнена")
+        enqueued_at = time.time()
+        seq = self._chat_seq[chat_id] if chat_id is not None else 0
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        try:
+            if time.time() - enqueued_at > settings.vision_queue_max_wait or (
+                    chat_id is not None and self._chat_seq[chat_id] - seq > settings.vision_stale_messages):
+                self.dropped += 1
+                raise VisionJobDropped("чат ушёл вперёд, пока фото ждало очереди")
+            return await self._describe_miss(bot, photos, unique_id, ttl)
+        finally:
+            self._semaphore.release()
+
+    async def _describe_miss(self, bot, photos: Sequence, unique_id: str, ttl: float) -> Optional[str]:
+        photo = pick_photo_size(photos)
+        try:
+            data = await media_fetcher.fetch_telegram_file(bot, photo.file_id)
+        except Exception as e:
+            core_logger.logger.warning("vision_download_failed", error=str(e))
+            return None
+        if not data:
+            return None
+
+        started = time.perf_counter()
+        prepared = await self._run(prepare_image, data)
+        self.prepare_time += time.perf_counter() - started
+        downloaded = len(data)
+        del data
+        phash = prepared.phash
+        if phash:
+            description = await asyncio.to_thread(db_get_vision_cache, None, phash)
+            if description:
+                self.hash_hits += 1
+                # Запоминаем и этот file_unique_id – следующий повтор обойдётся без скачивания
+                await asyncio.to_thread(db_put_vision_cache, unique_id, phash, description, ttl)
+                return description
+
+        self.misses += 1
+        self.bytes_downloaded += downloaded
+        self.bytes_uploaded += prepared.size
+        self.reencoded += prepared.reencoded
+        try:
+            description = await self._request(prepared.data_url)
+        except Exception as e:
+            self.failed += 1
+            core_logger.logger.warning("vision_describe_failed", error=str(e))
+            return None
+        if description:
+            await asyncio.to_thread(db_put_vision_cache, unique_id, phash, description, ttl)
+        return description or None
+
+    async def close(self):
+        """Останавливает пул потоков (shutdown бота)."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика кэша описаний, очереди и предохранителей."""
+        total = self.id_hits + self.hash_hits + self.misses
+        prepared_count = self.hash_hits + self.misses
+        return {
+            "id_hits": self.id_hits,
+            "hash_hits": self.hash_hits,
+            "misses": self.misses,
+            "hit_rate": (self.id_hits + self.hash_hits) / total if total else 0.0,
+            "phash_enabled": Image is not None,
+            "waiting": self._waiting,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "breakers": {name: b.state for name, b in self._breakers.items()},
+            "bytes_downloaded": self.bytes_downloaded,
+            "bytes_uploaded": self.bytes_uploaded,
+            "upload_saved_ratio": (1 - self.bytes_uploaded / self.bytes_downloaded) if self.bytes_downloaded else 0.0,
+            "reencoded": self.reencoded,
+            "avg_prepare_ms": self.prepare_time * 1000 / prepared_count if prepared_count else 0.0,
+        }
+
+# Глобальный экземпляр
+vision_service = VisionService()
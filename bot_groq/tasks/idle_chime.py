@@ -1,18 +1,23 @@
 import asyncio
+import heapq
 import time
 import random
 import logging
-from typing import Dict
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 from aiogram import Bot
 
 from bot_groq.config.settings import settings
 from bot_groq.services.database import (
-    db_get_all_groups, db_get_last_activity, db_runtime_get, db_runtime_all, db_get_settings
+    db_get_all_chat_activities, db_add_activity_listener, db_runtime_get, db_runtime_all, db_get_settings,
+    db_get_idle_chimes, db_set_idle_chime
 )
 from bot_groq.services.llm import llm_text
 
 logger = logging.getLogger(__name__)
 
+# Последний пинг по чатам; копия таблицы idle_chime_state, загружается при старте
 _last_chime: Dict[int, float] = {}
 
 IDLE_PROMPTS = [
@@ -22,71 +27,176 @@ IDLE_PROMPTS = [
     "Скучно. Подкинь искру разговора в стиле токсика.",
 ]
 
+class IdleTracker:
+    """Чаты, упорядоченные по последней активности, – детектор тишины без опроса всех чатов.
+
+    Активные чаты лежат в OrderedDict по возрастанию last_ts: сообщение
+    переносит чат в конец за O(1), а «заснувшие» снимаются только с начала.
+    Заснувшие чаты, которые надо проверить ещё раз (кулдаун, не выпал шанс),
+    ждут в куче повторных проверок. Стоимость проверки – O(число тихих чатов).
+
+    Только что заснувший чат проверяется не сразу, а в случайный момент
+    внутри окна jitter: после рестарта (или когда тихими стали сразу много
+    чатов) LLM-запросы размазываются по интервалу, а не идут залпом.
+    """
+
+    def __init__(self):
+        self._active: "OrderedDict[int, float]" = OrderedDict()
+        self._idle: Dict[int, float] = {}                    # chat_id -> last_ts, на момент «засыпания»
+        self._recheck: List[Tuple[float, int, float]] = []   # (когда, chat_id, last_ts)
+
+    def touch(self, chat_id: int, ts: Optional[float] = None):
+        """Активность в чате (вызывается при записи каждого сообщения)."""
+        self._idle.pop(chat_id, None)
+        self._active.pop(chat_id, None)
+        self._active[chat_id] = ts if ts is not None else time.time()
+
+    def load(self, activities: List[Tuple]):
+        """Начальное заполнение из chat_activity (строки (chat_id, last_ts) по возрастанию last_ts)."""
+        for chat_id_raw, last_ts in activities:
+            try:
+                chat_id = int(chat_id_raw)
+            except (TypeError, ValueError):
+                continue
+            if chat_id not in self._active:
+                self._active[chat_id] = last_ts
+
+    def pop_due(self, now: float, threshold: float, jitter: float = 0.0) -> List[Tuple[int, float]]:
+        """Чаты, где тишина дольше threshold и наступила их (джиттерная) проверка."""
+        due = []
+        cutoff = now - threshold
+        while self._active:
+            chat_id, last_ts = next(iter(self._active.items()))
+            if last_ts > cutoff:
+                break
+            self._active.popitem(last=False)
+            self._idle[chat_id] = last_ts
+            if jitter > 0:
+                heapq.heappush(self._recheck, (now + random.uniform(0, jitter), chat_id, last_ts))
+            else:
+                due.append((chat_id, last_ts))
+        while self._recheck and self._recheck[0][0] <= now:
+            _, chat_id, last_ts = heapq.heappop(self._recheck)
+            # Если в чате с тех пор писали – запись устарела
+            if self._idle.get(chat_id) == last_ts:
+                due.append((chat_id, last_ts))
+        return due
+
+    def defer(self, chat_id: int, last_ts: float, when: float):
+        """Проверить тихий чат ещё раз в момент when (если он так и останется тихим)."""
+        if self._idle.get(chat_id) == last_ts:
+            heapq.heappush(self._recheck, (when, chat_id, last_ts))
+
+    def next_wakeup(self, threshold: float) -> Optional[float]:
+        """Момент, когда появится следующий чат для проверки (None – следить не за чем)."""
+        candidates = []
+        if self._active:
+            candidates.append(next(iter(self._active.values())) + threshold)
+        if self._recheck:
+            candidates.append(self._recheck[0][0])
+        return min(candidates) if candidates else None
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"active": len(self._active), "idle": len(self._idle), "rechecks": len(self._recheck)}
+
+idle_tracker = IdleTracker()
+
+def _quiet_until(now: float) -> Optional[float]:
+    """Если сейчас 'тихие часы' – момент их окончания, иначе None."""
+    quiet_start = settings.quiet_hours_start
+    quiet_end = settings.quiet_hours_end
+    current = datetime.fromtimestamp(now)
+    h = current.hour
+    if quiet_start < quiet_end:
+        quiet = quiet_start <= h < quiet_end
+    else:
+        # Перехлёст через полночь
+        quiet = h >= quiet_start or h < quiet_end
+    if not quiet:
+        return None
+    end = current.replace(hour=quiet_end, minute=0, second=0, microsecond=0)
+    if end <= current:
+        end += timedelta(days=1)
+    return end.timestamp()
+
+def _jittered(delay: float) -> float:
+    """delay ±50% – повторные проверки разных чатов не собираются в один момент."""
+    return delay * random.uniform(0.5, 1.5)
+
+async def _chime_idle_chats(bot: Bot, now: float, threshold: float):
+    """Пишет в чаты, где тишина дольше порога; остальные откладывает до следующей проверки."""
+    due = idle_tracker.pop_due(now, threshold, jitter=settings.idle_check_every)
+    if not due:
+        return
+    # Небольшая вероятностная регулировка: если response_chance у чата высокий (runtime), можно понижать
+    try:
+        cfg = db_get_settings()
+        chance = int(cfg.get('response_chance', settings.response_chance))
+    except Exception:
+        chance = settings.response_chance
+    # Чем больше шанс обычных ответов, тем реже пинги
+    prob = 0.6 - min(0.4, chance/200.0)
+    for chat_id, last_act in due:
+        since = now - last_act
+        last_sent = _last_chime.get(chat_id, 0)
+        if now - last_sent < settings.idle_chime_cooldown:
+            idle_tracker.defer(chat_id, last_act, last_sent + settings.idle_chime_cooldown)
+            continue
+        if random.random() > prob:
+            idle_tracker.defer(chat_id, last_act, now + _jittered(settings.idle_check_every))
+            continue
+        prompt = random.choice(IDLE_PROMPTS) + f" (тишина {int(since/60)} мин)"
+        try:
+            reply = await llm_text(prompt, max_tokens=0)
+        except Exception as e:
+            logger.warning(f"idle_chime llm error chat={chat_id}: {e}")
+            reply = None
+        if not reply:
+            idle_tracker.defer(chat_id, last_act, now + _jittered(settings.idle_check_every))
+            continue
+        try:
+            await bot.send_message(chat_id, reply)
+            _last_chime[chat_id] = now
+            db_set_idle_chime(chat_id, now)
+            logger.info(f"[idle_chime] sent to {chat_id} after {int(since/60)}m silence")
+        except Exception as e:
+            logger.debug(f"idle_chime send fail chat={chat_id}: {e}")
+        # Тишина продолжится – следующий пинг не раньше кулдауна
+        idle_tracker.defer(chat_id, last_act, time.time() + settings.idle_chime_cooldown)
+
 async def idle_chime_worker(bot: Bot):
-    """Фоновая задача: проверяет чаты и пишет что-нибудь после долгой тишины.
+    """Фоновая задача: пишет что-нибудь в чаты после долгой тишины.
     Условия:
       - включено settings.idle_enabled
       - прошло >= idle_chime_minutes с последней активности
       - прошло >= idle_chime_cooldown с последнего нашего чима
       - не в 'тихих часах'
+    Чаты не опрашиваются: активность приходит из записи сообщений, а воркер
+    спит ровно до момента, когда очередной чат пересечёт порог тишины
+    (но не дольше idle_check_every, чтобы подхватывать смену настроек).
+    Заснувшие чаты проверяются в случайный момент внутри idle_check_every,
+    кулдауны хранятся в БД.
     """
     await asyncio.sleep(10)  # даём стартовым процессам устаканиться
+    # Кулдауны прошлых запусков – чтобы рестарт не сделал все чаты «созревшими» разом
+    _last_chime.update(await asyncio.to_thread(db_get_idle_chimes))
+    idle_tracker.load(await asyncio.to_thread(db_get_all_chat_activities))
+    db_add_activity_listener(idle_tracker.touch)
     while True:
         try:
-            if not settings.idle_enabled:
-                await asyncio.sleep(settings.idle_check_every)
-                continue
             now = time.time()
-            quiet_start = settings.quiet_hours_start
-            quiet_end = settings.quiet_hours_end
-            hour = int(time.strftime('%H', time.localtime(now)))
-            def in_quiet(h: int) -> bool:
-                if quiet_start < quiet_end:
-                    return quiet_start <= h < quiet_end
-                # Перехлёст через полночь
-                return h >= quiet_start or h < quiet_end
-            if in_quiet(hour):
-                await asyncio.sleep(settings.idle_check_every)
-                continue
-            # Получаем группы из истории
-            groups = db_get_all_groups()  # list of tuples [(chat_id,), ...]
-            for (chat_id_raw,) in groups:
-                try:
-                    chat_id = int(chat_id_raw)
-                except Exception:
-                    continue
-                last_act = db_get_last_activity(chat_id) or 0
-                since = now - last_act
-                if since < settings.idle_chime_minutes * 60:
-                    continue
-                last_sent = _last_chime.get(chat_id, 0)
-                if now - last_sent < settings.idle_chime_cooldown:
-                    continue
-                # Небольшая вероятностная регулировка: если response_chance у чата высокий (runtime), можно понижать
-                try:
-                    cfg = db_get_settings()
-                    chance = int(cfg.get('response_chance', settings.response_chance))
-                except Exception:
-                    chance = settings.response_chance
-                # Чем больше шанс обычных ответов, тем реже пинги
-                prob = 0.6 - min(0.4, chance/200.0)
-                if random.random() > prob:
-                    continue
-                prompt = random.choice(IDLE_PROMPTS) + f" (тишина {int(since/60)} мин)"
-                try:
-                    reply = await llm_text(prompt, max_tokens=0)
-                except Exception as e:
-                    logger.warning(f"idle_chime llm error chat={chat_id}: {e}")
-                    reply = None
-                if not reply:
-                    continue
-                try:
-                    await bot.send_message(chat_id, reply)
-                    _last_chime[chat_id] = now
-                    logger.info(f"[idle_chime] sent to {chat_id} after {int(since/60)}m silence")
-                except Exception as e:
-                    logger.debug(f"idle_chime send fail chat={chat_id}: {e}")
-            await asyncio.sleep(settings.idle_check_every)
+            wake_at = now + settings.idle_check_every
+            if settings.idle_enabled:
+                threshold = settings.idle_chime_minutes * 60
+                quiet_until = _quiet_until(now)
+                if quiet_until is None:
+                    await _chime_idle_chats(bot, now, threshold)
+                    next_due = idle_tracker.next_wakeup(threshold)
+                    if next_due is not None:
+                        wake_at = min(wake_at, next_due)
+                else:
+                    wake_at = min(wake_at, quiet_until)
+            await asyncio.sleep(max(1.0, wake_at - time.time()))
         except asyncio.CancelledError:
             logger.info("idle_chime_worker cancelled")
             break
@@ -94,4 +204,4 @@ async def idle_chime_worker(bot: Bot):
             logger.error(f"idle_chime_worker loop error: {e}")
             await asyncio.sleep(30)
 
-__all__ = ["idle_chime_worker"]
+__all__ = ["idle_chime_worker", "idle_tracker"]
@@ -142,6 +142,9 @@ class DatabaseOptimizer:
                         conn.execute("VACUUM")
                         self._last_vacuum = time.time()
                         database_logger.logger.info("database_vacuum_completed")
+                        # VACUUM мог перенумеровать rowid – синхронизируем поисковый индекс
+                        from bot_groq.services.database import db_rebuild_search_index
+                        db_rebuild_search_index()
                     
                     # ANALYZE каждые 6 часов
                     if time.time() - self._last_analyze > 21600:
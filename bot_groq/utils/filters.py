@@ -3,11 +3,16 @@
 """
 
 import re
+import time
+import asyncio
 import hashlib  
+from collections import OrderedDict
 from typing import List, Dict, Set, Optional, Tuple
 from dataclasses import dataclass
 from enum import Enum
 
+from bot_groq.config.settings import settings
+
 class ThreatLevel(Enum):
     """Уровни угроз в сообщениях."""
     SAFE = "safe"
@@ -16,6 +21,12 @@ class ThreatLevel(Enum):
     HIGH = "high"
     CRITICAL = "critical"
 
+_THREAT_ORDER = [ThreatLevel.SAFE, ThreatLevel.LOW, ThreatLevel.MEDIUM, ThreatLevel.HIGH, ThreatLevel.CRITICAL]
+
+def _max_threat(a: ThreatLevel, b: ThreatLevel) -> ThreatLevel:
+    """Более серьёзный из двух уровней (Enum сам по себе не сравнивается)."""
+    return a if _THREAT_ORDER.index(a) >= _THREAT_ORDER.index(b) else b
+
 @dataclass
 class FilterResult:
     """Результат фильтрации сообщения."""
@@ -61,6 +72,14 @@ class AdvancedTextFilter:
             r'я\s+(?:был\s+)?(?:обучен|создан)\s+(?:на|для)',
         ]
         
+        # Слишком вежливые фразы (не в характере токсичного бота)
+        self.polite_patterns = [
+            r'извините,?\s*',
+            r'пожалуйста,?\s*',
+            r'с\s+уважением,?\s*',
+            r'благодарю\s+вас,?\s*'
+        ]
+        
         # Компиляция регексов для производительности
         self._compile_patterns()
     
@@ -70,6 +89,32 @@ class AdvancedTextFilter:
         self.personal_data_re = re.compile('|'.join(self.personal_data_patterns), re.IGNORECASE)
         self.hate_speech_re = re.compile('|'.join(self.hate_speech_patterns), re.IGNORECASE)
         self.llm_leak_re = re.compile('|'.join(self.llm_leak_patterns), re.IGNORECASE)
+        # Все категории одним проходом: каждая – именованная группа внутри lookahead,
+        # поэтому совпадение одной категории не «съедает» текст для остальных.
+        # Более серьёзные категории идут первыми – при совпадении в одной позиции побеждают они.
+        categories = [
+            ("personal_data", self.personal_data_patterns),
+            ("hate_speech", self.hate_speech_patterns),
+            ("llm_leak", self.llm_leak_patterns),
+            ("spam_content", self.spam_patterns),
+        ]
+        self.scan_re = re.compile(
+            "(?=" + "|".join(f"(?P<{name}>{'|'.join(patterns)})" for name, patterns in categories) + ")",
+            re.IGNORECASE
+        )
+        self._category_count = len(categories)
+        # Очистка ответа LLM: выдача себя + вежливости одним регексом
+        self.response_strip_re = re.compile('|'.join(self.llm_leak_patterns + self.polite_patterns), re.IGNORECASE)
+        self.whitespace_re = re.compile(r'\s+')
+    
+    def _scan_categories(self, text: str) -> Set[str]:
+        """Категории нарушений за один проход по тексту."""
+        found: Set[str] = set()
+        for m in self.scan_re.finditer(text):
+            found.add(m.lastgroup)
+            if len(found) == self._category_count:
+                break
+        return found
     
     def analyze_text(self, text: str) -> FilterResult:
         """Анализирует текст на предмет различных нарушений."""
@@ -79,34 +124,36 @@ class AdvancedTextFilter:
         violations = []
         threat_level = ThreatLevel.SAFE
         
+        found = self._scan_categories(text)
+        
         # Проверка на спам
-        if self.spam_re.search(text):
+        if "spam_content" in found:
             violations.append("spam_content")
-            threat_level = max(threat_level, ThreatLevel.LOW)
+            threat_level = _max_threat(threat_level, ThreatLevel.LOW)
         
         # Проверка персональных данных
-        if self.personal_data_re.search(text):
+        if "personal_data" in found:
             violations.append("personal_data")
-            threat_level = max(threat_level, ThreatLevel.HIGH)
+            threat_level = _max_threat(threat_level, ThreatLevel.HIGH)
         
         # Проверка hate speech
-        if self.hate_speech_re.search(text):
+        if "hate_speech" in found:
             violations.append("hate_speech")
-            threat_level = max(threat_level, ThreatLevel.CRITICAL)
+            threat_level = _max_threat(threat_level, ThreatLevel.CRITICAL)
         
         # Проверка на выдачу себя LLM
-        if self.llm_leak_re.search(text):
+        if "llm_leak" in found:
             violations.append("llm_leak")
-            threat_level = max(threat_level, ThreatLevel.MEDIUM)
+            threat_level = _max_threat(threat_level, ThreatLevel.MEDIUM)
         
         # Дополнительные проверки
         if len(text) > 4000:  # Слишком длинный текст
             violations.append("excessive_length")
-            threat_level = max(threat_level, ThreatLevel.LOW)
+            threat_level = _max_threat(threat_level, ThreatLevel.LOW)
         
         if text.count('!') > 10:  # Слишком много восклицательных знаков
             violations.append("excessive_punctuation")
-            threat_level = max(threat_level, ThreatLevel.LOW)
+            threat_level = _max_threat(threat_level, ThreatLevel.LOW)
         
         is_safe = threat_level in [ThreatLevel.SAFE, ThreatLevel.LOW]
         
@@ -122,87 +169,128 @@ class AdvancedTextFilter:
         if not text:
             return text
         
-        # Удаляем LLM-leak паттерны
-        filtered = self.llm_leak_re.sub('', text)
-        
-        # Удаляем слишком вежливые фразы (не в характере токсичного бота)
-        polite_patterns = [
-            r'извините,?\s*',
-            r'пожалуйста,?\s*',
-            r'с\s+уважением,?\s*',
-            r'благодарю\s+вас,?\s*'
-        ]
-        
-        for pattern in polite_patterns:
-            filtered = re.sub(pattern, '', filtered, flags=re.IGNORECASE)
+        # Удаляем LLM-leak паттерны и вежливости одним проходом
+        filtered = self.response_strip_re.sub('', text)
         
         # Очищаем лишние пробелы
-        filtered = re.sub(r'\s+', ' ', filtered).strip()
+        filtered = self.whitespace_re.sub(' ', filtered).strip()
         
         return filtered or "..."
 
 class RateLimiter:
-    """Система ограничения частоты запросов."""
+    """Ограничение частоты запросов по пользователю и по чату (GCRA).
+
+    Для каждого ключа хранится одно число – теоретическое время прихода
+    следующего запроса (TAT), поэтому проверка стоит O(1), а состояние
+    ограничено LRU на max_keys ключей: вытесняются давно молчавшие, чьи
+    «вёдра» всё равно уже полные.
+    """
     
-    def __init__(self):
-        self.user_requests: Dict[int, List[float]] = {}
-        self.chat_requests: Dict[int, List[float]] = {}
-        
-        # Лимиты (запросов в секунду)
-        self.user_limit = 5  # 5 сообщений в минуту на пользователя
-        self.chat_limit = 20  # 20 сообщений в минуту на чат
-        self.window = 60  # Окно в секундах
+    def __init__(self, user_limit: Optional[int] = None, chat_limit: Optional[int] = None,
+                 window: float = 60.0, max_keys: Optional[int] = None):
+        # Лимиты (запросов за окно, окно в секундах); допускается всплеск до лимита
+        self.user_limit = user_limit or settings.rate_limit_user_per_minute
+        self.chat_limit = chat_limit or settings.rate_limit_chat_per_minute
+        self.window = window
+        self.max_keys = max_keys or settings.rate_limit_max_keys
+        self.user_tat: "OrderedDict[int, float]" = OrderedDict()
+        self.chat_tat: "OrderedDict[int, float]" = OrderedDict()
+        self.allowed = 0
+        self.rejected = 0
+    
+    def _check(self, state: "OrderedDict[int, float]", key: int, limit: int, now: float) -> Optional[float]:
+        """Новый TAT, если запрос укладывается в лимит, иначе None (состояние не меняется)."""
+        interval = self.window / limit
+        tat = max(state.get(key, now), now)
+        if tat - now > self.window - interval:
+            return None
+        return tat + interval
+    
+    def _store(self, state: "OrderedDict[int, float]", key: int, tat: float):
+        state[key] = tat
+        state.move_to_end(key)
+        if len(state) > self.max_keys:
+            state.popitem(last=False)
     
     def is_allowed(self, user_id: int, chat_id: int) -> Tuple[bool, str]:
         """Проверяет, разрешен ли запрос от пользователя."""
-        import time
-        current_time = time.time()
-        
-        # Очищаем старые записи
-        self._cleanup_old_requests(current_time)
+        now = time.monotonic()
         
         # Проверяем лимит пользователя
-        user_requests = self.user_requests.get(user_id, [])
-        if len(user_requests) >= self.user_limit:
+        user_tat = self._check(self.user_tat, user_id, self.user_limit, now)
+        if user_tat is None:
+            self.rejected += 1
             return False, f"Превышен лимит сообщений ({self.user_limit}/мин)"
         
         # Проверяем лимит чата
-        chat_requests = self.chat_requests.get(chat_id, [])
-        if len(chat_requests) >= self.chat_limit:
+        chat_tat = self._check(self.chat_tat, chat_id, self.chat_limit, now)
+        if chat_tat is None:
+            self.rejected += 1
             return False, f"Превышен лимит чата ({self.chat_limit}/мин)"
         
-        # Добавляем текущий запрос
-        if user_id not in self.user_requests:
-            self.user_requests[user_id] = []
-        if chat_id not in self.chat_requests:
-            self.chat_requests[chat_id] = []
-        
-        self.user_requests[user_id].append(current_time)
-        self.chat_requests[chat_id].append(current_time)
-        
+        # Запрос принят – списываем из обоих «вёдер»
+        self._store(self.user_tat, user_id, user_tat)
+        self._store(self.chat_tat, chat_id, chat_tat)
+        self.allowed += 1
         return True, ""
     
-    def _cleanup_old_requests(self, current_time: float):
-        """Удаляет старые запросы вне окна."""
-        cutoff_time = current_time - self.window
-        
-        for user_id in list(self.user_requests.keys()):
-            self.user_requests[user_id] = [
-                t for t in self.user_requests[user_id] if t > cutoff_time
-            ]
-            if not self.user_requests[user_id]:
-                del self.user_requests[user_id]
-        
-        for chat_id in list(self.chat_requests.keys()):
-            self.chat_requests[chat_id] = [
-                t for t in self.chat_requests[chat_id] if t > cutoff_time
-            ]
-            if not self.chat_requests[chat_id]:
-                del self.chat_requests[chat_id]
+    def get_stats(self) -> Dict[str, int]:
+        """Статистика ограничителя."""
+        return {
+            "users": len(self.user_tat),
+            "chats": len(self.chat_tat),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+        }
+
+class BanList:
+    """Баны из веб-панели в памяти: проверка – поиск в словаре.
+
+    Веб-панель может жить в другом процессе, поэтому список не
+    инвалидируется, а перечитывается из БД не чаще раза в ttl секунд
+    (в пуле потоков, вне event loop).
+    """
+    
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl if ttl is not None else settings.ban_cache_ttl
+        self._bans: Dict[Tuple[int, int], Optional[float]] = {}
+        self._loaded_at = 0.0
+        self._lock: Optional["asyncio.Lock"] = None
+        self.blocked = 0
+    
+    async def refresh_if_needed(self):
+        """Перечитывает баны, если кэш устарел."""
+        if time.monotonic() - self._loaded_at < self.ttl:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if time.monotonic() - self._loaded_at < self.ttl:
+                return
+            from bot_groq.services.database import db_get_active_bans
+            self._bans = await asyncio.to_thread(db_get_active_bans)
+            self._loaded_at = time.monotonic()
+    
+    def invalidate(self):
+        """Перечитать баны при следующей проверке."""
+        self._loaded_at = 0.0
+    
+    def is_banned(self, chat_id: int, user_id: int) -> bool:
+        if (chat_id, user_id) not in self._bans:
+            return False
+        until = self._bans[(chat_id, user_id)]
+        if until is not None and until <= time.time():
+            return False
+        self.blocked += 1
+        return True
+    
+    def get_stats(self) -> Dict[str, int]:
+        return {"bans": len(self._bans), "blocked": self.blocked}
 
 # Глобальные экземпляры
 text_filter = AdvancedTextFilter()
 rate_limiter = RateLimiter()
+ban_list = BanList()
 
 def safe_filter_text(text: str) -> FilterResult:
     """Основная функция для фильтрации текста."""
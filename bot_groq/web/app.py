@@ -6,19 +6,29 @@
 from fastapi import FastAPI, Request, HTTPException, Depends, BackgroundTasks
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, FileResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import asyncio
 import json
+import os
 from datetime import datetime, timedelta
 
 from ..config.settings import settings
-from ..services.database import database_service
-from ..services.analytics import analytics_engine, report_generator
+from ..services.db_service import database_service
+from ..services.analytics import analytics_engine, search_messages
+from ..services.export import EXPORT_FORMATS, iter_export, gzip_chunks, export_filename
+from ..services.reports import report_jobs
+from ..services.vision import vision_service
 from ..utils.logging import bot_logger, bot_metrics
-from ..utils.cache import memory_cache
+from ..utils.cache import cache as memory_cache
+from ..utils.filters import rate_limiter, ban_list
+from .live import live_feed
+from .response_cache import response_cache, time_bucket
+
+# Аналитика за период кэшируется на 5 минут (@cached в analytics) – с тем же шагом меняется ETag
+ANALYTICS_BUCKET_SEC = 300
 
 app = FastAPI(
     title="Леха Bot Admin Panel",
@@ -30,6 +40,19 @@ app = FastAPI(
 templates = Jinja2Templates(directory="bot_groq/web/templates")
 app.mount("/static", StaticFiles(directory="bot_groq/web/static"), name="static")
 
+@app.on_event("startup")
+async def recover_report_jobs():
+    """Задачи отчётов, брошенные умершими процессами (нет пульса), помечаются проваленными."""
+    failed = await asyncio.to_thread(report_jobs.recover_interrupted)
+    if failed:
+        bot_logger.warning(f"Marked {failed} interrupted report jobs as failed")
+
+@app.on_event("shutdown")
+async def close_database():
+    """Останавливает живую ленту и закрывает пул соединений БД."""
+    await live_feed.stop()
+    await database_service.close()
+
 # Безопасность
 security = HTTPBearer()
 
@@ -59,7 +82,7 @@ async def dashboard(request: Request, token: str = Depends(verify_admin_token)):
     """Главная страница с общей статистикой."""
     try:
         # Получаем статистику
-        global_stats = analytics_engine.get_global_analytics()
+        global_stats = await asyncio.to_thread(analytics_engine.get_global_analytics)
         bot_stats = bot_metrics.get_stats()
         
         # Недавняя активность
@@ -82,17 +105,20 @@ async def dashboard(request: Request, token: str = Depends(verify_admin_token)):
 # API для получения статистики в реальном времени
 @app.get("/api/stats/realtime")
 async def get_realtime_stats(token: str = Depends(verify_admin_token)):
-    """Получение статистики в реальном времени для обновления дашборда."""
-    stats = {
-        "bot_metrics": bot_metrics.get_stats(),
-        "active_chats": len(await database_service.get_active_chats()),
-        "messages_today": analytics_engine.get_messages_count_today(),
-        "llm_requests_today": analytics_engine.get_llm_requests_today(),
-        "cache_hit_rate": memory_cache.get_hit_rate(),
-        "timestamp": datetime.now().isoformat()
-    }
+    """Последний снимок метрик (общий для всех клиентов, не пересчитывается на каждый запрос)."""
+    stats = dict(await live_feed.latest())
+    stats["timestamp"] = datetime.fromtimestamp(live_feed.updated_ts).isoformat()
     return JSONResponse(stats)
 
+@app.get("/api/stats/stream")
+async def stream_realtime_stats(token: str = Depends(verify_admin_token)):
+    """Живая лента метрик (SSE): полный снимок, затем только изменения."""
+    return StreamingResponse(
+        live_feed.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Управление чатами
 @app.get("/chats", response_class=HTMLResponse)
 async def chats_page(request: Request, token: str = Depends(verify_admin_token)):
@@ -105,25 +131,18 @@ async def chats_page(request: Request, token: str = Depends(verify_admin_token))
 
 @app.get("/api/chats")
 async def get_chats(
+    request: Request,
     search: str = "", 
     limit: int = 50, 
     offset: int = 0,
     token: str = Depends(verify_admin_token)
 ):
-    """API для получения списка чатов с поиском."""
-    chats = await database_service.search_chats(search, limit, offset)
-    
-    # Добавляем статистику для каждого чата
-    for chat in chats:
-        chat_stats = analytics_engine.get_chat_analytics(chat['chat_id'])
-        chat.update({
-            'total_messages': chat_stats.total_messages,
-            'active_users': len(chat_stats.active_users),
-            'avg_toxicity': chat_stats.avg_toxicity_level,
-            'last_activity': chat_stats.last_activity_time
-        })
+    """API для получения списка чатов с поиском (одна выборка по агрегатам на страницу)."""
+    async def build():
+        return await database_service.search_chats(search, limit, offset)
     
-    return JSONResponse(chats)
+    data = await database_service.data_version()
+    return await response_cache.respond(request, data["version"], build, data["last_modified"])
 
 @app.post("/api/chats/mode")
 async def update_chat_mode(
@@ -141,6 +160,8 @@ async def update_chat_mode(
             "message": f"Режим чата {request.chat_id} изменен на {request.mode}"
         })
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         bot_logger.error(f"Failed to update chat mode: {e}")
         raise HTTPException(status_code=500, detail="Failed to update chat mode")
@@ -153,26 +174,25 @@ async def users_page(request: Request, token: str = Depends(verify_admin_token))
 
 @app.get("/api/users")
 async def get_users(
+    request: Request,
     search: str = "", 
     limit: int = 50, 
-    offset: int = 0,
     sort_by: str = "last_seen",
+    cursor: Optional[str] = None,
     token: str = Depends(verify_admin_token)
 ):
-    """API для получения списка пользователей."""
-    users = await database_service.search_users(search, limit, offset, sort_by)
-    
-    # Добавляем аналитику пользователей
-    for user in users:
-        user_stats = analytics_engine.get_user_analytics_all_chats(user['user_id'])
-        user.update({
-            'total_messages': user_stats.total_messages,
-            'avg_toxicity': user_stats.avg_toxicity_level,
-            'favorite_words': user_stats.favorite_words[:3],  # Топ-3
-            'is_banned': user_stats.is_banned
-        })
+    """API списка пользователей: страница по итогам user_stats + баны и любимые слова.
+
+    Следующая страница – тот же запрос с cursor=next_cursor из ответа.
+    """
+    async def build():
+        try:
+            return await database_service.search_users(search, limit, sort_by, cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     
-    return JSONResponse(users)
+    data = await database_service.data_version()
+    return await response_cache.respond(request, data["version"], build, data["last_modified"])
 
 @app.post("/api/users/ban")
 async def ban_user(
@@ -193,6 +213,8 @@ async def ban_user(
             request.reason,
             ban_until
         )
+        # Бот в этом же процессе подхватит бан сразу, в другом – через BAN_CACHE_TTL
+        ban_list.invalidate()
         
         # Логируем действие
         bot_logger.warning(
@@ -215,6 +237,62 @@ async def ban_user(
         bot_logger.error(f"Failed to ban user: {e}")
         raise HTTPException(status_code=500, detail="Failed to ban user")
 
+# Полнотекстовый поиск
+@app.get("/api/search")
+async def search(
+    q: str,
+    chat_id: Optional[int] = None,
+    source: str = "all",
+    limit: int = 20,
+    offset: int = 0,
+    token: str = Depends(verify_admin_token)
+):
+    """Поиск по истории и памяти чатов с подсветкой и пагинацией."""
+    if source not in ("all", "history", "memory"):
+        raise HTTPException(status_code=400, detail="source must be one of: all, history, memory")
+    limit = max(1, min(limit, 100))
+    offset = max(0, offset)
+    try:
+        result = await asyncio.to_thread(search_messages, q, chat_id, source, limit, offset)
+        
+        return JSONResponse({
+            "query": q,
+            "chat_id": chat_id,
+            "total": result["total"],
+            "limit": limit,
+            "offset": offset,
+            "items": result["items"]
+        })
+        
+    except Exception as e:
+        bot_logger.error(f"Search failed: {e}")
+        raise HTTPException(status_code=500, detail="Search failed")
+
+# Потоковый экспорт
+@app.get("/api/export/chat/{chat_id}")
+async def export_chat(
+    chat_id: int,
+    format: str = "ndjson",
+    gzip: bool = False,
+    token: str = Depends(verify_admin_token)
+):
+    """Экспорт истории чата потоком (память не растёт с размером экспорта)."""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    
+    media_type = EXPORT_FORMATS[format][0]
+    chunks = iter_export(chat_id, format)
+    if gzip:
+        chunks = gzip_chunks(chunks)
+        media_type = "application/gzip"
+    
+    filename = export_filename(chat_id, format, gzip)
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 # Аналитика и отчеты
 @app.get("/analytics", response_class=HTMLResponse)
 async def analytics_page(request: Request, token: str = Depends(verify_admin_token)):
@@ -223,11 +301,12 @@ async def analytics_page(request: Request, token: str = Depends(verify_admin_tok
 
 @app.get("/api/analytics/global")
 async def get_global_analytics(
+    request: Request,
     period: str = "7d",
     token: str = Depends(verify_admin_token)
 ):
     """Глобальная аналитика за период."""
-    try:
+    async def build():
         # Парсим период
         if period == "24h":
             hours = 24
@@ -238,13 +317,19 @@ async def get_global_analytics(
         else:
             hours = 24 * 7
         
-        analytics = analytics_engine.get_global_analytics_period(hours)
+        # Синхронные запросы к SQLite – в потоке, чтобы промах кэша не блокировал event loop
+        analytics = await asyncio.to_thread(analytics_engine.get_global_analytics_period, hours)
         
-        return JSONResponse({
+        return {
             "period": period,
             "analytics": analytics.__dict__,
             "generated_at": datetime.now().isoformat()
-        })
+        }
+    
+    try:
+        data = await database_service.data_version()
+        version = (data["version"], time_bucket(ANALYTICS_BUCKET_SEC))
+        return await response_cache.respond(request, version, build)
         
     except Exception as e:
         bot_logger.error(f"Failed to get global analytics: {e}")
@@ -252,56 +337,81 @@ async def get_global_analytics(
 
 @app.get("/api/analytics/chat/{chat_id}")
 async def get_chat_analytics(
+    request: Request,
     chat_id: int,
     period: str = "7d",
     token: str = Depends(verify_admin_token)
 ):
     """Аналитика конкретного чата."""
-    try:
-        analytics = analytics_engine.get_chat_analytics_period(chat_id, period)
+    async def build():
+        analytics = await asyncio.to_thread(analytics_engine.get_chat_analytics_period, chat_id, period)
+        if analytics is None:
+            raise HTTPException(status_code=404, detail="Chat not found")
         
-        return JSONResponse({
+        return {
             "chat_id": chat_id,
             "period": period,
             "analytics": analytics.__dict__,
             "generated_at": datetime.now().isoformat()
-        })
+        }
+    
+    try:
+        data = await database_service.data_version(chat_id)
+        version = (data["version"], time_bucket(ANALYTICS_BUCKET_SEC))
+        return await response_cache.respond(request, version, build)
         
+    except HTTPException:
+        raise
     except Exception as e:
         bot_logger.error(f"Failed to get chat analytics: {e}")
         raise HTTPException(status_code=500, detail="Chat analytics generation failed")
 
 @app.post("/api/reports/generate")
 async def generate_report(
-    background_tasks: BackgroundTasks,
     report_type: str = "global",
     format: str = "json",
     period: str = "7d",
+    chat_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    gzip: bool = False,
     token: str = Depends(verify_admin_token)
 ):
-    """Генерация отчета в фоновом режиме."""
+    """Генерация отчета в фоновом режиме (повторный запрос с теми же параметрами отдаёт готовый)."""
     try:
-        # Запускаем генерацию отчета в фоне
-        task_id = f"report_{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        
-        background_tasks.add_task(
-            report_generator.generate_report_async,
-            task_id,
-            report_type,
-            format,
-            period
-        )
+        job = await report_jobs.submit(report_type, format, period, chat_id, user_id, gzip)
         
         return JSONResponse({
             "success": True,
-            "task_id": task_id,
-            "message": "Отчет генерируется в фоновом режиме"
+            "task_id": job["task_id"],
+            "status": job["status"],
+            "cached": job["cached"],
+            "message": "Отчет генерируется в фоновом режиме" if not job["ready"] else "Отчет уже готов"
         })
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         bot_logger.error(f"Failed to start report generation: {e}")
         raise HTTPException(status_code=500, detail="Report generation failed")
 
+@app.get("/api/reports/{task_id}")
+async def get_report_status(task_id: str, token: str = Depends(verify_admin_token)):
+    """Статус и прогресс фоновой задачи отчета."""
+    job = report_jobs.get(task_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    if job["ready"]:
+        job["download_url"] = f"/api/reports/{task_id}/download"
+    return JSONResponse(job)
+
+@app.get("/api/reports/{task_id}/download")
+async def download_report(task_id: str, token: str = Depends(verify_admin_token)):
+    """Скачивание готового отчета."""
+    path = report_jobs.result_path(task_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Report is not ready or has expired")
+    return FileResponse(path, filename=os.path.basename(path))
+
 # Системная информация
 @app.get("/api/system/info")
 async def get_system_info(token: str = Depends(verify_admin_token)):
@@ -325,7 +435,11 @@ async def get_system_info(token: str = Depends(verify_admin_token)):
                 "percent": psutil.disk_usage('/').percent
             },
             "bot_uptime": bot_metrics.get_uptime(),
-            "cache_stats": memory_cache.get_stats()
+            "cache_stats": memory_cache.get_stats(),
+            "response_cache": response_cache.get_stats(),
+            "vision_cache": vision_service.get_stats(),
+            "rate_limiter": rate_limiter.get_stats(),
+            "bans": ban_list.get_stats()
         }
         
         return JSONResponse(system_info)
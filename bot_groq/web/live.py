@@ -0,0 +1,153 @@
+"""
+Живая лента метрик дашборда (Server-Sent Events).
+
+Один фоновый продюсер раз в settings.live_feed_interval секунд считает снимок
+метрик и раздаёт его всем подписчикам, поэтому нагрузка на БД не зависит от
+числа открытых вкладок. Новый подписчик сначала получает полный снимок
+(event: snapshot), дальше – только изменившиеся поля (event: delta).
+Продюсер работает, пока есть хотя бы один подписчик.
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+from bot_groq.config.settings import settings
+from bot_groq.utils.logging import core_logger
+
+SUBSCRIBER_QUEUE_SIZE = 16
+
+def diff_snapshot(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Изменившиеся поля new относительно old (вложенные словари – тоже по полям)."""
+    delta = {}
+    for key, value in new.items():
+        prev = old.get(key)
+        if isinstance(value, dict) and isinstance(prev, dict):
+            nested = diff_snapshot(prev, value)
+            if nested:
+                delta[key] = nested
+        elif value != prev:
+            delta[key] = value
+    return delta
+
+def format_event(event: str, data: Dict[str, Any], event_id: Optional[int] = None) -> bytes:
+    """Кадр SSE."""
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n".encode("utf-8")
+
+def _rounded(value: Any) -> Any:
+    # Без округления float-метрики «меняются» каждый тик и раздувают дельты
+    if isinstance(value, float):
+        return round(value, 3)
+    if isinstance(value, dict):
+        return {k: _rounded(v) for k, v in value.items()}
+    return value
+
+async def collect_snapshot() -> Dict[str, Any]:
+    """Снимок метрик дашборда (то же, что отдаёт /api/stats/realtime)."""
+    from bot_groq.services.analytics import analytics_engine
+    from bot_groq.services.db_service import database_service
+    from bot_groq.utils.cache import cache
+    from bot_groq.utils.logging import bot_metrics
+
+    bot_stats = bot_metrics.get_stats()
+    return _rounded({
+        "bot_metrics": bot_stats,
+        "active_chats": await database_service.count_active_chats(),
+        "messages_today": await asyncio.to_thread(analytics_engine.get_messages_count_today),
+        "llm_requests": bot_stats["llm_requests"],
+        "cache_hit_rate": cache.get_stats()["hit_rate"],
+    })
+
+class LiveFeed:
+    """Один продюсер снимков метрик и их раздача подписчикам с дельта-кодированием."""
+
+    def __init__(self):
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._producer: Optional[asyncio.Task] = None
+        self._refresh_lock = asyncio.Lock()
+        self.snapshot: Dict[str, Any] = {}
+        self.seq = 0
+        self.updated_ts = 0.0
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    async def latest(self) -> Dict[str, Any]:
+        """Последний снимок; если продюсер не работает или снимок устарел – считаем новый."""
+        async with self._refresh_lock:
+            # Одновременные запросы ждут один пересчёт, а не запускают свои
+            if not self.snapshot or time.time() - self.updated_ts > settings.live_feed_interval:
+                self._publish(await collect_snapshot())
+        return self.snapshot
+
+    def _envelope(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        return {"seq": self.seq, "ts": self.updated_ts, "data": data}
+
+    def _publish(self, snapshot: Dict[str, Any]):
+        delta = diff_snapshot(self.snapshot, snapshot)
+        self.snapshot = snapshot
+        self.updated_ts = time.time()
+        if not delta:
+            return
+        self.seq += 1
+        frame = ("delta", self._envelope(delta))
+        for queue in self._subscribers:
+            try:
+                queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # Медленный клиент: выбрасываем его очередь и шлём полный снимок
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(("snapshot", self._envelope(self.snapshot)))
+
+    async def _produce(self):
+        try:
+            while self._subscribers:
+                try:
+                    async with self._refresh_lock:
+                        self._publish(await collect_snapshot())
+                except Exception as e:
+                    core_logger.log_error(e, {"operation": "live_feed_snapshot"})
+                await asyncio.sleep(settings.live_feed_interval)
+        finally:
+            self._producer = None
+
+    def _ensure_producer(self):
+        if self._producer is None or self._producer.done():
+            self._producer = asyncio.create_task(self._produce())
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        """Поток кадров SSE для одного клиента."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        await self.latest()
+        self._subscribers.add(queue)
+        self._ensure_producer()
+        try:
+            yield f"retry: {int(settings.live_feed_interval * 1000) * 2}\n\n".encode("utf-8")
+            yield format_event("snapshot", self._envelope(self.snapshot), self.seq)
+            while True:
+                try:
+                    event, payload = await asyncio.wait_for(queue.get(), timeout=settings.live_feed_keepalive)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                yield format_event(event, payload, payload["seq"])
+        finally:
+            self._subscribers.discard(queue)
+
+    async def stop(self):
+        """Останавливает продюсер (shutdown веб-приложения)."""
+        self._subscribers.clear()
+        if self._producer is not None:
+            self._producer.cancel()
+            try:
+                await self._producer
+            except asyncio.CancelledError:
+                pass
+            self._producer = None
+
+# Глобальный экземпляр
+live_feed = LiveFeed()
@@ -0,0 +1,102 @@
+"""
+Условные ответы и кэш сериализованного JSON для API веб-панели.
+
+ETag считается не по телу ответа, а по версии данных (число и last_ts
+сообщений, время смены режима, баны – DatabaseService.data_version) плюс
+параметры запроса. Если версия не изменилась, клиент с If-None-Match
+получает 304 без пересчёта, а остальные – готовые байты из кэша без повторной
+сериализации. JSON кодируется orjson, если он установлен.
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CACHE_CONTROL = "private, no-cache"
+
+def dumps(obj: Any) -> bytes:
+    """JSON в байты (orjson, если есть)."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, default=str, separators=(",", ":")).encode("utf-8")
+
+def time_bucket(seconds: int) -> int:
+    """Номер текущего интервала длиной seconds – для ответов, зависящих от «окна» времени."""
+    return int(time.time() // seconds)
+
+def request_key(request: Request) -> str:
+    """Ключ кэша: путь и параметры запроса (без учёта их порядка)."""
+    return request.url.path + "?" + "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+
+def _not_modified(request: Request, etag: str, last_modified: Optional[float]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*"
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+class ResponseCache:
+    """LRU-кэш тел JSON-ответов по ключу запроса и версии данных."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    async def respond(self, request: Request, version: Any, build: Callable[[], Awaitable[Any]],
+                      last_modified: Optional[float] = None) -> Response:
+        """Ответ на GET: 304, закэшированные байты или build() с сохранением в кэш."""
+        key = request_key(request)
+        # Слабый ETag: одна версия данных, но тело может отличаться (generated_at)
+        etag = 'W/"' + hashlib.blake2b(repr((key, version)).encode("utf-8"), digest_size=12).hexdigest() + '"'
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+        if last_modified:
+            headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+
+        if _not_modified(request, etag, last_modified):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+
+        cached = self._entries.get(key)
+        if cached is not None and cached[0] == etag:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            body = cached[1]
+        else:
+            self.misses += 1
+            body = dumps(await build())
+            self._entries[key] = (etag, body)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика кэша ответов."""
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+        }
+
+# Глобальный экземпляр
+response_cache = ResponseCache()
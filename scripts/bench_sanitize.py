@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Микро-бенчмарк обработки ответов LLM (sanitize_reply).
+
+Меряет стоимость одного ответа на типичных репликах и падает с кодом 1,
+если она выше бюджета – чтобы регрессии в регексах не проходили незаметно.
+Запуск из корня репозитория: python -m scripts.bench_sanitize [--max-us 150] [--number 2000]
+Эквивалентность прежней обработке на SAMPLES проверяет tests/test_sanitize.py.
+"""
+import argparse
+import sys
+import timeit
+
+from bot_groq.services.llm import sanitize_reply
+from bot_groq.utils.filters import filter_bot_response, safe_filter_text
+
+SAMPLES = [
+    "Ну ты и @vasya, как модель скажу честно: твой план – фигня.",
+    "Sorry, I can't help with that.\nНо вообще ты сам виноват, {имя}.",
+    "I'm sorry, but as an AI language model I cannot comply.\nЛадно, держи: иди работай.",
+    "Обычный короткий ответ без мусора.",
+    "Твой датасет   кривой,  а температура   ответа тут ни при чём.\n\n\n\nИ токены тоже.",
+    ("Длинный ответ. " * 40).strip(),
+]
+
+def bench(func, number: int) -> float:
+    """Среднее время одного вызова на SAMPLES (микросекунды)."""
+    total = timeit.timeit(lambda: [func(s) for s in SAMPLES], number=number)
+    return total / (number * len(SAMPLES)) * 1e6
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=2000, help="Повторов набора реплик")
+    parser.add_argument("--max-us", type=float, default=150.0, help="Бюджет sanitize_reply на один ответ (мкс)")
+    args = parser.parse_args()
+
+    results = {
+        "sanitize_reply": bench(sanitize_reply, args.number),
+        "filter_bot_response": bench(filter_bot_response, args.number),
+        "safe_filter_text": bench(safe_filter_text, args.number),
+    }
+    for name, us in results.items():
+        print(f"{name:<20} {us:8.1f} мкс/ответ")
+
+    if results["sanitize_reply"] > args.max_us:
+        print(f"❌ sanitize_reply дороже бюджета {args.max_us:.0f} мкс")
+        return 1
+    print(f"✅ sanitize_reply в бюджете {args.max_us:.0f} мкс")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
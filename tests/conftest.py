@@ -0,0 +1,23 @@
+"""Общие фикстуры: отдельная SQLite-база на каждый тест."""
+
+import pytest
+
+from bot_groq.config.settings import settings
+from bot_groq.services import database
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Пустая инициализированная база во временном каталоге; возвращает модуль database."""
+    monkeypatch.setattr(settings, "db_name", str(tmp_path / "bot.db"))
+    monkeypatch.setattr(database, "_activity_listeners", [])
+    database.initialize_database()
+    return database
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Управляемое time.time() для записи сообщений «в прошлом»: clock.now = ts."""
+    class Clock:
+        now = 1_700_000_000.0
+    c = Clock()
+    monkeypatch.setattr(database.time, "time", lambda: c.now)
+    return c
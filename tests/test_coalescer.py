@@ -0,0 +1,61 @@
+"""Склейка пачек сообщений: когда ответ считается устаревшим."""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from bot_groq.config.settings import settings
+from bot_groq.core import coalescer as coalescer_module
+from bot_groq.core.coalescer import MessageCoalescer
+
+@pytest.fixture(autouse=True)
+def short_window(monkeypatch):
+    monkeypatch.setattr(settings, "coalesce_window_sec", 0.01)
+    monkeypatch.setattr(settings, "coalesce_max_window_sec", 0.01)
+
+def _msg(chat_id: int = 1):
+    return SimpleNamespace(chat=SimpleNamespace(id=chat_id))
+
+def test_unrelated_message_during_generation_keeps_reply():
+    async def scenario():
+        c = MessageCoalescer()
+        burst = await c.collect(_msg(), "direct_mention")
+        assert burst is not None
+        # Пока генерируется ответ на упоминание, в чат пишут без повода; окно закрывается
+        assert await c.collect(_msg(), None) is None
+        assert not c.is_stale(burst)
+    asyncio.run(scenario())
+
+def test_newer_answering_burst_makes_reply_stale():
+    async def scenario():
+        c = MessageCoalescer()
+        first = await c.collect(_msg(), "direct_mention")
+        second = await c.collect(_msg(), "reply_to_bot")
+        assert second is not None
+        assert c.is_stale(first)
+        assert not c.is_stale(second)
+    asyncio.run(scenario())
+
+def test_stale_messages_join_pending_burst():
+    async def scenario():
+        c = MessageCoalescer()
+        first = await c.collect(_msg(), "direct_mention")
+        pending = asyncio.ensure_future(c.collect(_msg(), "keyword_trigger"))
+        await asyncio.sleep(0)  # новое сообщение с поводом ещё копится
+        assert c.is_stale(first)
+        c.drop_stale(first)
+        second = await pending
+        assert second.messages[:len(first.messages)] == first.messages
+        assert second.reason == "direct_mention"
+    asyncio.run(scenario())
+
+def test_idle_chat_states_are_evicted():
+    async def scenario():
+        c = MessageCoalescer()
+        await c.collect(_msg(1), None)
+        await c.collect(_msg(2), "direct_mention")
+        c._evict_idle(time.time() + coalescer_module.IDLE_STATE_TTL + 1)
+        assert c.get_stats()["tracked_chats"] == 0
+    asyncio.run(scenario())
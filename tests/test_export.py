@@ -0,0 +1,44 @@
+"""Экспорт истории: keyset-пачки db_iter_chat_history на границах страниц."""
+
+import pytest
+
+def _write(db, clock, chat_id, texts, ts):
+    clock.now = ts
+    for text in texts:
+        db.log_chat_event(chat_id=chat_id, user_id=1, text=text)
+
+def _flat(pages):
+    return [(row["chat_id"], row["content"]) for page in pages for row in page]
+
+@pytest.mark.parametrize("count,batch", [(6, 3), (7, 3), (2, 3), (3, 1)])
+def test_pages_cover_chat_exactly_once(db, clock, count, batch):
+    _write(db, clock, 1, [f"m{i}" for i in range(count)], clock.now)
+    pages = list(db.db_iter_chat_history(1, batch_size=batch))
+    # Одинаковый ts у всех строк: порядок и граница страницы держатся на rowid
+    assert _flat(pages) == [(1, f"m{i}") for i in range(count)]
+    assert [len(p) for p in pages[:-1]] == [batch] * (len(pages) - 1)
+    assert 0 < len(pages[-1]) <= batch
+
+def test_pages_across_chats_follow_chat_then_time(db, clock):
+    start = clock.now
+    _write(db, clock, 20, ["b-late"], start + 10)
+    _write(db, clock, 10, ["a-1", "a-2"], start + 5)
+    _write(db, clock, 20, ["b-early"], start)
+    _write(db, clock, 10, ["a-0"], start)
+
+    pages = list(db.db_iter_chat_history(batch_size=2))
+    assert _flat(pages) == [(10, "a-0"), (10, "a-1"), (10, "a-2"), (20, "b-early"), (20, "b-late")]
+    assert [len(p) for p in pages] == [2, 2, 1]
+    assert _flat(db.db_iter_chat_history(20, batch_size=1)) == [(20, "b-early"), (20, "b-late")]
+
+def test_rows_written_between_pages_are_not_repeated(db, clock):
+    _write(db, clock, 1, ["m0", "m1", "m2"], clock.now)
+    pages = db.db_iter_chat_history(1, batch_size=2)
+    first = next(pages)
+    _write(db, clock, 1, ["m3"], clock.now + 1)
+    rest = list(pages)
+    assert _flat([first] + rest) == [(1, "m0"), (1, "m1"), (1, "m2"), (1, "m3")]
+
+def test_empty_history_yields_nothing(db):
+    assert list(db.db_iter_chat_history(batch_size=10)) == []
+    assert db.db_count_chat_history() == 0
@@ -0,0 +1,107 @@
+"""Ограничение частоты: GCRA-лимитер и middleware, которое пропускает только ответ."""
+
+import asyncio
+from datetime import datetime
+
+import pytest
+from aiogram.types import Chat, Message, User
+
+from bot_groq.config.settings import settings
+from bot_groq.handlers import middleware as middleware_module
+from bot_groq.handlers.middleware import RateLimitMiddleware
+from bot_groq.utils import filters as filters_module
+from bot_groq.utils.filters import RateLimiter
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Управляемое time.monotonic() лимитера: clock.now += секунды."""
+    class Clock:
+        now = 1000.0
+    c = Clock()
+    monkeypatch.setattr(filters_module.time, "monotonic", lambda: c.now)
+    return c
+
+def test_burst_up_to_limit_then_reject(clock):
+    limiter = RateLimiter(user_limit=3, chat_limit=100, window=60.0, max_keys=10)
+    assert [limiter.is_allowed(1, 1)[0] for _ in range(3)] == [True, True, True]
+    allowed, reason = limiter.is_allowed(1, 1)
+    assert not allowed
+    assert "3/мин" in reason
+    assert limiter.get_stats()["rejected"] == 1
+
+def test_refill_one_request_per_interval(clock):
+    limiter = RateLimiter(user_limit=3, chat_limit=100, window=60.0, max_keys=10)
+    for _ in range(3):
+        limiter.is_allowed(1, 1)
+    # Отказ не списывает из «ведра»: через window/limit секунд ровно один запрос
+    assert not limiter.is_allowed(1, 1)[0]
+    clock.now += 19.9
+    assert not limiter.is_allowed(1, 1)[0]
+    clock.now += 0.1
+    assert limiter.is_allowed(1, 1)[0]
+    assert not limiter.is_allowed(1, 1)[0]
+    # За полное окно тишины ведро снова полное, но не больше лимита
+    clock.now += 600
+    assert [limiter.is_allowed(1, 1)[0] for _ in range(4)] == [True, True, True, False]
+
+def test_chat_limit_does_not_charge_user(clock):
+    limiter = RateLimiter(user_limit=2, chat_limit=2, window=60.0, max_keys=10)
+    assert limiter.is_allowed(1, 7)[0]
+    assert limiter.is_allowed(2, 7)[0]
+    allowed, reason = limiter.is_allowed(1, 7)
+    assert not allowed and "чата" in reason
+    # Отказ по чату не израсходовал лимит пользователя в другом чате
+    assert [limiter.is_allowed(1, 8)[0] for _ in range(2)] == [True, False]
+
+def test_lru_evicts_least_recently_seen_keys(clock):
+    limiter = RateLimiter(user_limit=1, chat_limit=100, window=60.0, max_keys=2)
+    limiter.is_allowed(1, 1)
+    limiter.is_allowed(2, 1)
+    assert not limiter.is_allowed(1, 1)[0]   # отказ не обновляет позицию в LRU
+    limiter.is_allowed(3, 1)
+    assert list(limiter.user_tat) == [2, 3]
+    assert len(limiter.chat_tat) == 1
+    # Вытесненный ключ начинает с полного ведра
+    assert limiter.is_allowed(1, 1)[0]
+    assert list(limiter.user_tat) == [3, 1]
+
+def _message(user_id: int = 42, chat_id: int = -100) -> Message:
+    return Message(message_id=1, date=datetime.now(), text="привет",
+                   chat=Chat(id=chat_id, type="group"),
+                   from_user=User(id=user_id, is_bot=False, first_name="Тест"))
+
+@pytest.fixture
+def limited(monkeypatch):
+    """Middleware с лимитером на одно сообщение в минуту."""
+    limiter = RateLimiter(user_limit=1, chat_limit=100, window=60.0, max_keys=10)
+    monkeypatch.setattr(settings, "rate_limit_enabled", True)
+    monkeypatch.setattr(settings, "admin_ids", set())
+    monkeypatch.setattr(middleware_module, "check_rate_limit", limiter.is_allowed)
+    return limiter
+
+def _run(mw: RateLimitMiddleware, count: int):
+    """Прогоняет count сообщений подряд: (результаты middleware, флаги rate_limited в хендлере)."""
+    flags = []
+    async def handler(event, data):
+        flags.append(data["rate_limited"])
+        return "handled"
+    async def scenario():
+        return [await mw(handler, _message(), {}) for _ in range(count)]
+    return asyncio.run(scenario()), flags
+
+def test_middleware_drop_skips_handler(limited):
+    results, flags = _run(RateLimitMiddleware(drop=True), 2)
+    assert results == ["handled", None]
+    assert flags == [False]
+
+def test_middleware_flag_keeps_handler(limited):
+    # Сообщение доходит до хендлера (история, профиль), пропускается только ответ
+    results, flags = _run(RateLimitMiddleware(drop=False), 2)
+    assert results == ["handled", "handled"]
+    assert flags == [False, True]
+
+def test_admins_are_not_limited(limited, monkeypatch):
+    monkeypatch.setattr(settings, "admin_ids", {42})
+    results, flags = _run(RateLimitMiddleware(drop=True), 3)
+    assert results == ["handled"] * 3
+    assert flags == [False] * 3
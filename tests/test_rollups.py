@@ -0,0 +1,58 @@
+"""Роллапы статистики: сжатие почасовых строк в суточные."""
+
+from contextlib import closing
+
+DAY = 24 * 3600
+
+def _fill(db, clock) -> float:
+    """Две пачки сообщений: пятидневной давности (под сжатие) и часовой; возвращает «сейчас».
+
+    «Сейчас» – полдень, чтобы пачки не пересекали границу суток в любом часовом поясе.
+    """
+    now = db._day_start(clock.now) + 12 * 3600
+    for ts, user_id, text in [
+        (now - 5 * DAY, 1, "раз"),
+        (now - 5 * DAY + 60, 1, "два"),
+        (now - 5 * DAY + 120, 2, "три"),
+        (now - 5 * DAY + 7200, 2, "четыре"),
+        (now - 3600, 1, "свежее"),
+    ]:
+        clock.now = ts
+        db.log_chat_event(chat_id=10, user_id=user_id, text=text)
+    clock.now = now - 5 * DAY + 180
+    db.log_chat_event(chat_id=10, text="ответ бота", is_bot=True)
+    clock.now = now
+    return now
+
+def _table(db, name):
+    with closing(db.get_db_connection()) as conn:
+        return sorted(conn.execute(f"SELECT * FROM {name}").fetchall())
+
+def test_compaction_is_idempotent_and_keeps_period_totals(db, clock):
+    now = _fill(db, clock)
+    before = db.db_get_rollup_period(now - 10 * DAY)
+
+    assert db.db_compact_rollups(retention_hours=48, now=now) == 4
+    hourly, daily = _table(db, "chat_stats_hourly"), _table(db, "chat_stats_daily")
+    # Повторное сжатие ничего не меняет и не удваивает суточные счётчики
+    assert db.db_compact_rollups(retention_hours=48, now=now) == 0
+    assert _table(db, "chat_stats_hourly") == hourly
+    assert _table(db, "chat_stats_daily") == daily
+
+    after = db.db_get_rollup_period(now - 10 * DAY)
+    assert after == before
+    assert after["message_count"] == 6
+    assert after["user_count"] == 2
+    assert after["top_users"] == [(1, 3), (2, 2)]
+
+def test_compaction_aligns_on_local_day(db, clock):
+    now = _fill(db, clock)
+    db.db_compact_rollups(retention_hours=48, now=now)
+
+    old_day = db._day_start(now - 5 * DAY)
+    daily = _table(db, "chat_stats_daily")
+    assert {row[2] for row in daily} == {old_day}
+    assert sum(row[3] for row in daily) == 5
+    # Почасовые строки остались только у суток, не вошедших в сжатие
+    cutoff = db._day_start(now - 48 * 3600)
+    assert all(row[2] >= cutoff for row in _table(db, "chat_stats_hourly"))
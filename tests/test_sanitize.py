@@ -0,0 +1,69 @@
+"""Обработка ответов LLM: результат совпадает с прежней реализацией на репликах бенчмарка."""
+
+import pytest
+
+from bot_groq.services.llm import sanitize_reply
+from bot_groq.utils.filters import ThreatLevel, filter_bot_response, safe_filter_text, text_filter
+from scripts.bench_sanitize import SAMPLES
+
+# Выход прежней цепочки post_filter(clean_reply(text)) и прежнего filter_llm_response
+# (с перекомпиляцией регексов на каждый вызов) на тех же SAMPLES
+BASELINE_SANITIZED = [
+    "Ну ты и ,",
+    "Но вообще ты сам виноват, .",
+    "Ладно, держи: иди работай.",
+    "Обычный короткий ответ без мусора.",
+    "Твой   кривой,  а   ответа тут ни при чём.  И  тоже.",
+    SAMPLES[5],
+]
+BASELINE_BOT_RESPONSE = [
+    "Ну ты и @vasya, как модель скажу честно: твой план – фигня.",
+    "Sorry, I can't help with that. Но вообще ты сам виноват, {имя}.",
+    "I'm sorry, but as an AI language model I cannot comply. Ладно, держи: иди работай.",
+    "Обычный короткий ответ без мусора.",
+    "Твой датасет кривой, а температура ответа тут ни при чём. И токены тоже.",
+    SAMPLES[5],
+]
+
+EXTRA_TEXTS = [
+    "Пиши на vasya@mail.ru или звони 123-456-7890, купи скидка!",
+    "Я искусственный интеллект, мои алгоритмы говорят: умри, фашист.",
+    "#реклама www.example.com @bot",
+]
+
+def _baseline_violations(text: str) -> list:
+    """Прежний analyze_text: отдельный search на каждую категорию."""
+    checks = [
+        ("spam_content", text_filter.spam_re),
+        ("personal_data", text_filter.personal_data_re),
+        ("hate_speech", text_filter.hate_speech_re),
+        ("llm_leak", text_filter.llm_leak_re),
+    ]
+    return [name for name, pattern in checks if pattern.search(text)]
+
+@pytest.mark.parametrize("text,expected", list(zip(SAMPLES, BASELINE_SANITIZED)))
+def test_sanitize_reply_matches_baseline(text, expected):
+    assert sanitize_reply(text) == expected
+
+@pytest.mark.parametrize("text,expected", list(zip(SAMPLES, BASELINE_BOT_RESPONSE)))
+def test_filter_bot_response_matches_baseline(text, expected):
+    assert filter_bot_response(text) == expected
+
+@pytest.mark.parametrize("text", SAMPLES + EXTRA_TEXTS)
+def test_safe_filter_text_matches_per_category_search(text):
+    result = safe_filter_text(text)
+    assert result.violations == _baseline_violations(text)
+
+def test_safe_filter_text_ranks_threat_levels():
+    # Прежняя версия падала с TypeError на max() по Enum при первом же нарушении
+    result = safe_filter_text(SAMPLES[0])
+    assert result.violations == ["spam_content"]
+    assert result.threat_level is ThreatLevel.LOW
+    assert result.is_safe
+
+    result = safe_filter_text(EXTRA_TEXTS[1])
+    assert result.threat_level is ThreatLevel.CRITICAL
+    assert not result.is_safe
+
+def test_empty_reply_falls_back():
+    assert sanitize_reply("@vasya   ") == "По делу."
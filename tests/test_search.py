@@ -0,0 +1,61 @@
+"""Полнотекстовый поиск: FTS-индекс следует за chat_history и chat_memory."""
+
+from contextlib import closing
+
+def _hits(db, query, **kwargs):
+    found = db.db_search_messages(query, **kwargs)
+    assert found["total"] == len(found["items"])
+    return found["items"]
+
+def test_history_insert_update_delete_keep_index_in_sync(db):
+    db.log_chat_event(chat_id=1, user_id=7, text="Пойдём есть пельмени")
+    db.log_chat_event(chat_id=2, user_id=8, text="пельмени переоценены")
+
+    hits = _hits(db, "пельм")
+    assert {h["chat_id"] for h in hits} == {1, 2}
+    assert len(_hits(db, "пельмени", chat_id=1)) == 1
+    hit = _hits(db, "пойдём", chat_id=1)[0]
+    assert (hit["user_id"], hit["role"]) == (7, "user")
+    assert db.SNIPPET_OPEN + "Пойдем" + db.SNIPPET_CLOSE in hit["snippet"]
+
+    with closing(db.get_db_connection()) as conn:
+        conn.execute("UPDATE chat_history SET content='теперь вареники' WHERE chat_id='1'")
+        conn.commit()
+    assert {h["chat_id"] for h in _hits(db, "пельмени")} == {2}
+    assert [h["chat_id"] for h in _hits(db, "вареники")] == [1]
+
+    db.db_clear_history(2)
+    assert _hits(db, "пельмени") == []
+    assert [h["chat_id"] for h in _hits(db, "вареники")] == [1]
+
+def test_history_trim_removes_rows_from_index(db):
+    for i in range(205):
+        db.log_chat_event(chat_id=3, user_id=1, text=f"сообщение номер{i}")
+    # В истории чата хранится 200 последних сообщений – и в индексе тоже
+    assert db.db_search_messages("сообщение", chat_id=3, limit=1)["total"] == 200
+    assert _hits(db, "номер0") == []
+    assert len(_hits(db, "номер204")) == 1
+
+def test_memory_insert_delete_keep_index_in_sync(db):
+    db.mem_add_chat(4, "Ёжик любит яблоки")
+    assert [h["source"] for h in _hits(db, "ежик")] == ["memory"]
+    assert _hits(db, "ежик", source="history") == []
+
+    rowid = db.mem_list_chat(4)[0][0]
+    db.mem_del_chat(4, rowid)
+    assert _hits(db, "ежик") == []
+
+def test_rebuild_matches_trigger_maintained_index(db):
+    db.log_chat_event(chat_id=1, user_id=1, text="первая строка")
+    db.mem_add_chat(1, "вторая строка")
+    before = _hits(db, "строка")
+    db.db_rebuild_search_index()
+    assert _hits(db, "строка") == before
+    assert len(before) == 2
+
+def test_like_fallback_finds_substring(db):
+    db.log_chat_event(chat_id=1, user_id=1, text="Где мои пельмени?")
+    with closing(db.get_db_connection()) as conn:
+        found = db._search_messages_like(conn.cursor(), "мои пель", None, "all", 20, 0)
+    assert found["total"] == 1
+    assert found["items"][0]["snippet"] == "Где мои пельмени?"
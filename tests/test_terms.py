@@ -0,0 +1,92 @@
+"""Частоты слов: гарантии Space-Saving и однократный засев из истории."""
+
+import asyncio
+import random
+import threading
+from collections import Counter
+
+from bot_groq.core import terms as terms_module
+from bot_groq.core.terms import SpaceSaving, TermStats
+
+def _stream(seed: int = 7, n: int = 5000) -> list:
+    """Поток слов с «тяжёлым хвостом»: несколько частых и много редких."""
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(300)]
+    weights = [1.0 / (i + 1) for i in range(len(words))]
+    return rng.choices(words, weights=weights, k=n)
+
+def test_exact_below_capacity():
+    stream = _stream(n=500)[:200]
+    truth = Counter(stream)
+    sketch = SpaceSaving(capacity=len(truth))
+    for word in stream:
+        sketch.offer(word)
+    assert {t: c for t, (c, _e) in sketch.counts.items()} == dict(truth)
+    assert all(e == 0 for (_c, e) in sketch.counts.values())
+
+def test_error_bounds_over_capacity():
+    stream = _stream()
+    truth = Counter(stream)
+    capacity = 40
+    sketch = SpaceSaving(capacity)
+    for word in stream:
+        sketch.offer(word)
+
+    assert len(sketch.counts) == capacity
+    assert sketch.total == len(stream)
+    assert sum(c for (c, _e) in sketch.counts.values()) == len(stream)
+    for term, (count, error) in sketch.counts.items():
+        # Счёт – верхняя оценка, счёт минус ошибка – нижняя
+        assert count - error <= truth[term] <= count
+        assert error <= len(stream) // capacity
+    # Всё, что встречается чаще total/capacity, гарантированно отслеживается
+    for term, n in truth.items():
+        if n > len(stream) / capacity:
+            assert term in sketch.counts
+
+def test_roundtrip_keeps_counts_and_seed_mark():
+    sketch = SpaceSaving(8)
+    sketch.offer_many(Counter(_stream(n=300)))
+    sketch.seeded_ts = 123.5
+    restored = SpaceSaving.from_dict(sketch.snapshot(), capacity=99)
+    assert restored.capacity == 8
+    assert restored.counts == sketch.counts
+    assert restored.seeded_ts == 123.5
+    assert restored.top(3) == sketch.top(3)
+
+def test_concurrent_top_terms_seed_once(db, monkeypatch):
+    for text in ["котики котики собаки", "котики хомяки"]:
+        db.log_chat_event(chat_id=5, user_id=1, text=text)
+    calls = []
+    real = terms_module.db_get_chat_texts
+    def counting(*args, **kwargs):
+        calls.append(args)
+        return real(*args, **kwargs)
+    monkeypatch.setattr(terms_module, "db_get_chat_texts", counting)
+
+    stats = TermStats()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(stats.top_terms(5, k=3))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert results == [{"котики": 3, "собаки": 1, "хомяки": 1}] * 4
+    # Засев записан в БД: другой процесс историю уже не сканирует
+    assert TermStats().top_terms(5, k=1) == {"котики": 3}
+    assert len(calls) == 1
+
+def test_ingest_skips_messages_already_in_seed(db):
+    ts = db.log_chat_event(chat_id=6, user_id=2, text="пельмени пельмени")
+    stats = TermStats()
+    stats.top_terms(6)  # засев из истории уже учёл это сообщение
+
+    async def scenario():
+        await stats.ingest(6, 2, "пельмени пельмени", ts=ts)
+        await stats.ingest(6, 2, "пельмени вареники", ts=ts + 1)
+        stats._flush_task.cancel()
+    asyncio.run(scenario())
+
+    assert stats.top_terms(6, k=2) == {"пельмени": 3, "вареники": 1}
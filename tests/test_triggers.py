@@ -0,0 +1,48 @@
+"""Матчер триггеров: один проход, перекрывающиеся токены и границы слов."""
+
+import pytest
+
+from bot_groq.config.settings import settings
+from bot_groq.core.triggers import ADDRESS, KEYWORD, PROFANE, QUESTION, TriggerMatcher
+
+@pytest.fixture
+def matcher(monkeypatch):
+    monkeypatch.setattr(settings, "name_keywords", "леха,лёха,лех")
+    return TriggerMatcher()
+
+def test_overlapping_prefix_tokens_are_all_reported(matcher):
+    hits = matcher.scan("Лёха, привет")
+    # «лех» – префикс «леха», оба ключевых слова найдены за один проход
+    assert sorted(hits.keywords) == ["лех", "леха"]
+    assert hits.address_terms == ["леха"]
+    assert hits.categories == {KEYWORD, ADDRESS}
+
+def test_address_needs_word_boundary(matcher):
+    assert matcher.scan("работа не волк").address_terms == []
+    assert matcher.scan("эй, бот!").address_terms == ["бот"]
+
+def test_profanity_matches_substrings(matcher):
+    hits = matcher.scan("Ну ты и ДУРАК, идиотина")
+    assert sorted(hits.profanity) == ["дур", "идиот"]
+    assert PROFANE in hits.categories
+
+@pytest.mark.parametrize("text,question", [
+    ("бот, ты тут?", True),
+    ("бот\nа где все?", False),        # вопрос не в той строке, что имя
+    ("Что думаешь про это", True),
+    ("роботы? нет", False),           # имя бота только целым словом
+    ("", False),
+])
+def test_question_detection(matcher, text, question):
+    hits = matcher.scan(text)
+    assert hits.question is question
+    assert (QUESTION in hits.categories) is question
+
+def test_rebuilds_when_keywords_change(matcher, monkeypatch):
+    assert matcher.scan("саня здесь").keywords == []
+    rebuilds = matcher.rebuilds
+    monkeypatch.setattr(settings, "name_keywords", "саня")
+    assert matcher.scan("Саня здесь").keywords == ["саня"]
+    assert matcher.rebuilds == rebuilds + 1
+    matcher.scan("саня опять")
+    assert matcher.rebuilds == rebuilds + 1
@@ -0,0 +1,58 @@
+"""Предохранитель vision-моделей: closed -> open -> half_open с одной пробой."""
+
+import pytest
+
+from bot_groq.services import vision as vision_module
+from bot_groq.services.vision import CircuitBreaker
+
+@pytest.fixture
+def clock(monkeypatch):
+    class Clock:
+        now = 1000.0
+    c = Clock()
+    monkeypatch.setattr(vision_module.time, "time", lambda: c.now)
+    return c
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=30)
+    breaker.record_failure()
+    breaker.record_success()  # успех обнуляет серию
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+def test_failed_probe_reopens_for_full_cooldown(clock):
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    clock.now += 31
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+
+def test_released_probe_can_be_retried(clock):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=10)
+    breaker.record_failure()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.release_probe()  # запрос отменили – исхода нет
+    assert breaker.state == "half_open"
+    assert breaker.allow()